@@ -1,93 +1,267 @@
+import os
+import atexit
+import asyncio
+import threading
+import multiprocessing
 import numpy as np
-import matplotlib.pyplot as plt
 import base64
 from PIL import Image
-import requests
+import httpx
 from io import BytesIO
-from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import http_utils
+
+# 出力画像の形式（"png" / "webp" / "none"＝座標だけ返す）と WebP の品質
+THUMBNAIL_OUTPUT_FORMAT = os.getenv("THUMBNAIL_OUTPUT_FORMAT", "png")
+THUMBNAIL_IMAGE_QUALITY = int(os.getenv("THUMBNAIL_IMAGE_QUALITY", "80"))
+OUTPUT_FORMATS = ("png", "webp", "none")
+
+LINE_COLOR = (255, 255, 0)
+
+# エッジ検出のしきい値（二次微分の大きさ）と、ピークとみなすエッジ密度の割合
+EDGE_THRESHOLD = 50
+EDGE_PEAK_RATIO = 0.2
+# エッジ検出に使う明度画像の幅（0 なら元のサイズのまま。縮小すると速いが線の位置は粗くなる）
+THUMBNAIL_ANALYSIS_WIDTH = int(os.getenv("THUMBNAIL_ANALYSIS_WIDTH", "0"))
+
+# 解析用のプロセス数（デフォルトは CPU コア数）
+THUMBNAIL_ANALYSIS_WORKERS = int(os.getenv("THUMBNAIL_ANALYSIS_WORKERS", str(os.cpu_count() or 1)))
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+_thread_buffers = threading.local()
+
 
 class AnalyzeThumbnail:
-    def __init__(self, thumbnail_url: str):
+    def __init__(self, thumbnail_url: str, output_format: str = None, quality: int = None):
+        """
+        :param output_format: "png" / "webp" / "none"（"none" は画像を作らず座標だけ返す）
+        :param quality: WebP の品質（0-100）。PNG は可逆なので圧縮レベルにだけ使う
+        """
         self.thumbnail_url = thumbnail_url
+        self.output_format = (output_format or THUMBNAIL_OUTPUT_FORMAT).lower()
+        if self.output_format not in OUTPUT_FORMATS:
+            raise ValueError(f"output_format は {OUTPUT_FORMATS} のいずれかを指定してください: {output_format}")
+        self.quality = THUMBNAIL_IMAGE_QUALITY if quality is None else quality
 
     def analyze(self):
         """ 指定されたURLの画像を取得し、エッジ検出して縦横比を分析し、処理後の画像も返す """
         try:
             # ✅ 画像を取得
-            response = requests.get(self.thumbnail_url, timeout=5)
+            response = http_utils.get_sync(self.thumbnail_url)
             response.raise_for_status()  # HTTPエラー処理
-            image = Image.open(BytesIO(response.content))
-            image_array = np.array(image)
-
-            # ✅ 明度を計算（RGBの平均を使用）
-            brightness = np.mean(image_array, axis=2)  # RGBの平均を計算
-
-            # ✅ 横方向（左右）の明暗変化を取得
-            gradient_x = np.abs(np.diff(brightness, axis=1))  # 横方向の一次微分
-            gradient_x_diff = np.abs(np.diff(gradient_x, axis=1))  # 横方向の二次微分
-
-            # ✅ しきい値処理
-            threshold = 50
-            edges_x = (gradient_x_diff > threshold).astype(np.uint8) * 255
-
-            # ✅ エッジ密度の計算
-            edge_density_x = np.sum(edges_x, axis=0)  # 縦方向のエッジ密度（青線用）
-
-            # ✅ ピーク検出の調整
-            peak_threshold_x = np.max(edge_density_x) * 0.2  # 20% に変更
-            peak_cols = np.where(edge_density_x > peak_threshold_x)[0]  # 縦方向のエッジ（青線用）
-
-            # ✅ 左端・右端から中央へスキャン
-            if len(peak_cols) > 1:
-                min_x = int(peak_cols[0])  # 左端のエッジ
-                max_x = int(peak_cols[-1])  # 右端のエッジ
-                peak_cols = [min_x, max_x]  # 修正後のエッジ
-
-            # ✅ 画像にラインを描画
-            output_image = image_array.copy()
-
-            # ✅ 青線（左右のエッジ検出）
-            for col in peak_cols:
-                output_image[:, col] = [255, 255, 0]  # 線を描画（左右ライン）
-
-            # ✅ Matplotlib で画像を描画
-            fig, ax = plt.subplots(figsize=(image_array.shape[1] / 100, image_array.shape[0] / 100))  # 元画像と同じ比率に調整
-            ax.imshow(output_image, aspect='auto')
-            ax.set_title("縦線を描画した画像")
-            ax.axis("off")
-
-            # ✅ Matplotlibの画像をBase64エンコード
-            buffer = BytesIO()
-            canvas = FigureCanvas(fig)
-            canvas.print_png(buffer)
-            buffer.seek(0)
-            encoded_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
-            plt.close(fig)  # メモリ解放
-
-            # ✅ 画像サイズ情報
-            width, height = int(image_array.shape[1]), int(image_array.shape[0])
-
-            # ✅ 縦横比の判定
-            vertical_height = height
-            vertical_width = max_x - min_x
-            orientation = "縦長" if vertical_height > vertical_width else "横長"
-
-            # ✅ **解析結果の出力（return はそのまま）**
-            result = {
-                "thumbnail_url": self.thumbnail_url,
-                "width": width,
-                "height": height,
-                "vertical_height": int(vertical_height),
-                "vertical_width": int(vertical_width),
-                "orientation": orientation,
-                "processed_image": f"data:image/png;base64,{encoded_image}"
-            }
-
-            print(f"解析結果: {result}")  # デバッグ用
-
-            return result
-
-        except requests.HTTPError as http_err:
+        except httpx.HTTPStatusError as http_err:
             return {"error": f"HTTPエラー: {http_err}"}
         except Exception as err:
             return {"error": f"解析中にエラーが発生しました: {err}"}
+        return analyze_image_bytes(response.content, self.thumbnail_url, self.output_format, self.quality)
+
+
+def analyze_image_bytes(image_bytes: bytes, thumbnail_url: str = None, output_format: str = None, quality: int = None,
+                        analysis_width: int = None) -> dict:
+    """
+    ダウンロード済みの画像をエッジ検出して縦横比を分析する。
+    モジュール直下の関数なので、ProcessPoolExecutor の別プロセスでも実行できる
+
+    :param analysis_width: この幅に縮小した明度画像でエッジを探す（0 / None なら THUMBNAIL_ANALYSIS_WIDTH）
+    """
+    output_format = (output_format or THUMBNAIL_OUTPUT_FORMAT).lower()
+    quality = THUMBNAIL_IMAGE_QUALITY if quality is None else quality
+    analysis_width = analysis_width or THUMBNAIL_ANALYSIS_WIDTH
+    try:
+        image = Image.open(BytesIO(image_bytes))
+
+        # ✅ 画像サイズ情報
+        width, height = image.size
+
+        # ✅ エッジ検出用の画像（デコードは1回だけ）。JPEG は RGB への色変換をさせず、線を描かないなら明度だけ、
+        # 描くなら YCbCr のままデコードして Y を明度に使う（Y は "L" でデコードした明度と同じ値なので、
+        # 出力形式によって検出位置は変わらない）。縮小は luminance_plane でどちらも同じ方法で行う
+        image.draft("L" if output_format == "none" else "YCbCr", image.size)
+        analysis_image = image.getchannel(0) if image.mode == "YCbCr" else image
+
+        # ✅ 明度（輝度）の画像を作る。どのモードの画像でも "L" に変換してから扱う
+        luminance, scale = luminance_plane(analysis_image, analysis_width)
+
+        # ✅ 縦方向のエッジ（左右の明暗変化が大きい列）を検出し、元画像の座標に戻す
+        peak_cols = [min(width - 1, int(col * scale)) for col in detect_vertical_edges(luminance)]
+
+        # ✅ 左端・右端から中央へスキャン（エッジが2本見つからなければ画像全体を1枠とみなす）
+        if len(peak_cols) > 1:
+            min_x = peak_cols[0]  # 左端のエッジ
+            max_x = peak_cols[-1]  # 右端のエッジ
+            peak_cols = [min_x, max_x]  # 修正後のエッジ
+        else:
+            min_x, max_x = 0, width
+            peak_cols = []
+
+        # ✅ 縦横比の判定
+        vertical_height = height
+        vertical_width = max_x - min_x
+        orientation = "縦長" if vertical_height > vertical_width else "横長"
+
+        # ✅ **解析結果の出力**
+        result = {
+            "thumbnail_url": thumbnail_url,
+            "width": width,
+            "height": height,
+            "vertical_height": int(vertical_height),
+            "vertical_width": int(vertical_width),
+            "orientation": orientation,
+            "edges": peak_cols,
+            "processed_image": None,
+        }
+        if output_format != "none":
+            result["processed_image"] = encode_image(draw_vertical_lines(image, peak_cols), output_format, quality)
+
+        print(f"解析結果: {dict(result, processed_image=bool(result['processed_image']))}")  # デバッグ用
+
+        return result
+
+    except Exception as err:
+        return {"error": f"解析中にエラーが発生しました: {err}"}
+
+
+def luminance_plane(image: Image.Image, analysis_width: int = 0) -> tuple:
+    """
+    画像を uint8 の明度の配列にする。analysis_width が元の幅より小さければ縮小する
+
+    :return: (明度の配列, 元画像の列 / 配列の列 の倍率)
+    """
+    gray = image if image.mode == "L" else image.convert("L")
+    if not 0 < analysis_width < gray.size[0]:
+        return np.asarray(gray), 1.0
+    factor = gray.size[0] / analysis_width
+    gray = gray.resize((analysis_width, max(1, round(gray.size[1] / factor))), Image.BILINEAR, reducing_gap=2.0)
+    return np.asarray(gray), factor
+
+
+def detect_vertical_edges(luminance: np.ndarray, threshold: int = EDGE_THRESHOLD, peak_ratio: float = EDGE_PEAK_RATIO) -> np.ndarray:
+    """
+    横方向の二次微分が threshold を超える画素を列ごとに数え、最大値の peak_ratio 倍を超える列を返す。
+    uint8 → int16 の整数演算だけで、作業用の配列は同じサイズの画像なら使い回す
+    """
+    height, width = luminance.shape
+    if width < 3:
+        return np.empty(0, dtype=np.intp)
+    first, second, mask = _edge_buffers(height, width)
+
+    # ✅ 横方向の一次微分・二次微分（絶対値）をバッファ上で計算
+    np.subtract(luminance[:, 1:], luminance[:, :-1], out=first, dtype=np.int16)
+    np.abs(first, out=first)
+    np.subtract(first[:, 1:], first[:, :-1], out=second)
+    np.abs(second, out=second)
+
+    # ✅ しきい値処理とエッジ密度（列ごとのエッジ画素数）
+    np.greater(second, threshold, out=mask)
+    edge_density_x = np.count_nonzero(mask, axis=0)
+
+    # ✅ ピーク検出
+    peak = edge_density_x.max()
+    if peak == 0:
+        return np.empty(0, dtype=np.intp)
+    return np.flatnonzero(edge_density_x > peak * peak_ratio)
+
+
+def _edge_buffers(height: int, width: int) -> tuple:
+    """
+    スレッドごとに作業用の配列を持ち、同じサイズの画像が続く間は使い回す
+    """
+    buffers = getattr(_thread_buffers, "edges", None)
+    if buffers is None or buffers[0].shape != (height, width - 1):
+        buffers = (
+            np.empty((height, width - 1), dtype=np.int16),
+            np.empty((height, width - 2), dtype=np.int16),
+            np.empty((height, width - 2), dtype=bool),
+        )
+        _thread_buffers.edges = buffers
+    return buffers
+
+
+def draw_vertical_lines(image: Image.Image, cols: list, color: tuple = LINE_COLOR) -> Image.Image:
+    """
+    RGB 画像に1ピクセル幅の縦線を描く（RGB 以外のモードは変換したコピーに描く）
+    """
+    output_image = image if image.mode == "RGB" else image.convert("RGB")
+    for col in cols:
+        output_image.paste(color, (col, 0, col + 1, output_image.size[1]))
+    return output_image
+
+
+def encode_image(image: Image.Image, output_format: str, quality: int) -> str:
+    """
+    画像を Pillow で PNG / WebP にエンコードし、data URL にする
+    """
+    buffer = BytesIO()
+    if output_format == "webp":
+        image.save(buffer, format="WEBP", quality=quality, method=4)
+    else:
+        # 品質 0-100 を PNG の圧縮レベル 9-1 に対応させる（高品質ほど速く・大きく）
+        image.save(buffer, format="PNG", compress_level=max(1, min(9, 9 - quality // 12)))
+    encoded_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:image/{output_format};base64,{encoded_image}"
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    解析用のプロセスプールを1つだけ作って使い回す（最初に使うときに起動する）
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # サーバーはスレッド（スレッドプール・SSH トンネル）を抱えているので fork ではなく forkserver で起動する
+            _process_pool = ProcessPoolExecutor(
+                max_workers=THUMBNAIL_ANALYSIS_WORKERS, mp_context=multiprocessing.get_context("forkserver")
+            )
+        return _process_pool
+
+
+def discard_process_pool(pool: ProcessPoolExecutor):
+    """
+    壊れたプール（子プロセスが異常終了した BrokenProcessPool）を捨て、次回 get_process_pool で作り直す
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def analyze_in_process_pool(image_bytes: bytes, thumbnail_url: str = None, output_format: str = None,
+                                  quality: int = None) -> dict:
+    """
+    analyze_image_bytes をプロセスプールで実行する。プールが壊れていたら作り直して1回だけやり直す
+    """
+    loop = asyncio.get_running_loop()
+    for attempt in range(2):
+        pool = get_process_pool()
+        try:
+            return await loop.run_in_executor(pool, analyze_image_bytes, image_bytes, thumbnail_url, output_format, quality)
+        except BrokenProcessPool:
+            print("サムネイル解析のプロセスプールが停止したため作り直します")
+            discard_process_pool(pool)
+            if attempt:
+                raise
+
+
+def shutdown_process_pool():
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def _reset_process_pool_after_fork():
+    """
+    親のプロセスプールは子プロセスからは使えないので、必要になったら作り直す
+    """
+    global _process_pool, _process_pool_lock
+    _process_pool_lock = threading.Lock()
+    _process_pool = None
+
+
+atexit.register(shutdown_process_pool)
+os.register_at_fork(after_in_child=_reset_process_pool_after_fork)
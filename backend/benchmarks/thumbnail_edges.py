@@ -0,0 +1,213 @@
+"""
+サムネイルのエッジ検出のベンチマーク（旧実装との比較）
+
+    python benchmarks/thumbnail_edges.py                       # 合成画像で比較
+    python benchmarks/thumbnail_edges.py --fixtures ./thumbs   # ディレクトリ内の画像で比較
+    python benchmarks/thumbnail_edges.py --format none --analysis-width 160
+
+1枚あたりの処理時間（スループット）と tracemalloc のピークメモリ、旧実装と検出位置が一致した割合を表示する。
+時間とメモリは、両方の実装が解析できた画像だけで比べる（旧実装が RGB 以外の画像で失敗した分は別に表示する）。
+また、出力形式 none（draft で縮小デコード）と png で検出位置が一致するかを確認し、ずれがあれば終了コード 1 で終わる。
+"""
+import os
+import sys
+import time
+import argparse
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from analyze_thumbnail import analyze_image_bytes, encode_image  # noqa: E402
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp")
+
+
+def legacy_analyze(image_bytes: bytes, output_format: str = "png", quality: int = 80, analysis_width: int = None) -> dict:
+    """
+    変更前の実装（float64 の明度と np.diff 2回、出力用に配列をコピー）。比較用にそのまま残す
+    """
+    image_array = np.array(Image.open(BytesIO(image_bytes)))
+    brightness = np.mean(image_array, axis=2)
+    gradient_x = np.abs(np.diff(brightness, axis=1))
+    gradient_x_diff = np.abs(np.diff(gradient_x, axis=1))
+    edges_x = (gradient_x_diff > 50).astype(np.uint8) * 255
+    edge_density_x = np.sum(edges_x, axis=0)
+    peak_cols = np.where(edge_density_x > np.max(edge_density_x) * 0.2)[0]
+    peak_cols = [int(peak_cols[0]), int(peak_cols[-1])] if len(peak_cols) > 1 else []
+
+    result = {"edges": peak_cols}
+    if output_format != "none":
+        output_image = image_array.copy()
+        for col in peak_cols:
+            output_image[:, col] = [255, 255, 0]
+        result["processed_image"] = encode_image(Image.fromarray(output_image), output_format, quality)
+    return result
+
+
+def current_analyze(image_bytes: bytes, output_format: str = "png", quality: int = 80, analysis_width: int = None) -> dict:
+    return analyze_image_bytes(image_bytes, None, output_format, quality, analysis_width)
+
+
+def synthetic_thumbnails(count: int, size: tuple = (480, 360), seed: int = 0) -> list:
+    """
+    ノイズの背景に、左右に帯（縦長動画の黒帯など）がある画像を色々なモードで作る
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    thumbnails = []
+    for index in range(count):
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        if index % 2 == 0:
+            # 縦長動画を横長の枠に入れたサムネイル（左右が黒帯）
+            left = int(rng.integers(width // 8, width // 3))
+            pixels[:, :left] = 0
+            pixels[:, width - left:] = 0
+        image = Image.fromarray(pixels)
+        mode, image_format = [("RGB", "JPEG"), ("RGB", "PNG"), ("L", "JPEG"), ("RGBA", "PNG"), ("P", "PNG")][index % 5]
+        buffer = BytesIO()
+        image.convert(mode).save(buffer, format=image_format)
+        thumbnails.append((f"synthetic_{index}_{mode}.{image_format.lower()}", buffer.getvalue()))
+    return thumbnails
+
+
+def load_fixtures(directory: str) -> list:
+    names = sorted(name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS))
+    thumbnails = []
+    for name in names:
+        with open(os.path.join(directory, name), "rb") as f:
+            thumbnails.append((name, f.read()))
+    return thumbnails
+
+
+def failures(analyze, thumbnails: list, **options) -> set:
+    """
+    解析に失敗した（例外、または error を返した）画像の名前。ウォームアップも兼ねる
+    """
+    failed = set()
+    for name, image_bytes in thumbnails:
+        try:
+            if "error" in analyze(image_bytes, **options):
+                failed.add(name)
+        except Exception:
+            failed.add(name)
+    return failed
+
+
+def run(analyze, thumbnails: list, iterations: int, **options) -> dict:
+    """
+    全画像を iterations 回解析し、1枚あたりの時間・ピークメモリ・各画像の結果（最後の1回分）を返す
+    """
+    results = {}
+
+    def analyze_all():
+        for name, image_bytes in thumbnails:
+            try:
+                results[name] = analyze(image_bytes, **options)
+            except Exception as e:
+                results[name] = {"error": str(e)}
+
+    # 時間は tracemalloc なしで測る（割り当てのたびに記録するので、numpy を多く使う方が不利になる）
+    started = time.perf_counter()
+    for _ in range(iterations):
+        analyze_all()
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    analyze_all()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    processed = iterations * len(thumbnails)
+    return {
+        "ms_per_image": elapsed / processed * 1000,
+        "images_per_sec": processed / elapsed,
+        "peak_kib": peak / 1024,
+        "results": results,
+    }
+
+
+def check_format_consistency(thumbnails: list, analysis_width: int = 0) -> list:
+    """
+    同じ画像を none と png で解析し、検出位置がずれた画像の (名前, none の結果, png の結果) を返す
+    """
+    mismatches = []
+    for name, image_bytes in thumbnails:
+        none_result = current_analyze(image_bytes, "none", analysis_width=analysis_width)
+        png_result = current_analyze(image_bytes, "png", analysis_width=analysis_width)
+        if "error" in none_result or "error" in png_result:
+            if ("error" in none_result) != ("error" in png_result):
+                mismatches.append((name, none_result, png_result))
+            continue
+        if not _edges_match(none_result["edges"], png_result["edges"], _tolerance(png_result["width"], analysis_width)):
+            mismatches.append((name, none_result, png_result))
+    return mismatches
+
+
+def _tolerance(width: int, analysis_width: int) -> int:
+    """
+    縮小して解析した場合は、縮小後の2列（二次微分の幅）に相当するずれまで許容する
+    """
+    return max(2, 2 * -(-width // analysis_width)) if 0 < analysis_width < width else 2
+
+
+def _edges_match(a: list, b: list, tolerance: int) -> bool:
+    return len(a) == len(b) and all(abs(x - y) <= tolerance for x, y in zip(a, b))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fixtures", help="サムネイル画像のディレクトリ（省略時は合成画像）")
+    parser.add_argument("--count", type=int, default=50, help="合成画像の枚数")
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--format", default="png", choices=("png", "webp", "none"))
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument("--analysis-width", type=int, default=0, help="新実装で縮小して解析する幅（0 は縮小なし）")
+    args = parser.parse_args()
+
+    thumbnails = load_fixtures(args.fixtures) if args.fixtures else synthetic_thumbnails(args.count)
+    if not thumbnails:
+        sys.exit("画像がありません")
+    print(f"{len(thumbnails)} 枚 × {args.iterations} 回, format={args.format}, analysis_width={args.analysis_width}")
+
+    options = {"output_format": args.format, "quality": args.quality}
+    legacy_failed = failures(legacy_analyze, thumbnails, **options)
+    current_failed = failures(current_analyze, thumbnails, analysis_width=args.analysis_width, **options)
+    print(f"解析できなかった画像: legacy {len(legacy_failed)} 枚, current {len(current_failed)} 枚")
+    # 失敗はすぐ終わるので、両方が解析できた画像だけで速度とメモリを比べる
+    compared_thumbnails = [(name, data) for name, data in thumbnails if name not in legacy_failed | current_failed]
+    if not compared_thumbnails:
+        sys.exit("両方の実装で解析できた画像がありません")
+    legacy = run(legacy_analyze, compared_thumbnails, args.iterations, **options)
+    current = run(current_analyze, compared_thumbnails, args.iterations, analysis_width=args.analysis_width, **options)
+
+    print(f"比較した画像: {len(compared_thumbnails)} 枚")
+    for label, stats in (("legacy", legacy), ("current", current)):
+        print(f"{label:8s} {stats['ms_per_image']:8.2f} ms/枚 {stats['images_per_sec']:8.1f} 枚/秒 "
+              f"ピーク {stats['peak_kib']:9.1f} KiB")
+
+    # 両方が解析できた画像について、検出した線の位置がどれだけ一致したか（±2px。縮小時は縮小率の分も許容）
+    compared = matched = 0
+    for name, old in legacy["results"].items():
+        new = current["results"][name]
+        compared += 1
+        if _edges_match(old["edges"], new["edges"], _tolerance(new["width"], args.analysis_width)):
+            matched += 1
+    if compared:
+        print(f"検出位置の一致: {matched}/{compared} 枚")
+    print(f"速度 {legacy['ms_per_image'] / current['ms_per_image']:.2f} 倍, ピークメモリ {current['peak_kib'] / legacy['peak_kib']:.2f} 倍")
+
+    # 出力形式によって検出位置が変わらないこと（none は縮小デコードするので座標の戻し方を確認する）
+    mismatches = check_format_consistency(thumbnails, args.analysis_width)
+    print(f"none / png の検出位置の一致: {len(thumbnails) - len(mismatches)}/{len(thumbnails)} 枚")
+    for name, none_result, png_result in mismatches:
+        print(f"  {name}: none={none_result.get('edges', none_result.get('error'))} png={png_result.get('edges', png_result.get('error'))}")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+import os
+import time
+import pickle
+import asyncio
+import threading
+from collections import OrderedDict
+
+
+class InMemoryCache:
+    """
+    プロセス内の TTL 付き LRU キャッシュ。max_bytes を指定すると、値のおおよそのサイズの合計でも上限をかける。
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> (expires_at, value, size)
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value, _ = entry
+            if expires_at <= time.monotonic():
+                self.__remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys: list) -> list:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value, ttl_sec: float):
+        size = _approx_size(value) if self.max_bytes else 0
+        with self._lock:
+            self.__remove(key)
+            self._entries[key] = (time.monotonic() + ttl_sec, value, size)
+            self._total_bytes += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self._total_bytes > self.max_bytes):
+                self.__remove(next(iter(self._entries)))
+
+    def delete(self, key: str):
+        with self._lock:
+            self.__remove(key)
+
+    # private
+    def __remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry[2]
+
+
+def _approx_size(value) -> int:
+    """
+    値のおおよそのバイト数（文字列・バイト列の長さの合計。base64 の画像などが大半を占める）
+    """
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_approx_size(key) + _approx_size(item) for key, item in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return sum(_approx_size(item) for item in value)
+    return 8
+
+
+class RedisCache:
+    """
+    Redis 互換サーバーを使うキャッシュ。値は pickle で保存する。
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "magi:"):
+        import redis  # Redis を使うときだけ必要
+
+        self.prefix = prefix
+        self._redis = redis.Redis.from_url(url)
+
+    def get(self, key: str):
+        raw = self._redis.get(self.prefix + key)
+        return pickle.loads(raw) if raw is not None else None
+
+    def get_many(self, keys: list) -> list:
+        if not keys:
+            return []
+        raws = self._redis.mget([self.prefix + key for key in keys])
+        return [pickle.loads(raw) if raw is not None else None for raw in raws]
+
+    def set(self, key: str, value, ttl_sec: float):
+        self._redis.set(self.prefix + key, pickle.dumps(value), px=max(1, int(ttl_sec * 1000)))
+
+    def delete(self, key: str):
+        self._redis.delete(self.prefix + key)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    CACHE_BACKEND（memory / redis）に応じた共有キャッシュを返す。
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            backend = os.getenv("CACHE_BACKEND", "memory")
+            if backend == "redis":
+                _cache = RedisCache(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+            else:
+                _cache = InMemoryCache(int(os.getenv("CACHE_MAX_ENTRIES", "256")))
+        return _cache
+
+
+class SingleFlight:
+    """
+    同じキーに対する同時実行を1回にまとめる。後から来た呼び出しは最初の結果を待って共有する。
+    """
+
+    class _Call:
+        def __init__(self):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key: str, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+# セクションごとの TTL（秒）。統計は日次で変わり、チャンネル情報はほとんど変わらない
+DEFAULT_SECTION_TTLS = {
+    "video_stats": 60 * 60,
+    "comment_data": 6 * 60 * 60,
+    "comment_stats": 6 * 60 * 60,
+    "other_sponsored_video_comments": 6 * 60 * 60,
+    "video_data": 24 * 60 * 60,
+    "other_sponsored_video_data": 24 * 60 * 60,
+    "channel_data": 24 * 60 * 60,
+    "target_channel_data": 24 * 60 * 60,
+    "popular_channels_data": 24 * 60 * 60,
+    "popular_channels_csv_data": 24 * 60 * 60,
+    "age_prediction": 24 * 60 * 60,
+    "gender_prediction": 24 * 60 * 60,
+}
+
+
+def _parse_section_ttls(value: str) -> dict:
+    """
+    "video_stats=600,comment_data=3600" 形式の文字列を dict にする
+    """
+    ttls = {}
+    for item in filter(None, (part.strip() for part in value.split(","))):
+        name, _, ttl = item.partition("=")
+        ttls[name.strip()] = float(ttl)
+    return ttls
+
+
+class AnalysisCache:
+    """
+    分析データ（load_data_for_analysis の結果）の cache-aside 層。
+    - キーは 分析種別 + ID
+    - セクションごとに TTL を持ち、期限切れのセクションだけを作り直す
+    - 同じキーへの同時リクエストは SingleFlight で1回のビルドにまとめる
+    """
+
+    def __init__(self, backend, section_ttls: dict = None, default_ttl_sec: float = 3600.0):
+        self.backend = backend
+        self.section_ttls = {**DEFAULT_SECTION_TTLS, **(section_ttls or {})}
+        self.default_ttl_sec = default_ttl_sec
+        self._flight = SingleFlight()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            get_cache(),
+            section_ttls=_parse_section_ttls(os.getenv("ANALYSIS_CACHE_TTLS", "")),
+            default_ttl_sec=float(os.getenv("ANALYSIS_CACHE_DEFAULT_TTL_SEC", "3600")),
+        )
+
+    def get_or_build(self, analysis_type: str, target_id: str, builder) -> dict:
+        """
+        :param builder: 作り直すセクション名の集合（None なら全て）を受け取り、セクション dict を返す関数
+        """
+        key = f"analysis:{analysis_type}:{target_id}"
+        return self._flight.do(key, lambda: self.__get_or_build(key, builder))
+
+    def invalidate(self, analysis_type: str, target_id: str):
+        self.backend.delete(f"analysis:{analysis_type}:{target_id}:sections")
+
+    # private
+    def __get_or_build(self, key: str, builder) -> dict:
+        sections = self.backend.get(f"{key}:sections")
+        if sections is None:
+            print(f"分析キャッシュ miss: {key}")
+            data = builder(None)
+            self.__store(key, data)
+            return data
+
+        values = self.backend.get_many([f"{key}:{name}" for name in sections])
+        data = {name: value for name, value in zip(sections, values) if value is not None}
+        missing = set(sections) - set(data)
+        if missing:
+            print(f"分析キャッシュ 一部期限切れ: {key} {sorted(missing)}")
+            rebuilt = builder(missing)
+            self.__store(key, rebuilt, with_sections=False)
+            data.update(rebuilt)
+        return {name: data[name] for name in sections if name in data}
+
+    def __store(self, key: str, data: dict, with_sections: bool = True):
+        ttls = []
+        for name, value in data.items():
+            ttl = self.section_ttls.get(name, self.default_ttl_sec)
+            ttls.append(ttl)
+            self.backend.set(f"{key}:{name}", value, ttl)
+        if with_sections:
+            # セクション一覧は最も長い TTL まで保持する
+            self.backend.set(f"{key}:sections", list(data.keys()), max(ttls, default=self.default_ttl_sec))
+
+
+class ThumbnailCache:
+    """
+    サムネイル分析のキャッシュ（非同期のエンドポイントから使う）。
+    - 動画ID → サムネイルURL（YouTube API のクォータ節約）
+    - サムネイルURL → ETag / Last-Modified / 内容のハッシュ（画像の再検証用）
+    - 内容のハッシュ + 出力オプション → 分析結果（同じ画像は再解析しない）
+    Redis などネットワーク越しのバックエンドはスレッドで呼び、イベントループを止めない
+    """
+
+    def __init__(self, backend, url_ttl_sec: float = 24 * 60 * 60, result_ttl_sec: float = 7 * 24 * 60 * 60):
+        self.backend = backend
+        self.url_ttl_sec = url_ttl_sec
+        self.result_ttl_sec = result_ttl_sec
+
+    @classmethod
+    def from_env(cls):
+        backend = get_cache()
+        if isinstance(backend, InMemoryCache):
+            # base64 の画像を含む結果で分析データが追い出されないよう、プロセス内では専用のキャッシュを使う
+            backend = InMemoryCache(
+                int(os.getenv("THUMBNAIL_CACHE_MAX_ENTRIES", "4096")),
+                max_bytes=int(os.getenv("THUMBNAIL_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+            )
+        return cls(
+            backend,
+            url_ttl_sec=float(os.getenv("THUMBNAIL_URL_CACHE_TTL_SEC", str(24 * 60 * 60))),
+            result_ttl_sec=float(os.getenv("THUMBNAIL_RESULT_CACHE_TTL_SEC", str(7 * 24 * 60 * 60))),
+        )
+
+    async def get_urls(self, video_ids: list) -> dict:
+        values = await self.__call(self.backend.get_many, [f"thumbnail:url:{video_id}" for video_id in video_ids])
+        return {video_id: url for video_id, url in zip(video_ids, values) if url is not None}
+
+    async def set_urls(self, thumbnail_urls: dict):
+        def set_all():
+            for video_id, url in thumbnail_urls.items():
+                self.backend.set(f"thumbnail:url:{video_id}", url, self.url_ttl_sec)
+
+        await self.__call(set_all)
+
+    async def get_validator(self, thumbnail_url: str):
+        """
+        前回ダウンロードしたときの {"etag", "last_modified", "content_hash"}（なければ None）
+        """
+        return await self.__call(self.backend.get, f"thumbnail:image:{thumbnail_url}")
+
+    async def set_validator(self, thumbnail_url: str, etag: str, last_modified: str, content_hash: str):
+        await self.__call(
+            self.backend.set,
+            f"thumbnail:image:{thumbnail_url}",
+            {"etag": etag, "last_modified": last_modified, "content_hash": content_hash},
+            self.result_ttl_sec,
+        )
+
+    async def get_result(self, content_hash: str, options: tuple):
+        return await self.__call(self.backend.get, self.__result_key(content_hash, options))
+
+    async def set_result(self, content_hash: str, options: tuple, result: dict):
+        await self.__call(self.backend.set, self.__result_key(content_hash, options), result, self.result_ttl_sec)
+
+    # private
+    async def __call(self, fn, *args):
+        if isinstance(self.backend, InMemoryCache):
+            return fn(*args)  # プロセス内なら待ちは発生しない
+        return await asyncio.to_thread(fn, *args)
+
+    @staticmethod
+    def __result_key(content_hash: str, options: tuple) -> str:
+        return f"thumbnail:result:{content_hash}:" + ":".join(str(option) for option in options)
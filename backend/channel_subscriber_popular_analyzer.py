@@ -22,12 +22,28 @@ class ChannelPopularityAnalyzer:
     # CSVのチャンネルデータとデモグラデータ、統計データ
     # 対象チャンネルおよびCSVの動画データ、統計データ
 
-    def create_data(self):
-        return {
-            "target_channel_data": self.__a_channel_data(self.youtube_channel_id),
-            "popular_channels_data": self.__channels_data(),
-            "popular_channels_csv_data": self.__get_popular_channel_data(),
-        }
+    def create_data(self, sections: set = None):
+        """
+        :param sections: 作成するセクション名の集合（None なら全て）。キャッシュの期限切れ分だけ作り直すときに使う
+        """
+        wanted = lambda name: sections is None or name in sections
+        data = {}
+
+        if wanted("target_channel_data") or wanted("popular_channels_data"):
+            youtube_channel_ids = self.extract_youtube_channel_id_from_json_data()
+            # 対象チャンネルと比較チャンネルのデータ・デモグラを1クエリでまとめて取得
+            channels = self.db.fetch_channels_with_demogra_by_youtube_channel_ids(
+                [self.youtube_channel_id] + youtube_channel_ids
+            )
+            target_channel = channels.get(self.youtube_channel_id)
+            if not target_channel:
+                raise ValueError(f"チャンネルが見つかりません: {self.youtube_channel_id}")
+
+            data["target_channel_data"] = self.__a_channel_data(target_channel)
+            data["popular_channels_data"] = self.__channels_data(channels, youtube_channel_ids)
+
+        data["popular_channels_csv_data"] = self.__get_popular_channel_data()
+        return {name: value for name, value in data.items() if wanted(name)}
 
     def __get_popular_channel_data(self):
         """
@@ -35,9 +51,9 @@ class ChannelPopularityAnalyzer:
         """
         print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
         s3_key = f"channel_subscriber_popular_channels/{self.youtube_channel_id}/{self.youtube_channel_id}.json"
-        text = self.s3.load_json_as_text(s3_key)
         try:
-            data = json.loads(text)  # ✅ JSON 文字列を辞書に変換
+            # ✅ 同じ分析内では S3Client が一度だけダウンロード・パースしたものを共有する
+            data = self.s3.load_json(s3_key)
             return data
         except json.JSONDecodeError as e:
             print(f"JSON デコードエラー: {e}")
@@ -54,39 +70,38 @@ class ChannelPopularityAnalyzer:
         return [channel["subscriber_popular_youtube_channel_id"] for channel in data]
 
 
-    def __channels_data(self) -> list:
+    def __channels_data(self, channels: dict, youtube_channel_ids: list) -> list:
         """
-        チャンネルデータを取得
+        チャンネルデータを整形（DB に存在しないチャンネルは除外）
         """
         print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        youtube_channel_ids = self.extract_youtube_channel_id_from_json_data()
-        return [self.__a_channel_data(youtube_channel_id) for youtube_channel_id in youtube_channel_ids]
+        return [
+            self.__a_channel_data(channels[youtube_channel_id])
+            for youtube_channel_id in youtube_channel_ids
+            if youtube_channel_id in channels
+        ]
 
     # チャンネルデータ
-    def __a_channel_data(self, youtube_channel_id: str):
+    def __a_channel_data(self, data: dict):
         """
-        チャンネルデータを取得
+        チャンネルデータを整形
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        data = self.db.fetch_channel_data_by_youtube_channel_id(youtube_channel_id)
-        age = self.__fetch_age_demogra(data["id"])
-        gender = self.__fetch_gender_demogra(data["id"])
         return {
             "タイトル": data["title"],
             "説明": data["description"],
             "メタデータ": data["metadata"],
             "チャンネル開設日": data["published_at"],
-            "年齢分布予測": age,
-            "性別予測": gender
+            "年齢分布予測": self.__age_demogra(data),
+            "性別予測": self.__gender_demogra(data)
         }
 
     # デモグラデータ
-    def __fetch_age_demogra(self, channel_id: str):
+    def __age_demogra(self, ages: dict):
         """
-        デモグラデータを取得
+        年齢デモグラデータを整形（予測がないチャンネルは None）
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        ages = self.db.fetch_age_demogra_data(channel_id)
+        if ages["prediction_age_13_17"] is None:
+            return None
         return {
             "13〜17歳": f"{ages["prediction_age_13_17"] * 100}%",
             "18~24歳": f"{ages["prediction_age_18_24"] * 100}%",
@@ -97,12 +112,12 @@ class ChannelPopularityAnalyzer:
             "65歳以上": f"{ages["prediction_age_65_"] * 100}%"
         }
 
-    def __fetch_gender_demogra(self, channel_id: str):
+    def __gender_demogra(self, genders: dict):
         """
-        デモグラデータを取得
+        性別デモグラデータを整形（予測がないチャンネルは None）
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        genders = self.db.fetch_gender_demogra_data(channel_id)
+        if genders["prediction_rate"] is None:
+            return None
         return {
             "推定男性比": f"({(100 - genders["prediction_rate"])}%",
             "推定女性比": f"{genders["prediction_rate"]}%"
@@ -1,21 +1,37 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from db_utils import DBClient
 from s3_utils import S3Client
+from comment_compactor import compact_comment_csv, compact_comment_rows
+from comment_stats import summarize_comment_csv, summarize_comment_table
+from comment_store import CommentStore, iter_rows
 import inspect
 
+# プロンプトに載せるコメントのトークン予算（対象動画 / 関連スポンサード動画1本あたり）
+COMMENT_TOKEN_BUDGET = int(os.getenv("COMMENT_TOKEN_BUDGET", "6000"))
+SPONSORED_COMMENT_TOKEN_BUDGET = int(os.getenv("SPONSORED_COMMENT_TOKEN_BUDGET", "1500"))
+
 class CommentAnalyzer:
     """
     指定された動画のコメントを分析するクラス
     """
 
-    def __init__(self, youtube_video_id: str):
+    def __init__(self, youtube_video_id: str, parallelism: int = None, section_timeout_sec: float = None):
         """
         :param video_id: 分析対象のチャンネルID
+        :param parallelism: S3 / DB の同時取得数の上限
+        :param section_timeout_sec: 各セクション取得のタイムアウト（超えたセクションは None）
         """
         self.db = DBClient()
         self.s3 = S3Client()
+        # pyarrow がある場合はコメントCSVを列指向形式でローカルに保持して使い回す
+        self.comment_store = CommentStore(self.s3) if CommentStore.available() else None
         self.youtube_video_id = youtube_video_id
-        self.channel_id = self.db.fetch_channel_id_by(self.youtube_video_id)
-        self.youtube_channel_id = self.__get_youtube_channel_id_by(self.channel_id)
+        self.channel_id = None
+        self.youtube_channel_id = None
+        self.parallelism = parallelism or int(os.getenv("ANALYSIS_FETCH_PARALLELISM", "8"))
+        self.section_timeout_sec = section_timeout_sec or float(os.getenv("ANALYSIS_SECTION_TIMEOUT_SEC", "30"))
 
 
     # 分析に必要なもの
@@ -25,82 +41,184 @@ class CommentAnalyzer:
     # チャンネルデータ
     # 動画の統計データ
 
-    def create_data(self):
-        video_data = self.__fetch_video_data()
+    def create_data(self, sections: set = None):
+        """
+        :param sections: 作成するセクション名の集合（None なら全て）。キャッシュの期限切れ分だけ作り直すときに使う
+        """
+        wanted = lambda name: sections is None or name in sections
+
+        # 動画・チャンネル・デモグラは1クエリ、統計データはもう1クエリで取得する
+        bundle = self.__fetch_bundle()
+        self.channel_id = bundle["channel_id"]
+        self.youtube_channel_id = bundle["youtube_channel_id"]
+
         basic_data = {
-            "comment_data": self.__fetch_comment_data(video_data["youtube_video_id"]),
-            "channel_data": self.__a_channel_data(self.youtube_channel_id),
-            "age_prediction": self.__fetch_age_demogra(),
-            "gender_prediction": self.__fetch_gender_demogra(),
+            "channel_data": self.__a_channel_data(bundle),
+            "age_prediction": self.__age_demogra(bundle),
+            "gender_prediction": self.__gender_demogra(bundle),
             "video_data": {
-                "タイトル": video_data["title"],
-                "説明": video_data["description"],
-                "メタデータ": video_data["metadata"],
-                "投稿日": video_data["published_at"]
+                "タイトル": bundle["title"],
+                "説明": bundle["description"],
+                "メタデータ": bundle["metadata"],
+                "投稿日": bundle["published_at"]
             },
-            "video_stats": self.__fetch_video_stats(10)
         }
-        if video_data["is_sponsored"] == 1:
-            other_sponsored_video_data = self.db.fetch_other_product_videos(str(video_data['product_id']))
+        # 互いに依存しない S3 ダウンロードと DB クエリは並列に取得する
+        executor = ThreadPoolExecutor(max_workers=self.parallelism, thread_name_prefix="comment-analyzer")
+        try:
+            futures = {}
+            comments = None
+            if wanted("comment_data") or wanted("comment_stats"):
+                comments = self.__submit(
+                    executor, self.__fetch_comment_sections, self.youtube_channel_id, bundle["youtube_video_id"], bundle["published_at"]
+                )
+            if wanted("video_stats"):
+                futures["video_stats"] = self.__submit(executor, self.__fetch_video_stats, bundle["video_id"], 10)
 
-            if other_sponsored_video_data:
-                basic_data["other_sponsored_video_data"] = []
+            sponsored_wanted = wanted("other_sponsored_video_data") or wanted("other_sponsored_video_comments")
+            if bundle["is_sponsored"] == 1 and sponsored_wanted:
+                sponsored = self.__submit(executor, self.__fetch_other_sponsored_videos, str(bundle['product_id']))
+                other_sponsored_video_data, youtube_channel_ids = self.__result("other_sponsored_video_data", sponsored) or ([], {})
 
-                for video in other_sponsored_video_data:
-                    print("other_sponsored_video_data", video)
-                    basic_data["other_sponsored_video_data"].append({
-                        "タイトル": video["title"],
-                        "説明": video["description"],
-                        "メタデータ": video["metadata"],
-                        "投稿日": video["published_at"]
-                    })
-                    comment_data = self.__fetch_comment_data(video["youtube_video_id"])
-                    basic_data["other_sponsored_video_comments"].append(comment_data) if comment_data else None
+                if other_sponsored_video_data:
+                    basic_data["other_sponsored_video_data"] = []
+                    comment_keys = []
 
-        return basic_data
+                    for video in other_sponsored_video_data:
+                        print("other_sponsored_video_data", video)
+                        basic_data["other_sponsored_video_data"].append({
+                            "タイトル": video["title"],
+                            "説明": video["description"],
+                            "メタデータ": video["metadata"],
+                            "投稿日": video["published_at"]
+                        })
+                        youtube_channel_id = youtube_channel_ids.get(video["youtube_video_id"])
+                        if not youtube_channel_id or not wanted("other_sponsored_video_comments"):
+                            continue
+                        comment_keys.append(self.__comment_key(youtube_channel_id, video["youtube_video_id"]))
 
-    # youtube_channel_idを取得
-    def __get_youtube_channel_id_by(self, channel_id: str) -> str:
+                    if self.comment_store:
+                        comment_futures = [
+                            self.__submit(executor, self.__fetch_comment_data, s3_key, SPONSORED_COMMENT_TOKEN_BUDGET)
+                            for s3_key in comment_keys
+                        ]
+                        other_comments = [self.__result("other_sponsored_video_comments", future) for future in comment_futures]
+                    else:
+                        # 列指向の保存がない場合は、動画ごとの CSV を get_many でまとめて並列にダウンロードする
+                        other_comments = self.__result("other_sponsored_video_comments", self.__submit(
+                            executor, self.__fetch_comment_data_many, comment_keys, SPONSORED_COMMENT_TOKEN_BUDGET
+                        )) or []
+                    basic_data["other_sponsored_video_comments"] = [comment_data for comment_data in other_comments if comment_data]
+
+            for name, future in futures.items():
+                basic_data[name] = self.__result(name, future)
+            if comments is not None:
+                basic_data.update(self.__result("comment_data", comments) or {"comment_data": None, "comment_stats": None})
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return {name: value for name, value in basic_data.items() if wanted(name)}
+
+    # 並列取得
+    def __submit(self, executor, fn, *args):
         """
-        指定された動画IDからチャンネルIDを取得
+        タスクを投入し、(future, 締め切り時刻) を返す
+        """
+        return executor.submit(fn, *args), time.monotonic() + self.section_timeout_sec
+
+    def __result(self, name: str, submitted):
+        """
+        締め切りまで結果を待つ。タイムアウトしたセクションは None にする
+        """
+        future, deadline = submitted
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            print(f"セクション取得がタイムアウトしました: {name} ({self.section_timeout_sec}秒)")
+            future.cancel()
+            return None
+
+    # スポンサード動画
+    def __fetch_other_sponsored_videos(self, product_id: str):
+        """
+        同じ商品の他のスポンサード動画と、そのチャンネルID（IN (...) でまとめて取得）を返す
         """
         print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        youtube_channel_id = self.db.fetch_channel_data_by_id(channel_id)["youtube_channel_id"]
-        return youtube_channel_id
+        videos = self.db.fetch_other_product_videos(product_id)
+        youtube_channel_ids = self.db.fetch_youtube_channel_ids_by_youtube_video_ids(
+            [video["youtube_video_id"] for video in videos]
+        )
+        return videos, youtube_channel_ids
+
+    # 動画・チャンネル・デモグラデータ
+    def __fetch_bundle(self):
+        """
+        分析に必要な DB データをまとめて取得
+        """
+        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
+        bundle = self.db.fetch_comment_analysis_bundle(self.youtube_video_id)
+        if not bundle:
+            raise ValueError(f"動画が見つかりません: {self.youtube_video_id}")
+        return bundle
 
     # コメントデータ
-    def __fetch_comment_data(self, youtube_video_id):
+    def __comment_key(self, youtube_channel_id: str, youtube_video_id: str) -> str:
+        return f"video_comments/{youtube_channel_id}/{youtube_video_id}.csv"
+
+    def __fetch_comment_data(self, s3_key: str, token_budget: int):
         """
-        コメントCSVをS3から取得
+        列指向で保存したコメントを読み、重複・スパムを除いてトークン予算内の代表コメントに絞る
         """
         print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        channel_id = self.db.fetch_channel_id_by(youtube_video_id)
-        youtube_channel_id = self.__get_youtube_channel_id_by(channel_id)
-        s3_key = f"video_comments/{youtube_channel_id}/{youtube_video_id}.csv"
+        table = self.comment_store.load_table(s3_key)
+        return compact_comment_rows(table.column_names, iter_rows(table), token_budget)
+
+    def __fetch_comment_data_many(self, s3_keys: list, token_budget: int) -> list:
+        """
+        複数のコメントCSVをS3からまとめて並列に取得し、それぞれトークン予算内の代表コメントに絞る（存在しないCSVは None）
+        """
+        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
+        bodies = self.s3.get_many(s3_keys, max_workers=self.parallelism)
+        return [
+            compact_comment_csv(bodies[s3_key].decode("utf-8"), token_budget) if bodies[s3_key] is not None else None
+            for s3_key in s3_keys
+        ]
+
+    def __fetch_comment_sections(self, youtube_channel_id: str, youtube_video_id: str, published_at):
+        """
+        対象動画のコメントを1回だけダウンロードし、予算内の代表コメントと全件の集計値を作る
+        """
+        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
+        s3_key = self.__comment_key(youtube_channel_id, youtube_video_id)
+        if self.comment_store:
+            table = self.comment_store.load_table(s3_key)
+            return {
+                "comment_data": compact_comment_rows(table.column_names, iter_rows(table), COMMENT_TOKEN_BUDGET),
+                "comment_stats": summarize_comment_table(table, published_at),
+            }
         csv_text = self.s3.load_csv_as_text(s3_key)
-        return csv_text
+        return {
+            "comment_data": compact_comment_csv(csv_text, COMMENT_TOKEN_BUDGET),
+            "comment_stats": summarize_comment_csv(csv_text, published_at),
+        }
 
     # チャンネルデータ
-    def __a_channel_data(self, youtube_channel_id: str):
+    def __a_channel_data(self, bundle: dict):
         """
-        チャンネルデータを取得
+        チャンネルデータを整形
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        data = self.db.fetch_channel_data_by_youtube_channel_id(youtube_channel_id)
         return {
-            "タイトル": data["title"],
-            "説明": data["description"],
-            "メタデータ": data["metadata"],
-            "チャンネル開設日": data["published_at"]
+            "タイトル": bundle["channel_title"],
+            "説明": bundle["channel_description"],
+            "メタデータ": bundle["channel_metadata"],
+            "チャンネル開設日": bundle["channel_published_at"]
         }
 
     # デモグラデータ
-    def __fetch_age_demogra(self):
+    def __age_demogra(self, ages: dict):
         """
-        デモグラデータを取得
+        年齢デモグラデータを整形
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        ages = self.db.fetch_age_demogra_data(self.channel_id)
         return {
             "13〜17歳": f"{ages["prediction_age_13_17"] * 100}%",
             "18~24歳": f"{ages["prediction_age_18_24"] * 100}%",
@@ -111,32 +229,22 @@ class CommentAnalyzer:
             "65歳以上": f"{ages["prediction_age_65_"] * 100}%"
         }
 
-    def __fetch_gender_demogra(self):
+    def __gender_demogra(self, genders: dict):
         """
-        デモグラデータを取得
+        性別デモグラデータを整形
         """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        genders = self.db.fetch_gender_demogra_data(self.channel_id)
         return {
             "推定男性比": f"({(100 - genders["prediction_rate"])}%",
             "推定女性比": f"{genders["prediction_rate"]}%"
         }
 
-    # 動画データ
-    def __fetch_video_data(self):
-        """
-        動画データを取得
-        """
-        print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        return self.db.fetch_video_data(self.youtube_video_id)
-
     # 動画の統計データ
-    def __fetch_video_stats(self, days):
+    def __fetch_video_stats(self, video_id: int, days):
         """
         動画の統計データを取得
         """
         print(f"実行中のメソッド: {inspect.currentframe().f_code.co_name}")
-        stats = self.db.fetch_video_stats(self.youtube_video_id, days)
+        stats = self.db.fetch_video_stats_by_video_id(video_id, days)
         return {
             "視聴回数": stats["view_count"],
             "いいね数": stats["like_count"],
@@ -0,0 +1,150 @@
+import io
+import re
+import csv
+import math
+import heapq
+from datetime import datetime
+
+from token_utils import count_tokens
+
+# コメントCSVの列名の候補（エクスポート元によって列名が違うため）
+TEXT_COLUMNS = ("text", "comment", "text_display", "textDisplay", "text_original", "textOriginal", "body", "content", "コメント")
+LIKE_COLUMNS = ("like_count", "likeCount", "likes", "いいね数")
+DATE_COLUMNS = ("published_at", "publishedAt", "created_at", "createdAt", "updated_at", "updatedAt", "投稿日")
+
+URL_PATTERN = re.compile(r"https?://|www\.", re.IGNORECASE)
+REPEATED_CHAR_PATTERN = re.compile(r"(.)\1{14,}")
+SYMBOL_ONLY_PATTERN = re.compile(r"^[\W_]+$")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+
+# 1日新しいコメントを「いいね数 e^0.1 倍」程度に評価する
+RECENCY_WEIGHT_PER_DAY = 0.1
+
+
+def detect_columns(header: list) -> dict:
+    """
+    ヘッダーから本文・いいね数・投稿日時の列番号を探す（見つからない列は None）
+    """
+    normalized = [name.strip().lstrip("\ufeff") for name in header]
+
+    def find(candidates):
+        lowered = [name.lower() for name in normalized]
+        for candidate in candidates:
+            if candidate.lower() in lowered:
+                return lowered.index(candidate.lower())
+        return None
+
+    return {"text": find(TEXT_COLUMNS), "likes": find(LIKE_COLUMNS), "published_at": find(DATE_COLUMNS)}
+
+
+def parse_like_count(value) -> int:
+    try:
+        return int(float(str(value).replace(",", "")))
+    except (TypeError, ValueError):
+        return 0
+
+
+def parse_timestamp(value) -> float:
+    """
+    ISO 形式などの日時文字列を UNIX 秒にする（解釈できなければ 0）
+    """
+    if not value:
+        return 0.0
+    text = str(value).strip().replace("Z", "+00:00")
+    for parser in (datetime.fromisoformat, lambda v: datetime.strptime(v, "%Y-%m-%d %H:%M:%S")):
+        try:
+            return parser(text).timestamp()
+        except ValueError:
+            continue
+    return 0.0
+
+
+def is_spam(text: str) -> bool:
+    """
+    URL を含む・同じ文字の連続・記号だけ、などのコメントをスパムとみなす
+    """
+    return bool(URL_PATTERN.search(text) or REPEATED_CHAR_PATTERN.search(text) or SYMBOL_ONLY_PATTERN.match(text))
+
+
+def compact_comment_csv(source, token_budget: int, max_candidates: int = None) -> str:
+    """
+    コメントCSVを1行ずつ読み、token_budget に収まる代表的なコメントだけの CSV を返す。
+
+    :param source: CSV 文字列、または行のイテラブル（S3 からのストリームなど）
+    """
+    lines = io.StringIO(source) if isinstance(source, str) else source
+    reader = csv.reader(lines)
+    header = next(reader, None)
+    if header is None:
+        return ""
+    return compact_comment_rows(header, reader, token_budget, max_candidates)
+
+
+def compact_comment_rows(header: list, rows, token_budget: int, max_candidates: int = None) -> str:
+    """
+    コメント行を1行ずつ読み、重複・スパムを除いたうえで いいね数 と 新しさ で順位付けし、
+    token_budget に収まる代表的なコメントだけの CSV（本文, いいね数, 投稿日時）を返す。
+
+    :param header: 列名のリスト
+    :param rows: 各行の値（文字列）のイテラブル
+    :param max_candidates: 保持する候補数の上限（メモリを一定に保つため）。None なら予算から決める
+    """
+    columns = detect_columns(header)
+    max_candidates = max_candidates or max(200, token_budget // 4)
+
+    candidates = []  # (score, 連番, text, likes, published_at) の最小ヒープ
+    seen = set()
+    total = duplicates = spams = 0
+
+    for index, row in enumerate(rows):
+        if not row:
+            continue
+        total += 1
+        text = row[columns["text"]] if columns["text"] is not None and columns["text"] < len(row) else " ".join(row)
+        text = WHITESPACE_PATTERN.sub(" ", text).strip()
+        if not text:
+            continue
+
+        fingerprint = hash(text.casefold())
+        if fingerprint in seen:
+            duplicates += 1
+            continue
+        seen.add(fingerprint)
+
+        if is_spam(text):
+            spams += 1
+            continue
+
+        likes = parse_like_count(row[columns["likes"]]) if columns["likes"] is not None and columns["likes"] < len(row) else 0
+        published_at = row[columns["published_at"]] if columns["published_at"] is not None and columns["published_at"] < len(row) else ""
+        score = math.log1p(likes) + RECENCY_WEIGHT_PER_DAY * parse_timestamp(published_at) / 86400
+
+        item = (score, index, text, likes, published_at)
+        if len(candidates) < max_candidates:
+            heapq.heappush(candidates, item)
+        elif score > candidates[0][0]:
+            heapq.heapreplace(candidates, item)
+
+    def note(selected_count: int) -> str:
+        return f"# 全{total}件中{selected_count}件を抜粋（重複{duplicates}件・スパム{spams}件を除外、いいね数と新しさで選択）\n"
+
+    # 予算内に収まるまで、順位の高いものから詰める（先頭の注記の分も予算に含める）
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["text", "like_count", "published_at"])
+    used_tokens = count_tokens(note(total)) + count_tokens(output.getvalue())
+    selected = []
+    for score, index, text, likes, published_at in sorted(candidates, reverse=True):
+        line = io.StringIO()
+        csv.writer(line).writerow([text, likes, published_at])
+        row_tokens = count_tokens(line.getvalue())
+        if used_tokens + row_tokens > token_budget:
+            continue
+        used_tokens += row_tokens
+        selected.append((index, line.getvalue()))
+
+    # 読みやすいよう元の順番（おおむね時系列）に戻す
+    for _, line in sorted(selected):
+        output.write(line)
+
+    return note(len(selected)) + output.getvalue()
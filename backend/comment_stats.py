@@ -0,0 +1,183 @@
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from comment_compactor import detect_columns
+
+# 単語っぽい塊（漢字・カタカナ・ひらがな・英数字の連続）
+TOKEN_PATTERN = r"[一-龥々]{2,}|[ァ-ヶー]{2,}|[ぁ-ん]{3,}|[A-Za-z0-9]{2,}"
+EMOJI_PATTERN = r"[\U0001F300-\U0001FAFF☀-➿⭐❤]"
+
+DEFAULT_KEYWORDS = ("面白", "最高", "好き", "かわいい", "草", "泣", "感動", "嫌い", "つまらな", "広告", "案件", "PR")
+COMMENT_STATS_KEYWORDS = tuple(
+    keyword.strip() for keyword in os.getenv("COMMENT_STATS_KEYWORDS", ",".join(DEFAULT_KEYWORDS)).split(",") if keyword.strip()
+)
+
+LENGTH_BINS = [0, 10, 20, 50, 100, 200, np.inf]
+WINDOW_HOURS = 7 * 24
+
+
+class CommentStats:
+    """
+    コメントを列指向のデータフレームに載せ、集計値をベクトル演算で求めるクラス。
+    LLM に数えさせる代わりに、ここで求めた集計値をプロンプトに渡す。
+    """
+
+    def __init__(self, frame: pd.DataFrame, window_start=None):
+        """
+        :param frame: コメントのデータフレーム（列名はエクスポート元のまま）
+        :param window_start: 7日間ウィンドウの起点（動画の投稿日時）。None なら最初のコメント
+        """
+        columns = detect_columns(list(frame.columns))
+        text = frame.iloc[:, columns["text"]] if columns["text"] is not None else frame.astype(str).agg(" ".join, axis=1)
+        likes = frame.iloc[:, columns["likes"]] if columns["likes"] is not None else pd.Series(0, index=frame.index)
+        published_at = frame.iloc[:, columns["published_at"]] if columns["published_at"] is not None else pd.Series(pd.NaT, index=frame.index)
+
+        self.frame = pd.DataFrame({
+            "text": text.fillna("").astype(str).str.strip(),
+            "likes": pd.to_numeric(likes, errors="coerce").fillna(0).astype(np.int64),
+            "published_at": pd.to_datetime(published_at, errors="coerce", utc=True),
+        })
+        self.frame = self.frame[self.frame["text"] != ""]
+        self._tokens = None
+        if window_start is None:
+            self.window_start = self.frame["published_at"].min()
+        else:
+            # DB の日時は tz なしなので UTC とみなす
+            start = pd.Timestamp(window_start)
+            self.window_start = start.tz_localize("UTC") if start.tzinfo is None else start
+
+    @classmethod
+    def from_csv_text(cls, csv_text: str, window_start=None):
+        frame = pd.read_csv(io.StringIO(csv_text), dtype=str, keep_default_na=False, on_bad_lines="skip")
+        return cls(frame, window_start)
+
+    @classmethod
+    def from_arrow(cls, table, window_start=None):
+        """
+        pyarrow.Table から作る。集計に使う列だけをデータフレームにする
+        """
+        columns = detect_columns(table.column_names)
+        used = [table.column_names[index] for index in columns.values() if index is not None]
+        return cls(table.select(used).to_pandas() if used else table.to_pandas(), window_start)
+
+    def summary(self, top_n: int = 15) -> dict:
+        """
+        プロンプトに載せる集計値をまとめて返す
+        """
+        return {
+            "コメント総数": int(len(self.frame)),
+            "時間帯別コメント数": self.hourly_volume(),
+            "文字数分布": self.length_distribution(),
+            "頻出語": self.top_ngrams(1, top_n),
+            "頻出フレーズ（2語）": self.top_ngrams(2, top_n),
+            "絵文字": self.emoji_frequencies(top_n),
+            "キーワード出現コメント数": self.keyword_frequencies(),
+            "いいね上位コメント": self.top_liked(10),
+            "いいね加重の頻出語": self.like_weighted_tokens(top_n),
+        }
+
+    def hourly_volume(self) -> dict:
+        """
+        投稿から7日間の1時間ごとのコメント数（168 要素）と、日別合計・ピーク時間
+        """
+        published_at = self.frame["published_at"].dropna()
+        if published_at.empty or pd.isna(self.window_start):
+            return {}
+        hours = ((published_at - self.window_start) / pd.Timedelta(hours=1)).to_numpy()
+        hours = np.floor(hours[(hours >= 0) & (hours < WINDOW_HOURS)]).astype(np.int64)
+        counts = np.bincount(hours, minlength=WINDOW_HOURS)
+        peak_hours = np.argsort(counts)[::-1][:5]
+        return {
+            "起点": self.window_start.isoformat(),
+            "1時間ごと": counts.tolist(),
+            "日別": counts.reshape(7, 24).sum(axis=1).tolist(),
+            "ピーク（起点からの経過時間: 件数）": {f"{int(hour)}h": int(counts[hour]) for hour in peak_hours if counts[hour] > 0},
+        }
+
+    def length_distribution(self) -> dict:
+        lengths = self.frame["text"].str.len().to_numpy()
+        if lengths.size == 0:
+            return {}
+        histogram, _ = np.histogram(lengths, bins=LENGTH_BINS)
+        labels = [f"{int(low)}-{int(high) - 1}" if np.isfinite(high) else f"{int(low)}+" for low, high in zip(LENGTH_BINS, LENGTH_BINS[1:])]
+        return {
+            "平均": round(float(lengths.mean()), 1),
+            "中央値": float(np.median(lengths)),
+            "90パーセンタイル": float(np.percentile(lengths, 90)),
+            "最大": int(lengths.max()),
+            "分布": dict(zip(labels, histogram.tolist())),
+        }
+
+    def top_ngrams(self, n: int = 1, top_n: int = 15) -> dict:
+        tokens = self.__tokens()
+        if tokens.empty:
+            return {}
+        grams = tokens
+        for offset in range(1, n):
+            # 同じコメント内の次の語とつなげる
+            grams = grams + " " + tokens.groupby(level=0).shift(-offset)
+        return self.__counts(grams.dropna().value_counts().head(top_n))
+
+    def emoji_frequencies(self, top_n: int = 15) -> dict:
+        emojis = self.frame["text"].str.findall(EMOJI_PATTERN).explode().dropna()
+        return self.__counts(emojis.value_counts().head(top_n))
+
+    def keyword_frequencies(self) -> dict:
+        text = self.frame["text"]
+        return {keyword: int(text.str.contains(keyword, regex=False).sum()) for keyword in COMMENT_STATS_KEYWORDS}
+
+    def top_liked(self, top_n: int = 10) -> list:
+        top = self.frame.nlargest(top_n, "likes")
+        return [
+            {"コメント": text[:100], "いいね数": int(likes)}
+            for text, likes in zip(top["text"], top["likes"])
+        ]
+
+    def like_weighted_tokens(self, top_n: int = 15) -> dict:
+        """
+        語ごとに、その語を含むコメントのいいね数を合計した順位
+        """
+        tokens = self.__tokens()
+        if tokens.empty:
+            return {}
+        weights = self.frame["likes"].reindex(tokens.index)
+        weighted = weights.groupby(tokens.to_numpy()).sum().sort_values(ascending=False).head(top_n)
+        return self.__counts(weighted)
+
+    # private
+    def __tokens(self) -> pd.Series:
+        """
+        コメントを語に分割して1語1行にしたもの（index は元のコメント）
+        """
+        if self._tokens is None:
+            self._tokens = self.frame["text"].str.findall(TOKEN_PATTERN).explode().dropna()
+        return self._tokens
+
+    @staticmethod
+    def __counts(series: pd.Series) -> dict:
+        return {str(key): int(value) for key, value in series.items()}
+
+
+def summarize_comment_table(table, window_start=None) -> dict:
+    """
+    pyarrow.Table のコメントの集計値を返す（集計できなければ空 dict）
+    """
+    try:
+        return CommentStats.from_arrow(table, window_start).summary()
+    except Exception as e:
+        print(f"コメント集計エラー: {e}")
+        return {}
+
+
+def summarize_comment_csv(csv_text: str, window_start=None) -> dict:
+    """
+    コメントCSVの集計値を返す（集計できなければ空 dict）
+    """
+    try:
+        return CommentStats.from_csv_text(csv_text, window_start).summary()
+    except Exception as e:
+        print(f"コメント集計エラー: {e}")
+        return {}
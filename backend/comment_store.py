@@ -0,0 +1,179 @@
+import os
+import csv
+import json
+import uuid
+import hashlib
+import threading
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.ipc as pa_ipc
+except ImportError:  # pyarrow がない環境では S3 から毎回 CSV を読む
+    pa = None
+
+COMMENT_STORE_DIR = os.getenv("COMMENT_STORE_DIR", ".comment_store")
+# 非圧縮（none）ならメモリマップからゼロコピーで読めるので、ヒープをほとんど使わない。
+# zstd / lz4 にするとディスクは減るが、読み出し時にテーブル全体をヒープに展開する
+COMMENT_STORE_COMPRESSION = os.getenv("COMMENT_STORE_COMPRESSION", "none")
+# ヘッダー行を探すときに一度に読むバイト数
+HEADER_READ_CHUNK_SIZE = 64 * 1024
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+def _lock_for(path: str) -> threading.Lock:
+    with _key_locks_lock:
+        return _key_locks.setdefault(path, threading.Lock())
+
+
+class CommentStore:
+    """
+    S3 のコメントCSVを一度だけ Arrow IPC（列指向）に変換してローカルに保存し、
+    以降はメモリマップで読み出す。S3 の ETag / LastModified か圧縮の設定が変わったら作り直す。
+    """
+
+    def __init__(self, s3, directory: str = COMMENT_STORE_DIR, compression: str = COMMENT_STORE_COMPRESSION):
+        """
+        :param s3: S3Client
+        """
+        self.s3 = s3
+        self.directory = directory
+        self.compression = None if compression in ("", "none") else compression
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def available() -> bool:
+        return pa is not None and os.getenv("COMMENT_STORE_ENABLED", "1") != "0"
+
+    def load_table(self, s3_key: str):
+        """
+        コメントを pyarrow.Table で返す（ローカルが最新ならダウンロードもパースもしない）
+        """
+        head = self.s3.head(s3_key)
+        version = head["etag"] or str(head["last_modified"])
+        path = os.path.join(self.directory, hashlib.sha256(s3_key.encode("utf-8")).hexdigest() + ".arrow")
+
+        with _lock_for(path):
+            if self.__stored_version(path) != (version, self.compression):
+                print(f"コメントCSVを列指向形式に変換します: {s3_key}")
+                self.__convert(s3_key, path, version)
+        return self.__read(path)
+
+    # private
+    def __stored_version(self, path: str):
+        """
+        保存済みファイルの (S3 のバージョン, 圧縮方式)。なければ None
+        """
+        try:
+            with open(path + ".json", encoding="utf-8") as f:
+                meta = json.load(f)
+            return meta["version"], meta.get("compression")
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def __convert(self, s3_key: str, path: str, version: str):
+        """
+        S3 からストリームで読みながらレコードバッチ単位で書き出す（CSV 全体をメモリに載せない）
+        """
+        tmp_path = _tmp_path(path)
+        body = self.s3.open_stream(s3_key)
+        try:
+            # 型推論はバッチごとに揺れるので、全列を文字列として読む（列名はヘッダー行から取る）
+            header, rest = _read_header(body)
+            try:
+                reader = pa_csv.open_csv(
+                    rest,
+                    read_options=pa_csv.ReadOptions(column_names=header),
+                    parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+                    convert_options=pa_csv.ConvertOptions(column_types={name: pa.string() for name in header}),
+                )
+            except pa.ArrowInvalid as e:
+                if "Empty CSV" not in str(e):
+                    raise
+                reader = None  # 空のファイル・ヘッダー行だけのファイルは、0行のテーブルにする
+            schema = reader.schema if reader else pa.schema([(name, pa.string()) for name in header])
+            options = pa_ipc.IpcWriteOptions(compression=self.compression)
+            with pa.OSFile(tmp_path, "wb") as sink, pa_ipc.new_file(sink, schema, options=options) as writer:
+                for batch in reader or ():
+                    writer.write_batch(batch)
+        finally:
+            body.close()
+        os.replace(tmp_path, path)
+
+        # 複数のワーカープロセスが同じキーを変換しても一時ファイルがぶつからないようにする
+        meta_tmp_path = _tmp_path(path + ".json")
+        with open(meta_tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"s3_key": s3_key, "version": version, "compression": self.compression}, f)
+        os.replace(meta_tmp_path, path + ".json")
+
+    @staticmethod
+    def __read(path: str):
+        # 非圧縮ならバッファはメモリマップを指したまま（コピーしない）
+        with pa.memory_map(path, "r") as source:
+            return pa_ipc.open_file(source).read_all()
+
+
+def _tmp_path(path: str) -> str:
+    """
+    プロセス・呼び出しごとに異なる一時ファイル名（書き終えてから os.replace で置き換える）
+    """
+    return f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.tmp"
+
+
+class _PrefixedStream:
+    """
+    先に読みすぎた分（prefix）を返してから、残りを元のストリームから読む
+    """
+
+    def __init__(self, prefix: bytes, body):
+        self._prefix = prefix
+        self._body = body
+
+    def read(self, size: int = -1) -> bytes:
+        if not self._prefix:
+            return self._body.read(size) if size is not None and size >= 0 else self._body.read()
+        if size is None or size < 0:
+            data, self._prefix = self._prefix + self._body.read(), b""
+            return data
+        data, self._prefix = self._prefix[:size], self._prefix[size:]
+        if len(data) < size:
+            data += self._body.read(size - len(data))
+        return data
+
+    def close(self):
+        self._body.close()
+
+    @property
+    def closed(self) -> bool:
+        return False
+
+
+def _read_header(body) -> tuple:
+    """
+    ストリームの先頭1行（ヘッダー）を読み、(列名のリスト, ヘッダーの後ろから読めるストリーム) を返す。
+    HEADER_READ_CHUNK_SIZE ずつ読み、改行より後ろに読みすぎた分は返すストリームの先頭に戻す
+    """
+    buffer = bytearray()
+    while True:
+        newline = buffer.find(b"\n")
+        if newline != -1:
+            break
+        chunk = body.read(HEADER_READ_CHUNK_SIZE)
+        if not chunk:
+            newline = len(buffer)
+            break
+        buffer += chunk
+    text = bytes(buffer[:newline]).decode("utf-8").lstrip("\ufeff").rstrip("\r")
+    return next(csv.reader([text]), []), _PrefixedStream(bytes(buffer[newline + 1:]), body)
+
+
+def iter_rows(table, batch_size: int = 10000):
+    """
+    テーブルを1行ずつ（値は文字列）返す。バッチ単位で Python オブジェクトにするのでメモリは一定
+    """
+    for batch in table.to_batches(max_chunksize=batch_size):
+        columns = [batch.column(i).to_pylist() for i in range(batch.num_columns)]
+        for values in zip(*columns):
+            yield ["" if value is None else str(value) for value in values]
@@ -0,0 +1,122 @@
+import os
+
+from token_utils import count_tokens, truncate_to_tokens
+
+# 直近の発言として原文のまま残すトークン数と、古い発言の要約のトークン数
+CONVERSATION_RECENT_TOKENS = int(os.getenv("CONVERSATION_RECENT_TOKENS", "3000"))
+CONVERSATION_SUMMARY_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_TOKENS", "1000"))
+# 1発言あたりの上限（長すぎる発言が窓を占有しないように）
+CONVERSATION_TURN_TOKENS = int(os.getenv("CONVERSATION_TURN_TOKENS", "1500"))
+
+SUMMARY_UPDATE_PROMPT = """
+以下は議論のこれまでの要約と、要約に追加する発言です。
+要約を更新してください。各参加者の主張・論拠・合意点・対立点が分かるように、{max_tokens}トークン以内の箇条書きで出力してください。
+
+これまでの要約:
+{summary}
+
+追加する発言:
+{turns}
+"""
+
+
+class ConversationMemory:
+    """
+    議論の履歴を「古い発言の要約」と「直近の発言（トークン数で区切った窓）」で持つ。
+    窓からあふれた発言は、その分だけ要約に畳み込む（毎回全体を要約し直さない）。
+    """
+
+    def __init__(self, topic: str, summarize=None, recent_tokens: int = CONVERSATION_RECENT_TOKENS,
+                 summary_tokens: int = CONVERSATION_SUMMARY_TOKENS, turn_tokens: int = CONVERSATION_TURN_TOKENS):
+        """
+        :param topic: 議題（要約せず常にプロンプトに含める）
+        :param summarize: 要約用プロンプトを受け取り要約文を返す async 関数。None や失敗時は各発言の冒頭を残す
+        """
+        self.topic = topic
+        self.summarize = summarize
+        self.recent_tokens = recent_tokens
+        self.summary_tokens = summary_tokens
+        self.turn_tokens = turn_tokens
+
+        self.turns = []  # (sender, text) の全履歴
+        self.summary = ""
+        self._window_start = 0  # turns のうち、ここから先が要約されていない直近の発言
+        self._token_counts = []
+
+    def append(self, sender: str, text: str):
+        self.turns.append((sender, text))
+        self._token_counts.append(count_tokens(self.__format_turn(sender, text)))
+
+    def last(self) -> tuple:
+        return self.turns[-1] if self.turns else (None, "")
+
+    async def compact(self):
+        """
+        直近の発言が recent_tokens を超えたら、古いものから要約に畳み込む（最新の発言は常に残す）
+        """
+        end = self._window_start
+        window_tokens = sum(self._token_counts[self._window_start:])
+        while window_tokens > self.recent_tokens and end < len(self.turns) - 1:
+            window_tokens -= self._token_counts[end]
+            end += 1
+        if end == self._window_start:
+            return
+
+        evicted = self.turns[self._window_start:end]
+        self._window_start = end
+        turns_text = "\n\n".join(self.__format_turn(sender, text) for sender, text in evicted)
+        summary = None
+        if self.summarize is not None:
+            try:
+                summary = await self.summarize(SUMMARY_UPDATE_PROMPT.format(
+                    max_tokens=self.summary_tokens, summary=self.summary or "（なし）", turns=turns_text,
+                ))
+            except Exception as e:
+                print(f"議論の要約エラー（発言の冒頭を残します）: {e}")
+        if not summary:
+            # 要約できない場合は、各発言の冒頭だけを残す
+            summary = "\n".join(filter(None, [self.summary] + [
+                f"- {sender}: {truncate_to_tokens(text, 100)}" for sender, text in evicted
+            ]))
+        self.summary = truncate_to_tokens(summary.strip(), self.summary_tokens)
+
+    def render(self, token_budget: int, include_topic: bool = True) -> str:
+        """
+        議題・要約・直近の発言を token_budget 以内のテキストにする。
+        入りきらない場合は古い直近発言から落とす（最新の発言は切り詰めてでも残す）
+        """
+        header = []
+        if include_topic:
+            header.append(f"【議題】\n{truncate_to_tokens(self.topic, min(300, token_budget // 4))}")
+        if self.summary:
+            # 要約は残りの半分まで（直近の発言の分を残す）
+            summary_budget = max(0, (token_budget - count_tokens("\n\n".join(header))) // 2)
+            header.append(f"【これまでの議論の要約】\n{truncate_to_tokens(self.summary, summary_budget)}")
+        header_text = "\n\n".join(header)
+        remaining = token_budget - count_tokens(header_text)
+
+        recent = []
+        for sender, text in reversed(self.turns[self._window_start:]):
+            line = self.__format_turn(sender, text)
+            tokens = count_tokens(line)
+            if tokens > remaining:
+                if not recent and remaining > 0:
+                    recent.append(truncate_to_tokens(line, remaining))
+                break
+            recent.append(line)
+            remaining -= tokens
+
+        parts = [header_text] if header_text else []
+        if recent:
+            parts.append("【直近の発言】\n" + "\n\n".join(reversed(recent)))
+        return "\n\n".join(parts)
+
+    def transcript(self) -> str:
+        """
+        全履歴（保存用。プロンプトには render を使う）
+        """
+        return "\n\n".join(f"{sender}: {text}" for sender, text in self.turns)
+
+    # private
+    def __format_turn(self, sender: str, text: str) -> str:
+        return f"{sender}: {truncate_to_tokens(text, self.turn_tokens)}"
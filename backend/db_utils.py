@@ -1,13 +1,291 @@
 import os
+import time
+import atexit
+import threading
+from collections import deque
+from contextlib import contextmanager
+
 import pymysql
 import paramiko
 from sshtunnel import SSHTunnelForwarder
 import inspect
 import pymysql.cursors
 
+# 接続が切れたとみなしてリトライする例外
+RETRYABLE_DB_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError)
+
+
+class SSHTunnel:
+    """
+    プロセス内で共有する SSH トンネル。
+    一度張ったトンネルを使い回し、切れていた場合のみ張り直す。
+    """
+
+    def __init__(self, ssh_host, ssh_port, ssh_user, ssh_key_path, remote_host, remote_port,
+                 local_host, local_port, keepalive_sec: float = 30.0):
+        self.ssh_host = ssh_host
+        self.ssh_port = ssh_port
+        self.ssh_user = ssh_user
+        self.ssh_key_path = ssh_key_path
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.local_host = local_host
+        self.local_port = local_port
+        self.keepalive_sec = keepalive_sec
+
+        self._server = None  # SSHTunnelForwarder インスタンス
+        self._lock = threading.Lock()
+
+    def ensure(self) -> tuple:
+        """
+        トンネルが張られていることを保証し、接続先の (host, port) を返す。
+        """
+        with self._lock:
+            if self._server is not None and not self._server.is_active:
+                print("SSHトンネルが切断されていたため張り直します")
+                self.__stop()
+
+            if self._server is None:
+                pkey = paramiko.RSAKey.from_private_key_file(self.ssh_key_path)
+                server = SSHTunnelForwarder(
+                    (self.ssh_host, self.ssh_port),
+                    ssh_username=self.ssh_user,
+                    ssh_pkey=pkey,
+                    remote_bind_address=(self.remote_host, self.remote_port),
+                    local_bind_address=(self.local_host, self.local_port),
+                    set_keepalive=self.keepalive_sec,
+                )
+                server.start()
+                self._server = server
+                print(f"SSHトンネル開始: local={self.local_host}:{server.local_bind_port} -> remote={self.remote_host}:{self.remote_port}")
+
+            return self.local_host, self._server.local_bind_port
+
+    def close(self):
+        with self._lock:
+            self.__stop()
+
+    def __stop(self):
+        if self._server:
+            try:
+                self._server.stop()
+            except Exception as e:
+                print(f"SSHトンネル停止エラー: {e}")
+            print("SSHトンネルを停止しました")
+            self._server = None
+
+
+class ConnectionPool:
+    """
+    上限付きの MySQL コネクションプール。
+    - 一定時間使われていない接続は貸し出し前に破棄する（max idle）
+    - しばらく使われていない接続は貸し出し前に ping で死活確認する
+    - 壊れた接続は返却時に破棄し、次回は新しく接続する
+    """
+
+    def __init__(self, connect, max_size: int = 5, max_idle_sec: float = 300.0,
+                 health_check_interval_sec: float = 30.0, acquire_timeout_sec: float = 30.0):
+        """
+        :param connect: 新しい接続を作る関数
+        """
+        self._connect = connect
+        self.max_size = max_size
+        self.max_idle_sec = max_idle_sec
+        self.health_check_interval_sec = health_check_interval_sec
+        self.acquire_timeout_sec = acquire_timeout_sec
+
+        self._idle = deque()  # (conn, last_used) 右端が直近に返却された接続
+        self._size = 0  # 貸し出し中 + 待機中の接続数
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """
+        接続を借りる。空きがなければ acquire_timeout_sec まで待つ。
+        """
+        deadline = time.monotonic() + self.acquire_timeout_sec
+        while True:
+            conn, last_used, expired = self.__take(deadline)
+            for stale in expired:
+                self.__close_quietly(stale)
+
+            if conn is None:
+                try:
+                    return self._connect()
+                except Exception:
+                    self.__forget()
+                    raise
+
+            if time.monotonic() - last_used < self.health_check_interval_sec or self.__is_healthy(conn):
+                return conn
+            self.discard(conn)
+
+    def release(self, conn, broken: bool = False):
+        """
+        接続を返却する。broken=True の場合は破棄する。
+        """
+        if broken:
+            self.discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def discard(self, conn):
+        self.__close_quietly(conn)
+        self.__forget()
+
+    def clear_idle(self):
+        """
+        待機中の接続をすべて破棄する（トンネル断などで一斉に死んだとき用）。
+        """
+        with self._cond:
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self.__close_quietly(conn)
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except RETRYABLE_DB_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    # private
+    def __take(self, deadline: float):
+        """
+        待機中の接続を1つ取り出す。新規作成すべき場合は conn=None を返す。
+        """
+        with self._cond:
+            while True:
+                expired = self.__evict_expired_locked()
+                if self._idle:
+                    conn, last_used = self._idle.pop()  # LIFO: 直近に使った接続を優先
+                    return conn, last_used, expired
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None, 0.0, expired
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("DB接続プールの空き待ちがタイムアウトしました")
+                self._cond.wait(remaining)
+
+    def __evict_expired_locked(self) -> list:
+        now = time.monotonic()
+        expired = []
+        while self._idle and now - self._idle[0][1] >= self.max_idle_sec:
+            expired.append(self._idle.popleft()[0])
+            self._size -= 1
+        return expired
+
+    def __forget(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def __is_healthy(conn) -> bool:
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def __close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+# ===============================
+# プロセス共有のトンネル / プール
+# ===============================
+_shared_lock = threading.Lock()
+_shared_tunnel = None
+_shared_pool = None
+
+
+def _get_shared_pool(db: "DBClient"):
+    """
+    プロセス内で1つだけトンネルとプールを作り、以降は使い回す。
+    """
+    global _shared_tunnel, _shared_pool
+    with _shared_lock:
+        if _shared_pool is None:
+            tunnel = SSHTunnel(
+                db.ssh_host, db.ssh_port, db.ssh_user, db.ssh_key_path,
+                db.remote_host, db.remote_port, db.local_host, db.local_port,
+                keepalive_sec=float(os.getenv("SSH_KEEPALIVE_SEC", "30")),
+            )
+
+            def connect():
+                host, port = tunnel.ensure()
+                return pymysql.connect(
+                    host=host,
+                    port=port,
+                    user=db.db_user,
+                    password=db.db_password,
+                    db=db.db_name,
+                    charset="utf8mb4",
+                    cursorclass=pymysql.cursors.DictCursor,
+                    connect_timeout=int(os.getenv("DB_CONNECT_TIMEOUT_SEC", "10")),
+                    # 接続を使い回すため、トランザクションのスナップショットが古いまま残らないようにする
+                    autocommit=True,
+                )
+
+            _shared_tunnel = tunnel
+            _shared_pool = ConnectionPool(
+                connect,
+                max_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                max_idle_sec=float(os.getenv("DB_POOL_MAX_IDLE_SEC", "300")),
+                health_check_interval_sec=float(os.getenv("DB_POOL_HEALTH_CHECK_SEC", "30")),
+                acquire_timeout_sec=float(os.getenv("DB_POOL_TIMEOUT_SEC", "30")),
+            )
+        return _shared_tunnel, _shared_pool
+
+
+def close_shared_pool():
+    """
+    共有プールとトンネルを閉じる（プロセス終了時）。
+    """
+    global _shared_tunnel, _shared_pool
+    with _shared_lock:
+        if _shared_pool is not None:
+            _shared_pool.clear_idle()
+            _shared_pool = None
+        if _shared_tunnel is not None:
+            _shared_tunnel.close()
+            _shared_tunnel = None
+
+
+def _reset_shared_pool_after_fork():
+    """
+    fork した子プロセス（gunicorn のワーカーなど）では親のトンネル・接続を使わず、必要になったら作り直す。
+    親のソケットを閉じないよう、参照を捨てるだけにする
+    """
+    global _shared_lock, _shared_tunnel, _shared_pool
+    _shared_lock = threading.Lock()
+    _shared_tunnel = None
+    _shared_pool = None
+
+
+atexit.register(close_shared_pool)
+os.register_at_fork(after_in_child=_reset_shared_pool_after_fork)
+
+
 class DBClient:
     """
     Aurora MySQL への接続クライアント（SSHポートフォワーディングを使用）。
+    トンネルとコネクションはプロセス内で共有し、各メソッドはプールから借りて返す。
     """
 
     def __init__(self):
@@ -26,7 +304,7 @@ class DBClient:
         self.db_password = os.getenv("DB_PASSWORD", "")
         self.db_name = os.getenv("DB_NAME", "my_database")
 
-        self.server = None  # SSHTunnelForwarder インスタンス
+        self.tunnel, self.pool = _get_shared_pool(self)
 
     # ========== 以下は実際のDB操作例 ==========
     def fetch_channel_id_by(self, youtube_video_id: str) -> str:
@@ -34,60 +312,29 @@ class DBClient:
         指定された動画IDからチャンネルIDを取得
         """
         sql = "SELECT channel_id FROM videos WHERE youtube_video_id = %s LIMIT 1"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (youtube_video_id,))
-                row = cur.fetchone()
-                return row["channel_id"] if row else None
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        row = self.__fetch_one(sql, (youtube_video_id,))
+        return row["channel_id"] if row else None
 
     def fetch_channel_data_by_id(self, channel_id: str):
         """
         チャンネルID からチャンネル情報を取得する例
         """
         sql = "SELECT youtube_channel_id, title, description, published_at, branding_keywords, metadata FROM channels WHERE id = %s"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (channel_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (channel_id,))
 
     def fetch_channel_data_by_youtube_channel_id(self, channel_id: str):
         """
         youtube_チャンネルID からチャンネル情報を取得する例
         """
         sql = "SELECT id, youtube_channel_id, title, description, published_at, branding_keywords, metadata FROM channels WHERE youtube_channel_id = %s"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (channel_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (channel_id,))
 
     def fetch_video_data(self, youtube_video_id: str):
         """
         指定された動画IDから動画データを取得
         """
         sql = "SELECT v.youtube_video_id as youtube_video_id, v.title as title, v.title_keywords as title_keywords, v.description as description, v.metadata as metadata, v.published_at as published_at, pv.is_sponsored as is_sponsored, pv.product_id as product_id FROM videos v left join product_videos pv on v.id = pv.video_id WHERE youtube_video_id = %s"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (youtube_video_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (youtube_video_id,))
 
     # product_idを元に他のスポンサード動画の情報を取得（投稿日降順、上位10件）
     def fetch_other_product_videos(self, product_id: str):
@@ -106,120 +353,156 @@ class DBClient:
             ORDER BY v.published_at DESC
             LIMIT 10
         """
-        conn = self.__get_connection()
-        try:
-            # ✅ `DictCursor` を使って辞書形式で取得
-            with conn.cursor(pymysql.cursors.DictCursor) as cur:
-                cur.execute(sql, (product_id,))
-                rows = cur.fetchall()  # `fetchone()` ではなく `fetchall()` に変更
-                return rows  # ✅ 複数行をリストで返す
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        # ✅ 複数行をリストで返す
+        return self.__fetch_all(sql, (product_id,))
 
     def fetch_age_demogra_data(self, channel_id: str):
         """
         指定された動画IDからデモグラフィックデータを取得
         """
         sql = "SELECT * FROM channel_age_predictions WHERE channel_id = %s"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (channel_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (channel_id,))
 
     def fetch_gender_demogra_data(self, channel_id: str):
         """
         指定された動画IDからデモグラフィックデータを取得
         """
         sql = "SELECT * FROM channel_gender_predictions WHERE channel_id = %s"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (channel_id,))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (channel_id,))
 
     def fetch_video_stats(self, youtube_video_id: str, days: int = 5):
         video_id = self.__fetch_video_id(youtube_video_id)
         sql = "SELECT * FROM video_statistics WHERE video_id = %s AND update_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY) ORDER BY update_date DESC"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (video_id, days))
-                row = cur.fetchone()
-                return row
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        return self.__fetch_one(sql, (video_id, days))
 
-    # private
-    def __setup_port_forwarding(self):
+    def fetch_comment_analysis_bundle(self, youtube_video_id: str):
         """
-        SSHポートフォワーディングをセットアップし、SSHTunnelForwarderを返す。
+        コメント分析に必要な動画・チャンネル・デモグラデータを1クエリでまとめて取得
         """
-        pkey = paramiko.RSAKey.from_private_key_file(self.ssh_key_path)
+        sql = """
+            SELECT v.id AS video_id,
+                v.youtube_video_id AS youtube_video_id,
+                v.title AS title,
+                v.title_keywords AS title_keywords,
+                v.description AS description,
+                v.metadata AS metadata,
+                v.published_at AS published_at,
+                pv.is_sponsored AS is_sponsored,
+                pv.product_id AS product_id,
+                c.id AS channel_id,
+                c.youtube_channel_id AS youtube_channel_id,
+                c.title AS channel_title,
+                c.description AS channel_description,
+                c.published_at AS channel_published_at,
+                c.branding_keywords AS channel_branding_keywords,
+                c.metadata AS channel_metadata,
+                a.prediction_age_13_17 AS prediction_age_13_17,
+                a.prediction_age_18_24 AS prediction_age_18_24,
+                a.prediction_age_25_34 AS prediction_age_25_34,
+                a.prediction_age_35_44 AS prediction_age_35_44,
+                a.prediction_age_45_54 AS prediction_age_45_54,
+                a.prediction_age_55_64 AS prediction_age_55_64,
+                a.prediction_age_65_ AS prediction_age_65_,
+                g.prediction_rate AS prediction_rate
+            FROM videos v
+            JOIN channels c ON v.channel_id = c.id
+            LEFT JOIN product_videos pv ON v.id = pv.video_id
+            LEFT JOIN channel_age_predictions a ON a.channel_id = c.id
+            LEFT JOIN channel_gender_predictions g ON g.channel_id = c.id
+            WHERE v.youtube_video_id = %s
+            LIMIT 1
+        """
+        return self.__fetch_one(sql, (youtube_video_id,))
 
-        server = SSHTunnelForwarder(
-            (self.ssh_host, self.ssh_port),
-            ssh_username=self.ssh_user,
-            ssh_pkey=pkey,
-            remote_bind_address=(self.remote_host, self.remote_port),
-            local_bind_address=(self.local_host, self.local_port)
-        )
-        return server
+    def fetch_video_stats_by_video_id(self, video_id: int, days: int = 5):
+        """
+        内部の動画ID（videos.id）から直近の統計データを取得
+        """
+        sql = "SELECT * FROM video_statistics WHERE video_id = %s AND update_date >= DATE_SUB(CURDATE(), INTERVAL %s DAY) ORDER BY update_date DESC"
+        return self.__fetch_one(sql, (video_id, days))
+
+    def fetch_youtube_channel_ids_by_youtube_video_ids(self, youtube_video_ids: list) -> dict:
+        """
+        複数の動画IDから youtube_channel_id を1クエリで取得し、{youtube_video_id: youtube_channel_id} で返す
+        """
+        if not youtube_video_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(youtube_video_ids))
+        sql = f"""
+            SELECT v.youtube_video_id AS youtube_video_id,
+                c.youtube_channel_id AS youtube_channel_id
+            FROM videos v
+            JOIN channels c ON v.channel_id = c.id
+            WHERE v.youtube_video_id IN ({placeholders})
+        """
+        rows = self.__fetch_all(sql, tuple(youtube_video_ids))
+        return {row["youtube_video_id"]: row["youtube_channel_id"] for row in rows}
 
-    def __get_connection(self):
+    def fetch_channels_with_demogra_by_youtube_channel_ids(self, youtube_channel_ids: list) -> dict:
         """
-        SSHトンネルを開始し、ローカルポート経由で Aurora MySQL に接続する。
+        複数の youtube_channel_id についてチャンネル情報と年齢・性別予測を1クエリで取得し、
+        {youtube_channel_id: row} で返す
         """
-        if not self.server:
-            self.server = self.__setup_port_forwarding()
+        if not youtube_channel_ids:
+            return {}
+        placeholders = ", ".join(["%s"] * len(youtube_channel_ids))
+        sql = f"""
+            SELECT c.id AS id,
+                c.youtube_channel_id AS youtube_channel_id,
+                c.title AS title,
+                c.description AS description,
+                c.published_at AS published_at,
+                c.branding_keywords AS branding_keywords,
+                c.metadata AS metadata,
+                a.prediction_age_13_17 AS prediction_age_13_17,
+                a.prediction_age_18_24 AS prediction_age_18_24,
+                a.prediction_age_25_34 AS prediction_age_25_34,
+                a.prediction_age_35_44 AS prediction_age_35_44,
+                a.prediction_age_45_54 AS prediction_age_45_54,
+                a.prediction_age_55_64 AS prediction_age_55_64,
+                a.prediction_age_65_ AS prediction_age_65_,
+                g.prediction_rate AS prediction_rate
+            FROM channels c
+            LEFT JOIN channel_age_predictions a ON a.channel_id = c.id
+            LEFT JOIN channel_gender_predictions g ON g.channel_id = c.id
+            WHERE c.youtube_channel_id IN ({placeholders})
+        """
+        rows = self.__fetch_all(sql, tuple(dict.fromkeys(youtube_channel_ids)))
+        channels = {}
+        for row in rows:
+            # 予測が複数行ある場合は最初の1行を使う（単体取得の fetchone と同じ）
+            channels.setdefault(row["youtube_channel_id"], row)
+        return channels
 
-        # トンネル開始
-        self.server.start()
-        print(f"SSHトンネル開始: local={self.local_host}:{self.local_port} -> remote={self.remote_host}:{self.remote_port}")
+    # private
+    def __fetch_one(self, sql: str, params: tuple):
+        return self.__execute(sql, params, lambda cur: cur.fetchone())
 
-        # self.local_host / self.local_port を使って MySQL に接続
-        conn = pymysql.connect(
-            host=self.local_host,
-            port=self.local_port,
-            user=self.db_user,
-            password=self.db_password,
-            db=self.db_name,
-            charset="utf8mb4",
-            cursorclass=pymysql.cursors.DictCursor
-        )
-        return conn
+    def __fetch_all(self, sql: str, params: tuple):
+        return self.__execute(sql, params, lambda cur: cur.fetchall())
 
-    def __close_tunnel(self):
+    def __execute(self, sql: str, params: tuple, fetch):
         """
-        SSHトンネルを停止する。
+        プールから接続を借りてクエリを実行する。
+        接続が切れていた場合はトンネルの状態を確認して1回だけリトライする。
         """
-        if self.server:
-            self.server.stop()
-            print("SSHトンネルを停止しました")
-            self.server = None
-
+        for attempt in range(2):
+            try:
+                with self.pool.connection() as conn:
+                    with conn.cursor() as cur:
+                        cur.execute(sql, params)
+                        return fetch(cur)
+            except RETRYABLE_DB_ERRORS as e:
+                if attempt > 0:
+                    raise
+                print(f"DB接続エラーのため再接続します: {e}")
+                # 同じトンネル経由の待機中接続も死んでいる可能性が高いので捨てる
+                self.pool.clear_idle()
 
     def __fetch_video_id(self, youtube_video_id: str) -> str:
         """
         指定された動画IDからyotuube_video_idを取得
         """
         sql = "SELECT id FROM videos WHERE youtube_video_id = %s LIMIT 1"
-        conn = self.__get_connection()
-        try:
-            with conn.cursor() as cur:
-                cur.execute(sql, (youtube_video_id,))
-                row = cur.fetchone()
-                return row["id"] if row else None
-        finally:
-            conn.close()
-            self.__close_tunnel()
+        row = self.__fetch_one(sql, (youtube_video_id,))
+        return row["id"] if row else None
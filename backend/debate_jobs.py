@@ -0,0 +1,650 @@
+import os
+import json
+import time
+import uuid
+import socket
+import asyncio
+import threading
+
+# 同時に進める議論の数と、終わったジョブ（フレーム）を保持する秒数
+DEBATE_WORKERS = int(os.getenv("DEBATE_WORKERS", "4"))
+DEBATE_JOB_TTL_SEC = float(os.getenv("DEBATE_JOB_TTL_SEC", str(24 * 60 * 60)))
+# 期限切れのジョブを削除する間隔（プロセス内のストアのみ。Redis は TTL で消える）
+DEBATE_PURGE_INTERVAL_SEC = float(os.getenv("DEBATE_PURGE_INTERVAL_SEC", "300"))
+# フレーム待ちの最大秒数（この間隔でジョブの状態も確認する）
+DEBATE_FOLLOW_POLL_SEC = float(os.getenv("DEBATE_FOLLOW_POLL_SEC", "15"))
+# ジョブの保存先（memory / redis）。複数ワーカーで動かすときは redis にする
+DEBATE_JOB_STORE = os.getenv("DEBATE_JOB_STORE", "memory")
+# 別のワーカーから中止されていないかを確認する間隔
+DEBATE_CANCEL_POLL_SEC = float(os.getenv("DEBATE_CANCEL_POLL_SEC", "2"))
+# ワーカーの生存期限。この間ハートビートが途絶えたワーカーのジョブは、他のワーカーが引き取る
+DEBATE_WORKER_LEASE_SEC = float(os.getenv("DEBATE_WORKER_LEASE_SEC", "30"))
+# 生存期限の間に更新する回数（期限の 1/3 ごとに更新し、2回続けて失敗しても期限は切れない）
+DEBATE_WORKER_LEASE_RENEWALS = 3
+
+TERMINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+class InMemoryJobStore:
+    """
+    議論ジョブの状態と、クライアントに送るフレームをプロセス内に保持する。
+    フレームには発生順に offset を振り、位置を指定して何度でも読み直せる。
+    discard で消したフレーム（発言が終わった後の delta）の offset は欠番になる
+    """
+
+    def __init__(self, ttl_sec: float = DEBATE_JOB_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._jobs = {}
+        self._conditions = {}
+        self._pending = None  # 実行待ちの job_id
+
+    async def enqueue(self, job_id: str):
+        self.__pending().put_nowait(job_id)
+
+    async def dequeue(self, timeout: float):
+        """
+        実行待ちのジョブを1つ取り出す。timeout 秒待ってもなければ None
+        """
+        try:
+            return await asyncio.wait_for(self.__pending().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        self._jobs[job_id] = {
+            "id": job_id, "status": "queued", "params": params, "error": None, "cancel_requested": False,
+            "created_at": now, "updated_at": now, "next_offset": 0, "frames": {},
+        }
+        self._conditions[job_id] = asyncio.Condition()
+        return job_id
+
+    async def get(self, job_id: str):
+        """
+        ジョブの情報（フレーム本体は含まず、次に振る offset の next_offset だけ）。なければ None
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {key: value for key, value in job.items() if key != "frames"}
+
+    async def append(self, job_id: str, frame: dict) -> int:
+        """
+        フレームを追記し、その offset を返す
+        """
+        job = self._jobs[job_id]
+        offset = job["next_offset"]
+        job["frames"][offset] = frame
+        job["next_offset"] += 1
+        job["updated_at"] = time.time()
+        await self.__notify(job_id)
+        return offset
+
+    async def discard(self, job_id: str, offsets: list):
+        """
+        不要になったフレームを消す（offset は振り直さない）
+        """
+        frames = self._jobs[job_id]["frames"]
+        for offset in offsets:
+            frames.pop(offset, None)
+
+    async def set_status(self, job_id: str, status: str, error: str = None):
+        job = self._jobs[job_id]
+        job["status"] = status
+        job["error"] = error
+        job["updated_at"] = time.time()
+        await self.__notify(job_id)
+
+    async def request_cancel(self, job_id: str):
+        self._jobs[job_id]["cancel_requested"] = True
+        await self.__notify(job_id)
+
+    async def frames(self, job_id: str, offset: int = 0, limit: int = None) -> tuple:
+        """
+        offset 以降のフレームを読む
+
+        :return: ([(offset, frame), ...], 次に読む offset)
+        """
+        job = self._jobs[job_id]
+        frames = [(frame_offset, frame) for frame_offset, frame in job["frames"].items() if frame_offset >= offset]
+        if limit is not None and len(frames) > limit:
+            frames = frames[:limit]
+            return frames, frames[-1][0] + 1 if frames else offset
+        return frames, max(offset, job["next_offset"])
+
+    async def wait(self, job_id: str, offset: int, timeout: float):
+        """
+        offset 以降のフレームが増えるか、状態が変わるまで（最大 timeout 秒）待つ
+        """
+        condition = self._conditions[job_id]
+        job = self._jobs[job_id]
+        async with condition:
+            if job["next_offset"] > offset or job["status"] in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(condition.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def start_heartbeat(self):
+        pass  # 同じプロセスの中だけで動くので、生存確認は要らない
+
+    async def finish(self, job_id: str):
+        pass
+
+    async def reap(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def purge_expired(self):
+        """
+        終了してから ttl_sec を過ぎたジョブを削除する
+        """
+        now = time.time()
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job["status"] in TERMINAL_STATUSES and now - job["updated_at"] > self.ttl_sec]:
+            del self._jobs[job_id]
+            del self._conditions[job_id]
+
+    # private
+    def __pending(self) -> asyncio.Queue:
+        if self._pending is None:
+            self._pending = asyncio.Queue()
+        return self._pending
+
+    async def __notify(self, job_id: str):
+        condition = self._conditions[job_id]
+        async with condition:
+            condition.notify_all()
+
+
+# offset の採番・フレームの追加・状態の更新・通知を1回でまとめて行う（読み手に欠番と区別のつかない途中状態を見せない）
+_REDIS_APPEND_SCRIPT = """
+local offset = redis.call('HINCRBY', KEYS[1], 'next_offset', 1) - 1
+redis.call('ZADD', KEYS[2], offset, offset .. ':' .. ARGV[1])
+redis.call('HSET', KEYS[1], 'updated_at', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('PUBLISH', KEYS[3], '1')
+return offset
+"""
+
+
+# 実行していたワーカー（ARGV[1]）の生存期限が切れていて、まだそのワーカーの実行中なら failed にする。
+# 0: ワーカーが生きている、1: failed にした、-1: 既に終わっている・別のワーカーが実行している
+_REDIS_FAIL_ORPHAN_SCRIPT = """
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    return 0
+end
+if redis.call('HGET', KEYS[1], 'status') ~= 'running' or redis.call('HGET', KEYS[1], 'owner') ~= ARGV[1] then
+    return -1
+end
+redis.call('HSET', KEYS[1], 'status', 'failed', 'error', ARGV[2], 'updated_at', ARGV[3])
+redis.call('PUBLISH', KEYS[3], '1')
+return 1
+"""
+
+
+class RedisJobStore:
+    """
+    議論ジョブを Redis に保存する。実行待ちの行列・状態・フレームを複数のワーカープロセスで共有するので、
+    どのワーカーがジョブを実行していても、どのワーカーに接続しても続きを受け取れる
+    - {prefix}{job_id}: 状態（hash）、{prefix}{job_id}:frames: フレーム（offset をスコアにした sorted set）、
+      {prefix}queue: 実行待ち（list）
+    - フレームの追加・状態の変更は {prefix}{job_id}:events に publish して待っている接続を起こす
+    - 取り出したジョブは、終わるまでワーカーごとの {prefix}processing:{worker_id}（list）に置く。
+      ワーカーは {prefix}worker:{worker_id}（期限 lease_sec）をイベントループとは別のスレッドで更新し続け、
+      期限が切れたワーカーのジョブは生きているワーカーが引き取る（実行前なら行列に戻し、実行中なら failed にする）
+    - 実行中のジョブの owner には実行しているワーカーを記録し、failed にする直前にも owner の期限切れを確かめる
+    - フレームを待つ接続は、プロセスで1つの購読（{prefix}*:events）を共有する
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "magi:debate:",
+                 ttl_sec: float = DEBATE_JOB_TTL_SEC, lease_sec: float = DEBATE_WORKER_LEASE_SEC):
+        self.url = url
+        self.prefix = prefix
+        self.ttl_sec = ttl_sec
+        self.lease_sec = lease_sec
+        self._redis = None
+        self._append_script = None
+        self._fail_orphan_script = None
+        self._worker_id = None
+        self._heartbeat_thread = None
+        self._heartbeat_stop = threading.Event()
+        self._pubsub = None
+        self._listener = None
+        self._waiters = {}  # job_id -> フレーム待ちの asyncio.Event の集合
+
+    async def enqueue(self, job_id: str):
+        await self.__client().lpush(self.prefix + "queue", job_id)
+
+    async def dequeue(self, timeout: float):
+        """
+        実行待ちのジョブを1つ取り出し、このワーカーの processing に移す（finish を呼ぶまで残る）
+        """
+        return await self.__client().blmove(
+            self.prefix + "queue", self.__processing_key(self.__worker()), max(1, int(timeout)), "RIGHT", "LEFT"
+        )
+
+    async def create(self, params: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        async with self.__client().pipeline(transaction=True) as pipe:
+            pipe.hset(self.__key(job_id), mapping={
+                "id": job_id, "status": "queued", "params": json.dumps(params, ensure_ascii=False), "error": "",
+                "cancel_requested": 0, "created_at": now, "updated_at": now, "next_offset": 0,
+            })
+            pipe.expire(self.__key(job_id), int(self.ttl_sec))
+            await pipe.execute()
+        return job_id
+
+    async def get(self, job_id: str):
+        meta = await self.__client().hgetall(self.__key(job_id))
+        if not meta:
+            return None
+        return {
+            "id": meta["id"],
+            "status": meta["status"],
+            "params": json.loads(meta["params"]),
+            "error": meta["error"] or None,
+            "cancel_requested": meta["cancel_requested"] == "1",
+            "created_at": float(meta["created_at"]),
+            "updated_at": float(meta["updated_at"]),
+            "next_offset": int(meta.get("next_offset", 0)),
+        }
+
+    async def append(self, job_id: str, frame: dict) -> int:
+        self.__client()
+        return int(await self._append_script(
+            keys=[self.__key(job_id), self.__frames_key(job_id), self.__events_key(job_id)],
+            args=[json.dumps(frame, ensure_ascii=False), time.time(), int(self.ttl_sec)],
+        ))
+
+    async def discard(self, job_id: str, offsets: list):
+        if not offsets:
+            return
+        async with self.__client().pipeline(transaction=False) as pipe:
+            for offset in offsets:
+                pipe.zremrangebyscore(self.__frames_key(job_id), offset, offset)
+            await pipe.execute()
+
+    async def set_status(self, job_id: str, status: str, error: str = None):
+        fields = {"status": status, "error": error or ""}
+        if status == "running":
+            fields["owner"] = self.__worker()  # 引き取るときに、実行していたワーカーかどうかを確かめる
+        async with self.__client().pipeline(transaction=True) as pipe:
+            self.__touch(pipe, job_id, fields)
+            await pipe.execute()
+
+    async def request_cancel(self, job_id: str):
+        async with self.__client().pipeline(transaction=True) as pipe:
+            self.__touch(pipe, job_id, {"cancel_requested": 1})
+            await pipe.execute()
+
+    async def frames(self, job_id: str, offset: int = 0, limit: int = None) -> tuple:
+        async with self.__client().pipeline(transaction=True) as pipe:
+            if limit is None:
+                pipe.zrangebyscore(self.__frames_key(job_id), offset, "+inf")
+            else:
+                pipe.zrangebyscore(self.__frames_key(job_id), offset, "+inf", start=0, num=limit)
+            pipe.hget(self.__key(job_id), "next_offset")
+            members, next_offset = await pipe.execute()
+        frames = []
+        for member in members:
+            frame_offset, _, raw = member.partition(":")
+            frames.append((int(frame_offset), json.loads(raw)))
+        if limit is not None and len(frames) == limit:
+            return frames, frames[-1][0] + 1 if frames else offset
+        return frames, max(offset, int(next_offset or 0))
+
+    async def wait(self, job_id: str, offset: int, timeout: float):
+        await self.__listen_events()
+        event = asyncio.Event()
+        self._waiters.setdefault(job_id, set()).add(event)
+        try:
+            # 待ち受けを登録してから確認する（確認と登録の間に追加されたフレームを取りこぼさないように）
+            job = await self.get(job_id)
+            if job is None or job["next_offset"] > offset or job["status"] in TERMINAL_STATUSES:
+                return
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            waiters = self._waiters.get(job_id)
+            waiters.discard(event)
+            if not waiters:
+                del self._waiters[job_id]
+
+    async def start_heartbeat(self):
+        """
+        生存期限の更新を始める。イベントループが長く止まっても期限が切れないよう、専用のスレッドで同期クライアントを使う
+        """
+        if self._heartbeat_thread is not None:
+            return
+        import redis  # Redis を使うときだけ必要
+
+        client = redis.Redis.from_url(self.url, decode_responses=True)
+        await asyncio.to_thread(self.__renew_lease, client)  # ジョブを取り出す前に生存を示しておく
+        self._heartbeat_stop.clear()
+        self._heartbeat_thread = threading.Thread(
+            target=self.__heartbeat_loop, args=(client,), name="debate-worker-heartbeat", daemon=True
+        )
+        self._heartbeat_thread.start()
+
+    async def finish(self, job_id: str):
+        """
+        取り出したジョブの処理が終わったので processing から外す
+        """
+        await self.__client().lrem(self.__processing_key(self.__worker()), 1, job_id)
+
+    async def reap(self):
+        """
+        生存期限が切れたワーカーのジョブを引き取る。LMOVE で1件ずつ自分の processing に移すので、
+        複数のワーカーが同時に reap しても同じジョブを二重に扱わない
+        """
+        client = self.__client()
+        mine = self.__processing_key(self.__worker())
+        for worker_id in await client.smembers(self.prefix + "workers"):
+            if worker_id == self.__worker() or await client.exists(self.__lease_key(worker_id)):
+                continue
+            dead = self.__processing_key(worker_id)
+            while (job_id := await client.lmove(dead, mine, "RIGHT", "LEFT")) is not None:
+                job = await self.get(job_id)
+                if job is not None and job["status"] == "queued":
+                    # 実行前だったので、次に取り出されるように行列の先頭へ戻す
+                    async with client.pipeline(transaction=True) as pipe:
+                        pipe.rpush(self.prefix + "queue", job_id)
+                        pipe.lrem(mine, 1, job_id)
+                        await pipe.execute()
+                    print(f"停止したワーカー {worker_id} の議論ジョブを行列に戻しました: {job_id}")
+                    continue
+                error = f"議論を実行していたワーカーが停止しました: {worker_id}"
+                # owner の期限切れと状態を確かめてから failed にする（1つのスクリプトで行うので、その間に復帰しても誤らない）
+                failed = int(await self._fail_orphan_script(
+                    keys=[self.__key(job_id), self.__lease_key(worker_id), self.__events_key(job_id)],
+                    args=[worker_id, error, time.time()],
+                ))
+                if failed == 0:
+                    # ワーカーが復帰していた（イベントループが一時的に止まっていただけ）。ジョブは返す
+                    async with client.pipeline(transaction=True) as pipe:
+                        pipe.lrem(mine, 1, job_id)
+                        pipe.rpush(dead, job_id)
+                        await pipe.execute()
+                    print(f"ワーカー {worker_id} が復帰したため、議論ジョブを引き取りません: {job_id}")
+                    break
+                if failed == 1:
+                    await self.append(job_id, {"type": "error", "sender": "system", "text": f"サーバーエラー: {error}"})
+                    print(f"停止したワーカー {worker_id} の議論ジョブを失敗にしました: {job_id}")
+                await client.lrem(mine, 1, job_id)
+            else:
+                await client.srem(self.prefix + "workers", worker_id)
+
+    async def close(self):
+        """
+        生存期限の更新と、フレーム待ちの購読を止める
+        """
+        if self._heartbeat_thread is not None:
+            self._heartbeat_stop.set()
+            await asyncio.to_thread(self._heartbeat_thread.join)
+            self._heartbeat_thread = None
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def purge_expired(self):
+        pass  # キーの TTL で消える
+
+    # private
+    def __client(self):
+        if self._redis is None:
+            import redis.asyncio as redis_asyncio  # Redis を使うときだけ必要
+
+            self._redis = redis_asyncio.Redis.from_url(self.url, decode_responses=True)
+            self._append_script = self._redis.register_script(_REDIS_APPEND_SCRIPT)
+            self._fail_orphan_script = self._redis.register_script(_REDIS_FAIL_ORPHAN_SCRIPT)
+        return self._redis
+
+    async def __listen_events(self):
+        """
+        フレームの追加・状態の変更の通知を、プロセスで1つの購読で受け、待っている接続を起こす
+        """
+        if self._listener is not None and not self._listener.done():
+            return
+        if self._pubsub is not None:
+            await self._pubsub.aclose()  # 前の購読が切れていた
+        self._pubsub = self.__client().pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.psubscribe(f"{self.prefix}*:events")
+        self._listener = asyncio.create_task(self.__dispatch_events(self._pubsub))
+
+    async def __dispatch_events(self, pubsub):
+        suffix = len(":events")
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                for event in self._waiters.get(message["channel"][len(self.prefix):-suffix], ()):
+                    event.set()
+        except Exception as e:
+            # 次の wait で購読し直す。それまで待っている接続は timeout ごとに状態を確認する
+            print(f"議論ジョブの通知の購読が切れました: {e}")
+
+    def __heartbeat_loop(self, client):
+        while not self._heartbeat_stop.wait(self.lease_sec / DEBATE_WORKER_LEASE_RENEWALS):
+            try:
+                self.__renew_lease(client)
+            except Exception as e:
+                print(f"議論ワーカーの生存期限の更新エラー: {e}")
+        try:
+            # 止めるときは期限を待たずに消す（残ったジョブはすぐ他のワーカーが引き取る）
+            client.delete(self.__lease_key(self.__worker()))
+            client.close()
+        except Exception as e:
+            print(f"議論ワーカーの生存期限の削除エラー: {e}")
+
+    def __renew_lease(self, client):
+        worker_id = self.__worker()
+        with client.pipeline(transaction=True) as pipe:
+            pipe.set(self.__lease_key(worker_id), time.time(), px=int(self.lease_sec * 1000))
+            pipe.sadd(self.prefix + "workers", worker_id)
+            pipe.execute()
+
+    def __worker(self) -> str:
+        """
+        このプロセスのワーカー ID（fork 後のプロセスごとに別の ID になるよう、最初に使うときに決める）
+        """
+        if self._worker_id is None:
+            self._worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        return self._worker_id
+
+    def __processing_key(self, worker_id: str) -> str:
+        return f"{self.prefix}processing:{worker_id}"
+
+    def __lease_key(self, worker_id: str) -> str:
+        return f"{self.prefix}worker:{worker_id}"
+
+    def __key(self, job_id: str) -> str:
+        return self.prefix + job_id
+
+    def __frames_key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}:frames"
+
+    def __events_key(self, job_id: str) -> str:
+        return f"{self.prefix}{job_id}:events"
+
+    def __touch(self, pipe, job_id: str, fields: dict):
+        """
+        状態を更新し、TTL を延ばして、待っている接続に知らせる
+        """
+        pipe.hset(self.__key(job_id), mapping={**fields, "updated_at": time.time()})
+        pipe.expire(self.__key(job_id), int(self.ttl_sec))
+        pipe.expire(self.__frames_key(job_id), int(self.ttl_sec))
+        pipe.publish(self.__events_key(job_id), "1")
+
+
+def create_job_store():
+    """
+    DEBATE_JOB_STORE（memory / redis）に応じたジョブストアを返す
+    """
+    if DEBATE_JOB_STORE == "redis":
+        return RedisJobStore(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    return InMemoryJobStore()
+
+
+class DebateJobQueue:
+    """
+    議論をバックグラウンドのジョブとして実行する。WebSocket が切れても議論は続き、
+    フレームはジョブストアに残るので、あとから offset を指定して続きを受け取れる。
+    ストリーミングの delta は、その発言の turn_complete（全文）が届いた時点で消す（保持するのは全文だけ）。
+    ストアが Redis なら、どのワーカープロセスのキューからでもジョブを取り出して実行する。
+    ワーカーは生存期限を更新し続け、止まったワーカーのジョブは他のワーカーが引き取る
+    """
+
+    def __init__(self, runner, store=None, workers: int = DEBATE_WORKERS):
+        """
+        :param runner: (params, emit) を受け取る async 関数。emit(frame) でクライアント向けのフレームを出す
+        """
+        self.runner = runner
+        self.store = store or InMemoryJobStore()
+        self.workers = workers
+        self._worker_tasks = []
+        self._running = {}  # job_id -> 実行中の Task
+
+    async def start(self):
+        await self.store.start_heartbeat()  # ジョブを取り出す前に生存を示しておく（他のワーカーに引き取られないように）
+        self._worker_tasks = [asyncio.create_task(self.__work(index)) for index in range(self.workers)]
+        self._worker_tasks.append(asyncio.create_task(self.__reap_periodically()))
+        self._worker_tasks.append(asyncio.create_task(self.__purge_periodically()))
+
+    async def stop(self):
+        for task in [*self._worker_tasks, *self._running.values()]:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, *self._running.values(), return_exceptions=True)
+        self._worker_tasks = []
+        await self.store.close()
+
+    async def submit(self, params: dict) -> str:
+        job_id = await self.store.create(params)
+        await self.store.enqueue(job_id)
+        return job_id
+
+    async def cancel(self, job_id: str) -> bool:
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in TERMINAL_STATUSES:
+            return False
+        task = self._running.get(job_id)
+        if task is not None:
+            task.cancel()
+        elif job["status"] == "queued":
+            await self.store.set_status(job_id, "cancelled")
+        else:
+            await self.store.request_cancel(job_id)  # 別のワーカーで実行中
+        return True
+
+    async def follow(self, job_id: str, offset: int = 0):
+        """
+        offset 以降のフレームを (offset, frame) で yield し、ジョブが終わるまで新しいフレームを待ち続ける
+        """
+        while True:
+            frames, next_offset = await self.store.frames(job_id, offset)
+            for frame_offset, frame in frames:
+                yield frame_offset, frame
+            offset = next_offset
+            job = await self.store.get(job_id)
+            if job is None or (job["status"] in TERMINAL_STATUSES and job["next_offset"] <= offset):
+                return
+            await self.store.wait(job_id, offset, DEBATE_FOLLOW_POLL_SEC)
+
+    # private
+    async def __work(self, index: int):
+        while True:
+            try:
+                job_id = await self.store.dequeue(DEBATE_FOLLOW_POLL_SEC)
+                if job_id is None:
+                    continue
+                try:
+                    job = await self.store.get(job_id)
+                    if job is None or job["status"] != "queued":
+                        continue  # 実行前にキャンセルされた
+                    await self.__run(job)
+                finally:
+                    await asyncio.shield(self.store.finish(job_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"議論ワーカー{index}のエラー: {e}")
+                await asyncio.sleep(1)
+
+    async def __run(self, job: dict):
+        job_id = job["id"]
+        print(f"議論ジョブを開始します: {job_id}")
+        await self.store.set_status(job_id, "running")
+
+        delta_offsets = {}  # turnId -> その発言の delta の offset
+
+        async def emit(frame: dict):
+            offset = await self.store.append(job_id, frame)
+            if frame.get("type") == "delta":
+                delta_offsets.setdefault(frame["turnId"], []).append(offset)
+            elif frame.get("type") == "turn_complete":
+                # 全文が届いたので、途中の delta は再送用に残さない
+                await self.store.discard(job_id, delta_offsets.pop(frame["turnId"], []))
+
+        task = asyncio.create_task(self.runner(job["params"], emit))
+        self._running[job_id] = task
+        watcher = asyncio.create_task(self.__watch_cancel(job_id, task))
+        try:
+            await task
+            await self.store.set_status(job_id, "completed")
+        except asyncio.CancelledError:
+            await self.store.set_status(job_id, "cancelled")
+            if asyncio.current_task().cancelling():
+                raise  # ワーカー自身の停止（stop）。議論だけの中止なら次のジョブへ
+        except Exception as e:
+            print(f"議論ジョブのエラー: {job_id} {e}")
+            await self.store.append(job_id, {"type": "error", "sender": "system", "text": f"サーバーエラー: {e}"})
+            await self.store.set_status(job_id, "failed", str(e))
+        finally:
+            watcher.cancel()
+            self._running.pop(job_id, None)
+
+    async def __watch_cancel(self, job_id: str, task: asyncio.Task):
+        """
+        別のワーカーで受け付けた中止要求を確認し、実行中の議論を止める
+        """
+        while not task.done():
+            await asyncio.sleep(DEBATE_CANCEL_POLL_SEC)
+            try:
+                job = await self.store.get(job_id)
+            except Exception as e:
+                print(f"議論ジョブの状態取得エラー: {job_id} {e}")
+                continue
+            if job is not None and job["cancel_requested"]:
+                task.cancel()
+                return
+
+    async def __reap_periodically(self):
+        """
+        止まったワーカーのジョブを引き取る（生存期限の更新はストアが別のスレッドで行う）
+        """
+        while True:
+            await asyncio.sleep(DEBATE_WORKER_LEASE_SEC / DEBATE_WORKER_LEASE_RENEWALS)
+            try:
+                await self.store.reap()
+            except Exception as e:
+                print(f"議論ワーカーの生存確認エラー: {e}")
+
+    async def __purge_periodically(self):
+        while True:
+            await asyncio.sleep(DEBATE_PURGE_INTERVAL_SEC)
+            try:
+                await self.store.purge_expired()
+            except Exception as e:
+                print(f"議論ジョブの削除エラー: {e}")
@@ -0,0 +1,28 @@
+import os
+import multiprocessing
+
+# ===============================
+# 複数ワーカーでの起動設定（gunicorn -c gunicorn.conf.py main:app）
+# - ワーカーごとにイベントループを持つので、CPU コアをすべて使える
+# - キャッシュと議論ジョブは Redis で共有する（CACHE_BACKEND=redis / DEBATE_JOB_STORE=redis）
+# - プロバイダ・DB・S3・HTTP のクライアントは fork 後に各ワーカーで作る
+# ===============================
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8001")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn_worker.UvicornWorker"
+# 議論は WebSocket で長くつながるので、再起動時は進行中の接続を少し待つ
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT_SEC", "30"))
+timeout = int(os.getenv("GUNICORN_TIMEOUT_SEC", "120"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE_SEC", "5"))
+reload = os.getenv("GUNICORN_RELOAD", "0") in ("1", "true", "True")
+accesslog = "-"
+
+if workers > 1:
+    # SSH トンネルのローカルポートを固定するとワーカー同士でぶつかるので、空いているポートを使う
+    os.environ["LOCAL_PORT"] = "0"
+    # サムネイル解析のプロセスプールはワーカーごとに作られるので、合計がコア数になるように分ける
+    os.environ.setdefault("THUMBNAIL_ANALYSIS_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+
+    for name in ("CACHE_BACKEND", "DEBATE_JOB_STORE"):
+        if os.getenv(name, "memory") != "redis":
+            print(f"{name}={os.getenv(name, 'memory')} のため、キャッシュ・議論ジョブはワーカー間で共有されません（redis を推奨）")
@@ -0,0 +1,174 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+try:
+    import h2  # noqa: F401  HTTP/2 は h2 が入っているときだけ有効にする
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# 接続プール・タイムアウト・リトライの設定
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY_SEC = float(os.getenv("HTTP_KEEPALIVE_EXPIRY_SEC", "30"))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", "16"))
+HTTP_CONNECT_TIMEOUT_SEC = float(os.getenv("HTTP_CONNECT_TIMEOUT_SEC", "3"))
+HTTP_READ_TIMEOUT_SEC = float(os.getenv("HTTP_READ_TIMEOUT_SEC", "10"))
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_BASE_SEC = float(os.getenv("HTTP_BACKOFF_BASE_SEC", "0.2"))
+HTTP_BACKOFF_MAX_SEC = float(os.getenv("HTTP_BACKOFF_MAX_SEC", "5"))
+
+# リトライするステータス（レートリミット・一時的なサーバーエラー）とメソッド（冪等なものだけ）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+_async_client = None
+_sync_client = None
+_clients_lock = threading.Lock()
+_async_host_limits = {}
+_sync_host_limits = {}
+
+
+def _client_options() -> dict:
+    return {
+        "http2": HTTP2_AVAILABLE,
+        "follow_redirects": True,
+        "limits": httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY_SEC,
+        ),
+        "timeout": httpx.Timeout(HTTP_READ_TIMEOUT_SEC, connect=HTTP_CONNECT_TIMEOUT_SEC),
+    }
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    プロセス内で共有する非同期クライアント（接続を使い回し、HTTP/2 なら1接続で多重化する）
+    """
+    global _async_client
+    with _clients_lock:
+        if _async_client is None or _async_client.is_closed:
+            _async_client = httpx.AsyncClient(**_client_options())
+        return _async_client
+
+
+def get_sync_client() -> httpx.Client:
+    """
+    スレッドやプロセスプールから使う同期クライアント
+    """
+    global _sync_client
+    with _clients_lock:
+        if _sync_client is None or _sync_client.is_closed:
+            _sync_client = httpx.Client(**_client_options())
+        return _sync_client
+
+
+def _host_of(url) -> str:
+    return urlsplit(str(url)).netloc
+
+
+def _retry_delay(attempt: int, response: httpx.Response = None) -> float:
+    """
+    指数バックオフ（ジッター付き）。429 / 503 で Retry-After（秒）があればそれに従う
+    """
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), HTTP_BACKOFF_MAX_SEC)
+    return min(HTTP_BACKOFF_MAX_SEC, HTTP_BACKOFF_BASE_SEC * (2 ** attempt)) * random.uniform(0.5, 1.0)
+
+
+def _should_retry(method: str, attempt: int, response: httpx.Response = None) -> bool:
+    if method.upper() not in RETRY_METHODS or attempt >= HTTP_MAX_RETRIES:
+        return False
+    return response is None or response.status_code in RETRY_STATUS_CODES
+
+
+async def request(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    共有クライアントでリクエストする。ホストごとの同時接続数を制限し、一時的な失敗はリトライする
+    """
+    host = _host_of(url)
+    semaphore = _async_host_limits.setdefault(host, asyncio.Semaphore(HTTP_PER_HOST_LIMIT))
+    attempt = 0
+    while True:
+        try:
+            async with semaphore:
+                response = await get_async_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            if not _should_retry(method, attempt):
+                raise
+            await asyncio.sleep(_retry_delay(attempt))
+        else:
+            if not _should_retry(method, attempt, response):
+                return response
+            print(f"HTTP {response.status_code} のためリトライします: {host}")
+            await asyncio.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    return await request("GET", url, **kwargs)
+
+
+def request_sync(method: str, url: str, **kwargs) -> httpx.Response:
+    """
+    request の同期版
+    """
+    host = _host_of(url)
+    with _clients_lock:
+        semaphore = _sync_host_limits.setdefault(host, threading.BoundedSemaphore(HTTP_PER_HOST_LIMIT))
+    attempt = 0
+    while True:
+        try:
+            with semaphore:
+                response = get_sync_client().request(method, url, **kwargs)
+        except httpx.TransportError:
+            if not _should_retry(method, attempt):
+                raise
+            time.sleep(_retry_delay(attempt))
+        else:
+            if not _should_retry(method, attempt, response):
+                return response
+            print(f"HTTP {response.status_code} のためリトライします: {host}")
+            time.sleep(_retry_delay(attempt, response))
+        attempt += 1
+
+
+def get_sync(url: str, **kwargs) -> httpx.Response:
+    return request_sync("GET", url, **kwargs)
+
+
+async def aclose():
+    """
+    共有クライアントを閉じる（アプリ終了時）
+    """
+    global _async_client, _sync_client
+    with _clients_lock:
+        async_client, _async_client = _async_client, None
+        sync_client, _sync_client = _sync_client, None
+    if async_client is not None:
+        await async_client.aclose()
+    if sync_client is not None:
+        sync_client.close()
+
+
+def _reset_clients_after_fork():
+    """
+    fork した子プロセスでは親の接続（とイベントループに紐づく上限）を使わず、必要になったら作り直す
+    """
+    global _async_client, _sync_client, _clients_lock, _async_host_limits, _sync_host_limits
+    _clients_lock = threading.Lock()
+    _async_client = None
+    _sync_client = None
+    _async_host_limits = {}
+    _sync_host_limits = {}
+
+
+os.register_at_fork(after_in_child=_reset_clients_after_fork)
@@ -0,0 +1,130 @@
+import os
+import json
+import asyncio
+import hashlib
+import tempfile
+import threading
+
+
+class ResponseCache:
+    """
+    LLM の応答をディスクに保存するコンテンツアドレス型キャッシュ。
+    キーは モデル名 + temperature + プロンプトのハッシュ。合計サイズが上限を超えたら
+    最終アクセス（mtime）が古いものから削除する（LRU）。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._total_bytes = self.__scan_total_bytes()
+
+    @staticmethod
+    def make_key(model: str, temperature, prompt: str) -> str:
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{model}\n{temperature}\n{prompt_hash}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        path = self.__path(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(path)  # LRU 用に最終アクセスを更新
+        except OSError:
+            pass
+        return text
+
+    def set(self, key: str, text: str, model: str = None, temperature=None):
+        path = self.__path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        payload = json.dumps({"model": model, "temperature": temperature, "text": text}, ensure_ascii=False)
+
+        # 書きかけのファイルを読まれないよう、一時ファイルに書いてから置き換える
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(payload)
+        try:
+            replaced_bytes = os.path.getsize(path)  # 同じキーの上書きなら、古いファイルの分を差し引く
+        except OSError:
+            replaced_bytes = 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - replaced_bytes
+            if self._total_bytes > self.max_bytes:
+                self.__evict()
+
+    async def aget(self, key: str):
+        """
+        get の非同期版（ファイル I/O をスレッドで行い、イベントループを止めない）
+        """
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, text: str, model: str = None, temperature=None):
+        """
+        set の非同期版（上限超過時の削除のための走査もスレッドで行う）
+        """
+        await asyncio.to_thread(self.set, key, text, model, temperature)
+
+    # private
+    def __path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def __entries(self) -> list:
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def __scan_total_bytes(self) -> int:
+        return sum(size for _, size, _ in self.__entries())
+
+    def __evict(self):
+        """
+        古いものから削除して上限の 9 割まで減らす（他プロセスの書き込みもあるので実サイズを数え直す）
+        """
+        entries = sorted(self.__entries())
+        total = sum(size for _, size, _ in entries)
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+        self._total_bytes = total
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    LLM_CACHE_ENABLED=1 のときだけ共有の ResponseCache を返す（無効なら None）。
+    """
+    global _response_cache
+    if os.getenv("LLM_CACHE_ENABLED", "0") not in ("1", "true", "True"):
+        return None
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = ResponseCache(
+                os.getenv("LLM_CACHE_DIR", ".llm_cache"),
+                max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024))),
+            )
+        return _response_cache
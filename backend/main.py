@@ -1,17 +1,35 @@
 import os
+import asyncio
+import threading
 import logging
 import random
 import json
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+import uuid
+import hashlib
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-import requests
-from analyze_thumbnail import AnalyzeThumbnail
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+import httpx
+import http_utils
+from analyze_thumbnail import (
+    OUTPUT_FORMATS, THUMBNAIL_OUTPUT_FORMAT, THUMBNAIL_IMAGE_QUALITY, THUMBNAIL_ANALYSIS_WIDTH,
+    analyze_in_process_pool,
+)
 
 import openai
 from google import genai
 
 from comment_analyzer import CommentAnalyzer
 from channel_subscriber_popular_analyzer import ChannelPopularityAnalyzer
+from cache_utils import AnalysisCache, ThumbnailCache
+from model_router import ModelRouter, ProviderError
+from conversation_memory import ConversationMemory
+from termination_policy import create_termination_policy
+from token_utils import truncate_to_tokens
+from debate_jobs import DebateJobQueue, create_job_store
 
 
 # ===============================
@@ -22,214 +40,449 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
 GPT_MODEL_NAME = "chatgpt-4o-latest"
 GEMINI_MODEL_NAME = "gemini-2.0-flash"
+GPT_TEMPERATURE = 0.7
+GEMINI_TEMPERATURE = None  # Gemini はデフォルト値を使用
+
+# 遅い・失敗が続くときのフォールバック先、および軽い処理（終了判定・履歴の要約）に使う速いモデル
+GPT_FAST_MODEL_NAME = os.getenv("GPT_FAST_MODEL_NAME", "gpt-4o-mini")
+GEMINI_FAST_MODEL_NAME = os.getenv("GEMINI_FAST_MODEL_NAME", "gemini-2.0-flash-lite")
+
+# この秒数で応答がなければフォールバック先にも同時に投げる（未設定なら各モデルの p95 を使う）
+ROUTER_HEDGE_AFTER_SEC = float(os.getenv("ROUTER_HEDGE_AFTER_SEC")) if os.getenv("ROUTER_HEDGE_AFTER_SEC") else None
+ROUTER_CHEAP_HEDGE_AFTER_SEC = float(os.getenv("ROUTER_CHEAP_HEDGE_AFTER_SEC", "5"))
+
+# プロバイダごとの同時リクエスト数の上限（レートリミット対策）
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "8"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+
+# プロバイダのクライアントは最初に使うときに作る（gunicorn などで fork した後、ワーカーごとに接続を持つため）
+_async_openai_client = None
+_gemini_client = None
+_provider_clients_lock = threading.Lock()
+
+
+def get_async_openai_client():
+    global _async_openai_client
+    with _provider_clients_lock:
+        if _async_openai_client is None:
+            try:
+                _async_openai_client = openai.AsyncOpenAI(api_key=OPENAI_API_KEY)
+            except Exception as e:
+                print(f"OpenAI(async)の初期化エラー: {e}")
+        return _async_openai_client
+
+
+def get_gemini_client():
+    global _gemini_client
+    with _provider_clients_lock:
+        if _gemini_client is None:
+            try:
+                _gemini_client = genai.Client(api_key=GEMINI_API_KEY)
+            except Exception as e:
+                print(f"Geminiの初期化エラー: {e}")
+        return _gemini_client
+
+
+def _reset_provider_clients_after_fork():
+    global _async_openai_client, _gemini_client, _provider_clients_lock
+    _provider_clients_lock = threading.Lock()
+    _async_openai_client = None
+    _gemini_client = None
+
+
+os.register_at_fork(after_in_child=_reset_provider_clients_after_fork)
+
+# 議論中の各プロンプトに載せる履歴（議題 + 要約 + 直近の発言）のトークン数
+ATTACKER_CONTEXT_TOKENS = int(os.getenv("ATTACKER_CONTEXT_TOKENS", "4000"))
+SUMMARY_CONTEXT_TOKENS = int(os.getenv("SUMMARY_CONTEXT_TOKENS", "6000"))
+SUMMARY_ANALYSIS_DATA_TOKENS = int(os.getenv("SUMMARY_ANALYSIS_DATA_TOKENS", "8000"))
+# 両者がこの回数話した後（収束段階）の発言は短い確認・同意が中心なので、速いモデル（*_cheap ルート）に回す。0 なら回さない
+DEBATE_CHEAP_TURNS_AFTER = int(os.getenv("DEBATE_CHEAP_TURNS_AFTER", "3"))
 
-openai.api_key = OPENAI_API_KEY
+# 分析データのキャッシュ（CACHE_BACKEND=memory / redis）
+analysis_cache = AnalysisCache.from_env()
+# サムネイルURL・画像の ETag・分析結果のキャッシュ
+thumbnail_cache = ThumbnailCache.from_env()
 
-client = None
-try:
-    client = genai.Client(api_key=GEMINI_API_KEY)
-except Exception as e:
-    print(f"Geminiの初期化エラー: {e}")
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    起動時に議論ジョブのワーカーを動かし、終了時にワーカーと共有の HTTP クライアントを止める
+    """
+    await debate_queue.start()
+    try:
+        yield
+    finally:
+        await debate_queue.stop()
+        await http_utils.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("websocket_server")
 
 
 # ===============================
-# GPT 呼び出し関数
+# プロバイダごとのアダプタ（失敗時は ProviderError）
 # ===============================
-def call_chatgpt(prompt: str) -> str:
-    try:
-        response = openai.chat.completions.create(
-            model=GPT_MODEL_NAME,
+def _openai_adapter(model: str, temperature):
+    async def complete(prompt: str) -> str:
+        async_openai_client = get_async_openai_client()
+        if not async_openai_client:
+            raise ProviderError("OpenAI の Client が初期化されていません")
+        response = await async_openai_client.chat.completions.create(
+            model=model,
             messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
+            temperature=temperature,
         )
-        return response.choices[0].message.content if response.choices else "エラー: GPT からのレスポンスがありません"
-    except Exception as e:
-        return f"ChatGPTエラー: {e}"
+        if not response.choices:
+            raise ProviderError("GPT からのレスポンスがありません")
+        return response.choices[0].message.content
+
+    async def stream(prompt: str):
+        async_openai_client = get_async_openai_client()
+        if not async_openai_client:
+            raise ProviderError("OpenAI の Client が初期化されていません")
+        response = await async_openai_client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True,
+        )
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
+
+    return complete, stream
+
+
+def _gemini_adapter(model: str, temperature):
+    async def complete(prompt: str) -> str:
+        client = get_gemini_client()
+        if not client:
+            raise ProviderError("Gemini の Client が初期化されていません")
+        response = await client.aio.models.generate_content(
+            model=model,
+            contents=prompt,
+        )
+        if not response.text:
+            raise ProviderError("Gemini からのレスポンスがありません")
+        return response.text
+
+    async def stream(prompt: str):
+        client = get_gemini_client()
+        if not client:
+            raise ProviderError("Gemini の Client が初期化されていません")
+        response = await client.aio.models.generate_content_stream(
+            model=model,
+            contents=prompt,
+        )
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+    return complete, stream
 
 
 # ===============================
-# Gemini 呼び出し関数
+# モデルルーター
+# - "gpt" / "gemini": 議論の発言。遅い・失敗が続くときは同じプロバイダの速いモデルへ
+# - "gpt_cheap" / "gemini_cheap": 終了判定・履歴の要約・収束段階の短い発言など軽い処理。速いモデルを優先する
+# 応答キャッシュ（LLM_CACHE_ENABLED=1 のときのみ有効）もルーターが扱う
 # ===============================
-def call_gemini(prompt: str) -> str:
-    if not client:
-        return "Gemini の Client が初期化されていません"
-    try:
-        response = client.models.generate_content(
-            model=GEMINI_MODEL_NAME,
-            contents=prompt,
-        )
-        return response.text if response.text else "エラー: Gemini からのレスポンスがありません"
-    except Exception as e:
-        return f"Geminiエラー: {e}"
+model_router = ModelRouter()
+model_router.register_provider("openai", OPENAI_MAX_CONCURRENCY)
+model_router.register_provider("gemini", GEMINI_MAX_CONCURRENCY)
+model_router.register_model("gpt", "openai", GPT_MODEL_NAME, GPT_TEMPERATURE, *_openai_adapter(GPT_MODEL_NAME, GPT_TEMPERATURE))
+model_router.register_model("gpt_fast", "openai", GPT_FAST_MODEL_NAME, GPT_TEMPERATURE, *_openai_adapter(GPT_FAST_MODEL_NAME, GPT_TEMPERATURE))
+model_router.register_model("gemini", "gemini", GEMINI_MODEL_NAME, GEMINI_TEMPERATURE, *_gemini_adapter(GEMINI_MODEL_NAME, GEMINI_TEMPERATURE))
+model_router.register_model("gemini_fast", "gemini", GEMINI_FAST_MODEL_NAME, GEMINI_TEMPERATURE, *_gemini_adapter(GEMINI_FAST_MODEL_NAME, GEMINI_TEMPERATURE))
+model_router.set_route("gpt", ["gpt", "gpt_fast"], ROUTER_HEDGE_AFTER_SEC)
+model_router.set_route("gemini", ["gemini", "gemini_fast"], ROUTER_HEDGE_AFTER_SEC)
+model_router.set_route("gpt_cheap", ["gpt_fast", "gpt"], ROUTER_CHEAP_HEDGE_AFTER_SEC)
+model_router.set_route("gemini_cheap", ["gemini_fast", "gemini"], ROUTER_CHEAP_HEDGE_AFTER_SEC)
 
 
-@app.websocket("/ws")
-async def websocket_endpoint(websocket: WebSocket):
+# ===============================
+# GPT / Gemini 呼び出し関数（非同期。すべての候補が失敗したら ProviderError）
+# ===============================
+async def call_chatgpt_async(prompt: str, use_cache: bool = True, cheap: bool = False) -> str:
     """
-    - 両者が最低3回は話す
-    - 各モデル最大10回 (合計20発言) になったら強制終了
-    - それまでに"合意" or "同意" が出ても、両者とも3回以上話していなければ続行
-    - 追加データがある場合は、プロンプトに埋め込んで AI に渡す
+    イベントループをブロックしない GPT 呼び出し。cheap=True は終了判定など軽い処理用（速いモデル優先）
     """
-    await websocket.accept()
-    logger.info("クライアントが接続されました")
+    return await model_router.complete("gpt_cheap" if cheap else "gpt", prompt, use_cache)
 
-    try:
-        conversation_history = []  # (sender, text)
-        input_data = await websocket.receive_text()
-        input_json = json.loads(input_data)
 
-        topic = input_json.get("topic", "")
-        analysis_type = input_json.get("analysisType", "none")
-        video_id = input_json.get("videoId")
-        channel_id = input_json.get("channelId")
+async def call_gemini_async(prompt: str, use_cache: bool = True, cheap: bool = False) -> str:
+    """
+    イベントループをブロックしない Gemini 呼び出し。cheap=True は終了判定など軽い処理用（速いモデル優先）
+    """
+    return await model_router.complete("gemini_cheap" if cheap else "gemini", prompt, use_cache)
 
-        conversation_history.append(("User", topic))
 
-        # **分析データの取得**
-        analysis_data = load_data_for_analysis(analysis_type, video_id, channel_id)
+def _turn_route(speaker: str, cheap: bool = False) -> str:
+    """
+    発言者（"GPT" / "Gemini" で始まる名前）に対応するルート。cheap=True なら速いモデルを優先するルート
+    """
+    route = "gpt" if "GPT" in speaker else "gemini"
+    return f"{route}_cheap" if cheap else route
 
-        # **プロンプト作成**
-        if analysis_type == "comment_analysis":
-            prompt = __generate_comment_analysis_prompt(topic, analysis_data)
-        elif analysis_type == "channel_subscriber_popular_channel":
-            prompt = __generate_popular_channels_prompt(topic, analysis_data)
-        else:
-            prompt = topic  # そのまま議題を使用
 
-        # **(1) GPT / Gemini 初期見解**
+async def send_turn(emit, speaker: str, prompt: str, stream: bool = False, use_cache: bool = True,
+                    turn_filter=None, cheap: bool = False, label_model: bool = True) -> tuple:
+    """
+    1発言分をモデルに問い合わせて emit でフレームを出し、(発言者名, 全文) を返す。
+    - stream=False: 従来どおり {"sender", "text"} を1回送信
+    - stream=True : {"type": "delta"} を逐次送信し、最後に {"type": "turn_complete"} で全文を送信
+    - turn_filter: feed(delta) / finish() を持つフィルタ（終了マーカーの除去など）。送信前のテキストに適用する
+    - cheap: 短い・重要度の低い発言なので速いモデル（*_cheap ルート）を優先する
+    - label_model: 発言者名を "{speaker}:{実際に応答したモデル}" にする（False なら speaker のまま）
+    モデルの呼び出しに失敗したら ProviderError を送出する（エラーを発言として送ったり履歴に残したりしない）
+    """
+    route = _turn_route(speaker, cheap)
+    label = lambda model: f"{speaker}:{model}" if label_model else speaker
+    if not stream:
+        model, text = await model_router.complete_with_model(route, prompt, use_cache)
+        if turn_filter:
+            text = turn_filter.feed(text) + turn_filter.finish()
+        await emit({"sender": label(model), "text": text})
+        return label(model), text
+
+    turn_id = uuid.uuid4().hex
+    sender = speaker
+    chunks = []
+    async for model, delta in model_router.stream_with_model(route, prompt, use_cache):
+        sender = label(model)
+        if turn_filter:
+            delta = turn_filter.feed(delta)
+        if delta:
+            chunks.append(delta)
+            await emit({"type": "delta", "turnId": turn_id, "sender": sender, "text": delta})
+    if turn_filter and (rest := turn_filter.finish()):
+        chunks.append(rest)
+        await emit({"type": "delta", "turnId": turn_id, "sender": sender, "text": rest})
+
+    text = "".join(chunks)
+    if not text:
+        raise ProviderError(f"{speaker} からのレスポンスがありません")
+    await emit({"type": "turn_complete", "turnId": turn_id, "sender": sender, "text": text})
+    return sender, text
+
+
+async def run_debate(params: dict, emit):
+    """
+    議論を1回分実行する（DebateJobQueue のワーカーから呼ばれる）。発言などのフレームは emit で出す
+    - 両者が最低3回は話す
+    - 各モデル最大10回 (合計20発言) になったら強制終了
+    - それまでに"合意" or "同意" が出ても、両者とも3回以上話していなければ続行
+    - 追加データがある場合は、プロンプトに埋め込んで AI に渡す
+    - "stream": true なら発言を delta / turn_complete で逐次出す
+    - "noCache": true なら応答キャッシュを使わずに毎回モデルへ問い合わせる
+    """
+    topic = params.get("topic", "")
+    analysis_type = params.get("analysisType", "none")
+    video_id = params.get("videoId")
+    channel_id = params.get("channelId")
+    stream = bool(params.get("stream", False))
+    use_cache = not params.get("noCache", False)  # 応答キャッシュをこのリクエストだけバイパス
+
+    async def emit_error(text: str):
+        # モデルの失敗は発言としてではなく、1つのエラーフレームで知らせる（履歴・まとめには含めない）
+        await emit({"type": "error", "sender": "system", "text": text})
+
+    async def summarize_history(summary_prompt: str) -> str:
+        # 古い発言の要約は軽いモデルで作る（失敗時は ProviderError を送出し、ConversationMemory が冒頭を残す）
+        return await model_router.complete("gemini_cheap", summary_prompt, use_cache)
+
+    # 議題は常に、古い発言は要約で、直近の発言は原文でプロンプトに載せる
+    memory = ConversationMemory(topic, summarize=summarize_history)
+
+    async def ask_model(sender: str, ask_prompt: str) -> str:
+        # 終了判定の問い合わせは軽い処理なので速いモデルを優先する
+        if "GPT" in sender:
+            return await call_chatgpt_async(ask_prompt, use_cache, cheap=True)
+        return await call_gemini_async(ask_prompt, use_cache, cheap=True)
+
+    # 終了判定の方式（llm / local / marker）。"terminationPolicy" で指定、なければ TERMINATION_POLICY
+    termination_policy = create_termination_policy(params.get("terminationPolicy"), ask=ask_model)
+
+    # **分析データの取得**（DB / S3 は同期処理なのでスレッドプールで実行）
+    analysis_data = await run_in_threadpool(load_data_for_analysis, analysis_type, video_id, channel_id)
+
+    # **プロンプト作成**
+    if analysis_type == "comment_analysis":
+        prompt = __generate_comment_analysis_prompt(topic, analysis_data)
+    elif analysis_type == "channel_subscriber_popular_channel":
+        prompt = __generate_popular_channels_prompt(topic, analysis_data)
+    else:
+        prompt = topic  # そのまま議題を使用
+
+    # **(1) GPT / Gemini 初期見解**（並列に投げ、届いた順に送信）
+    first_prompt = f"'{prompt}' に対して建設的な初見を述べてください。補足や提案を含め、1000文字以内で。"
+    # 発言者は "GPT" / "Gemini"。フレームと履歴には実際に応答したモデル名を付ける（例: "GPT:gpt-4o-mini"）
+    gpt_speaker = "GPT"
+    gemini_speaker = "Gemini"
+    first_opinions = {}
+
+    async def first_opinion(speaker: str, error_label: str):
         try:
-            gpt_first = call_chatgpt(
-                f"'{prompt}' に対して建設的な初見を述べてください。補足や提案を含め、1000文字以内で。"
-            )
+            first_opinions[speaker] = await send_turn(emit, speaker, first_prompt, stream, use_cache)
         except Exception as e:
-            await websocket.send_text(json.dumps({"sender": "system", "text": f"ChatGPTエラー: {e}"}))
-            return
+            raise RuntimeError(f"{error_label}: {e}") from e
 
+    # 初期見解がそろわなければ議論を続けられないので、ジョブを失敗（failed）として終える
+    try:
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(first_opinion(gpt_speaker, "ChatGPTエラー"))
+            tg.create_task(first_opinion(gemini_speaker, "Geminiエラー"))
+    except ExceptionGroup as eg:
+        raise eg.exceptions[0]
+
+    # **履歴保存**（到着順に関わらず GPT → Gemini の順で残す）
+    memory.append(*first_opinions[gpt_speaker])
+    memory.append(*first_opinions[gemini_speaker])
+    await memory.compact()
+
+    # **(2) 議論の進行**
+    roles = [gpt_speaker, gemini_speaker]
+    random.shuffle(roles)
+    attacker, defender = roles
+
+    gpt_count = 1
+    gem_count = 1
+    max_comments = 10  # 各AIの最大発言回数
+
+    while gpt_count < max_comments and gem_count < max_comments:
+        attacker_prompt = f"""
+        あなたは {attacker} として議論に参加しています。
+        これまでの議論（最後が相手({defender})の最新の意見です）:
+        {memory.render(ATTACKER_CONTEXT_TOKENS)}
+
+        1. 論理的な矛盾があるか確認し、あれば明確に指摘してください。
+        2. 必要であれば補足説明を加えてください。
+        3. 議論を続けるべきか、合意して終了するべきかを判断してください。ただし、論理的な矛盾がない、かつ、どうしても述べたいことがなければ、議論を終了してください。
+        4. 発言回数には上限があります。議論を続けるのは構いませんが発言回数を意識して収束するようにしてください
+        {termination_policy.prompt_instruction()}
+
+        1000文字以内でお願いします。
+        あなたの発言回数は {gpt_count if "GPT" in attacker else gem_count} 回目です。上限は {max_comments} 回です。
+        """
+
+        cheap = 0 < DEBATE_CHEAP_TURNS_AFTER <= min(gpt_count, gem_count)
         try:
-            gemini_first = call_gemini(
-                f"'{prompt}' に対して建設的な初見を述べてください。補足や提案を含め、1000文字以内で。"
+            attacker_sender, attacker_resp = await send_turn(
+                emit, attacker, attacker_prompt, stream, use_cache, termination_policy.turn_filter(), cheap=cheap
             )
+            if "GPT" in attacker:
+                gpt_count += 1
+            else:
+                gem_count += 1
         except Exception as e:
-            await websocket.send_text(json.dumps({"sender": "system", "text": f"Geminiエラー: {e}"}))
-            return
-
-        # **初期発言を送信 & 履歴保存**
-        await websocket.send_text(json.dumps({"sender": f"GPT:{GPT_MODEL_NAME}", "text": gpt_first}))
-        conversation_history.append((f"GPT:{GPT_MODEL_NAME}", gpt_first))
-
-        await websocket.send_text(json.dumps({"sender": f"Gemini:{GEMINI_MODEL_NAME}", "text": gemini_first}))
-        conversation_history.append((f"Gemini:{GEMINI_MODEL_NAME}", gemini_first))
-
-        # **(2) 議論の進行**
-        roles = [f"GPT:{GPT_MODEL_NAME}", f"Gemini:{GEMINI_MODEL_NAME}"]
-        random.shuffle(roles)
-        attacker, defender = roles
+            await emit_error(f"{attacker}エラー: {e}")
+            break
 
-        gpt_count = 1
-        gem_count = 1
-        max_comments = 10  # 各AIの最大発言回数
+        memory.append(attacker_sender, attacker_resp)
+        await memory.compact()
 
-        while gpt_count < max_comments and gem_count < max_comments:
-            attacker_prompt = f"""
-            あなたは {attacker} として議論に参加しています。
-            相手({defender})の意見:
-            {conversation_history[-1][1]}
+        # **最低3回話すまでは終了判定を行わない**
+        if gpt_count >= 3 and gem_count >= 3:
+            try:
+                if await termination_policy.should_end(attacker, attacker_resp, memory):
+                    break
+            except ProviderError as e:
+                print(f"終了判定に失敗したため議論を続けます: {e}")
 
-            1. 論理的な矛盾があるか確認し、あれば明確に指摘してください。
-            2. 必要であれば補足説明を加えてください。
-            3. 議論を続けるべきか、合意して終了するべきかを判断してください。ただし、論理的な矛盾がない、かつ、どうしても述べたいことがなければ、議論を終了してください。
-            4. 発言回数には上限があります。議論を続けるのは構いませんが発言回数を意識して収束するようにしてください
+        # 交代
+        attacker, defender = defender, attacker
 
-            1000文字以内でお願いします。
-            あなたの発言回数は {gpt_count if "GPT" in attacker else gem_count} 回目です。上限は {max_comments} 回です。
-            """
+    # **(3) まとめ**
+    conversation_text = memory.render(SUMMARY_CONTEXT_TOKENS)
 
-            try:
-                if "GPT" in attacker:
-                    attacker_resp = call_chatgpt(attacker_prompt)
-                    gpt_count += 1
-                else:
-                    attacker_resp = call_gemini(attacker_prompt)
-                    gem_count += 1
-            except Exception as e:
-                await websocket.send_text(json.dumps({"sender": "system", "text": f"{attacker}エラー: {e}"}))
-                break
+    if analysis_type == "none":
+        summary_prompt = f"""
+        これまでの議論:
+        {conversation_text}
 
-            conversation_history.append((attacker, attacker_resp))
-            await websocket.send_text(json.dumps({"sender": attacker, "text": attacker_resp}))
+        以下のフォーマットでまとめてください：
+        1. 【議題】
+        2. 【主張と意見】
+        3. 【合意点 / 食い違い点】
+        4. 【結論と今後の方向性】
 
-            # **最低3回話すまでは終了判定を行わない**
-            if gpt_count >= 3 and gem_count >= 3:
-                confirm_end_prompt = f"""
-                これまでの議論:
-                {conversation_history[-5:]}
+        ただし、マークダウンで出力できるようにフォーマットをしてください。
+        """
+        try:
+            await send_turn(emit, "GPTまとめ", summary_prompt, stream, use_cache, label_model=False)
+        except Exception as e:
+            await emit_error(f"まとめエラー: {e}")
+
+    if analysis_type == "comment_analysis":
+        summary_prompt = f"""
+        これまでの議論の内容、および提供したデータから、最終的な当該動画のコメント分析結果を詳細にまとめてください。
+        客先に提出する内容なので、このレポートを見て動画の振り返りや今後の企画ができるような内容に仕上げてください。
+        コメントから見える動画内容への評価や、視聴者の反応についても含めてください。
+        年齢分布予測や性別分布予測などのデモグラフィックデータはチャンネルに対してで動画やコメントから推定した値ではないので注意してください。
+        コメントの書き方などからコメントのポジティブ度、ネガティブ度、性別予測などを割合で出してほしいです。
+        データを混同したくないので、あなたが自身が推定したものについては、GPTによる推定と明記してください。
+
+        議論データ:
+        {conversation_text}
+
+        分析データ:
+        {truncate_to_tokens(str(analysis_data), SUMMARY_ANALYSIS_DATA_TOKENS)}
+
+        また、各生成AIの解釈や認識に違いがあった場合は、別途項目を作り、それぞれ、どのような違いがあったのかをまとめてください。
+        ただし、マークダウンで出力できるようにフォーマットをしてください。
+        """
+        try:
+            await send_turn(emit, "GPTまとめ", summary_prompt, stream, use_cache, label_model=False)
+        except Exception as e:
+            await emit_error(f"まとめエラー: {e}")
 
-                あなたの最新の発言:
-                {attacker_resp}
 
-                議論は終了してもよいですか？「はい」または「いいえ」で答えてください。
-                """
-                confirm_end_response = call_chatgpt(confirm_end_prompt) if "GPT" in attacker else call_gemini(confirm_end_prompt)
+# 議論ジョブのキュー（WebSocket が切れても議論は続き、フレームはジョブストアに残る。DEBATE_JOB_STORE=redis ならワーカー間で共有）
+debate_queue = DebateJobQueue(run_debate, create_job_store())
 
-                if "はい" in confirm_end_response:
-                    break
 
-            # 交代
-            attacker, defender = defender, attacker
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """
+    議論はバックグラウンドのジョブ（run_debate）として実行し、WebSocket はそのフレームを中継する
+    - 最初のメッセージが議論の入力なら新しいジョブを作る
+    - {"jobId", "offset"} を送ると既存のジョブに接続し、offset 番目のフレームから送り直す
+    - 最初に {"type": "job", "jobId"} を送り、以降の各フレームには "offset" を付ける
+    - ジョブが終わると {"type": "job_end", "status"} を送って閉じる（途中で切断しても議論は続く）
+    """
+    await websocket.accept()
+    logger.info("クライアントが接続されました")
 
-        # **(3) まとめ**
-        conversation_text = "\n\n".join([f"{speaker}: {text}" for speaker, text in conversation_history])
+    try:
+        input_data = await websocket.receive_text()
+        input_json = json.loads(input_data)
 
-        if analysis_type == "none":
-            summary_prompt = f"""
-            これまでの議論:
-            {conversation_text}
+        job_id = input_json.get("jobId")
+        offset = max(0, int(input_json.get("offset", 0)))
+        if job_id:
+            if await debate_queue.store.get(job_id) is None:
+                await websocket.send_text(json.dumps({"sender": "system", "text": f"議論が見つかりません: {job_id}"}))
+                return
+            logger.info(f"議論 {job_id} に再接続しました（offset: {offset}）")
+        else:
+            job_id = await debate_queue.submit(input_json)
+        await websocket.send_text(json.dumps({"type": "job", "jobId": job_id}))
 
-            以下のフォーマットでまとめてください：
-            1. 【議題】
-            2. 【主張と意見】
-            3. 【合意点 / 食い違い点】
-            4. 【結論と今後の方向性】
+        async for frame_offset, frame in debate_queue.follow(job_id, offset):
+            await websocket.send_text(json.dumps({**frame, "offset": frame_offset}))
 
-            ただし、マークダウンで出力できるようにフォーマットをしてください。
-            """
-            try:
-                summary = call_chatgpt(summary_prompt)
-                await websocket.send_text(json.dumps({"sender": "GPTまとめ", "text": summary}))
-            except Exception as e:
-                await websocket.send_text(json.dumps({"sender": "system", "text": f"まとめエラー: {e}"}))
-
-        if analysis_type == "comment_analysis":
-            summary_prompt = f"""
-            これまでの議論の内容、および提供したデータから、最終的な当該動画のコメント分析結果を詳細にまとめてください。
-            客先に提出する内容なので、このレポートを見て動画の振り返りや今後の企画ができるような内容に仕上げてください。
-            コメントから見える動画内容への評価や、視聴者の反応についても含めてください。
-            年齢分布予測や性別分布予測などのデモグラフィックデータはチャンネルに対してで動画やコメントから推定した値ではないので注意してください。
-            コメントの書き方などからコメントのポジティブ度、ネガティブ度、性別予測などを割合で出してほしいです。
-            データを混同したくないので、あなたが自身が推定したものについては、GPTによる推定と明記してください。
-
-            議論データ:
-            {conversation_text}
-
-            分析データ:
-            {analysis_data}
-
-            また、各生成AIの解釈や認識に違いがあった場合は、別途項目を作り、それぞれ、どのような違いがあったのかをまとめてください。
-            ただし、マークダウンで出力できるようにフォーマットをしてください。
-            """
-            try:
-                summary = call_chatgpt(summary_prompt)
-                await websocket.send_text(json.dumps({"sender": "GPTまとめ", "text": summary}))
-            except Exception as e:
-                await websocket.send_text(json.dumps({"sender": "system", "text": f"まとめエラー: {e}"}))
+        job = await debate_queue.store.get(job_id)
+        await websocket.send_text(json.dumps({"type": "job_end", "jobId": job_id, "status": job["status"]}))
 
     except WebSocketDisconnect:
-        logger.warning("クライアントが切断されました")
+        logger.warning("クライアントが切断されました（議論はバックグラウンドで続きます）")
     except Exception as e:
         logger.error(f"サーバーエラー: {e}")
     finally:
@@ -237,14 +490,78 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.info("WebSocketコネクション終了")
 
 
+class DebateRequest(BaseModel):
+    topic: str
+    analysisType: str = "none"
+    videoId: str | None = None
+    channelId: str | None = None
+    stream: bool = False
+    noCache: bool = False
+    terminationPolicy: str | None = None
+
+
+async def _get_debate_job(job_id: str) -> dict:
+    job = await debate_queue.store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="議論が見つかりません")
+    return job
+
+
+@app.post("/api/debates")
+async def create_debate(request: DebateRequest):
+    """
+    ✅ 議論をバックグラウンドで開始し、jobId を返す（結果は /frames か WebSocket で受け取る）
+    """
+    job_id = await debate_queue.submit(request.model_dump())
+    return {"jobId": job_id}
+
+
+@app.get("/api/debates/{job_id}")
+async def get_debate(job_id: str):
+    """
+    ✅ 議論ジョブの状態（status: queued / running / completed / failed / cancelled）
+    """
+    return await _get_debate_job(job_id)
+
+
+@app.get("/api/debates/{job_id}/frames")
+async def get_debate_frames(job_id: str, offset: int = 0, limit: int | None = Query(None, ge=1)):
+    """
+    ✅ offset 番目以降のフレーム。nextOffset を次の offset に使えば続きから取得できる
+    （終わった発言の delta は全文の turn_complete に置き換わるので、offset は欠番になることがある）
+    """
+    job = await _get_debate_job(job_id)
+    offset = max(0, offset)
+    frames, next_offset = await debate_queue.store.frames(job_id, offset, limit)
+    return {
+        "jobId": job_id,
+        "status": job["status"],
+        "frames": [{**frame, "offset": frame_offset} for frame_offset, frame in frames],
+        "nextOffset": next_offset,
+    }
+
+
+@app.delete("/api/debates/{job_id}")
+async def cancel_debate(job_id: str):
+    """
+    ✅ 議論を中止する
+    """
+    await _get_debate_job(job_id)
+    return {"jobId": job_id, "cancelled": await debate_queue.cancel(job_id)}
+
+
 def load_data_for_analysis(analysis_type: str, video_id: str = None, channel_id: str = None):
     if analysis_type == "comment_analysis" and video_id:
-        data = CommentAnalyzer(video_id).create_data()
+        data = analysis_cache.get_or_build(
+            analysis_type, video_id, lambda sections: CommentAnalyzer(video_id).create_data(sections)
+        )
         print(f"data: {data}")
         return data
 
     if analysis_type == "channel_subscriber_popular_channel" and channel_id:
-        data = ChannelPopularityAnalyzer(channel_id).create_data()
+        data = analysis_cache.get_or_build(
+            analysis_type, channel_id, lambda sections: ChannelPopularityAnalyzer(channel_id).create_data(sections)
+        )
         print(f"data: {data}")
         return data
 
@@ -259,9 +576,10 @@ def __generate_comment_analysis_prompt(user_input: str, analysis_data: dict) ->
     prompt += "この動画の投稿日から7日間のコメントデータがあります。\n"
     prompt += f"動画データ: {analysis_data['video_data']}\n"
     prompt += f"コメントデータ:\n{analysis_data['comment_data']}...\n\n"
+    prompt += f"コメントの集計データ（全コメントから算出済み。件数や頻度はこちらを使ってください）: {analysis_data['comment_stats']}\n" if analysis_data.get("comment_stats") else ""
     prompt += f"動画の10日間の統計データ: {analysis_data['video_stats']}\n"
     prompt += f"スポンサード動画のデータ: {analysis_data['other_sponsored_video_data']}\n" if analysis_data.get("other_sponsored_video_data") else ""
-    prompt += f"スポンサード動画のコメントデータ: {analysis_data['other_sponsored_video_comments']}\n" if analysis_data.get("その他のスポンサード動画のコメントデータ") else ""
+    prompt += f"スポンサード動画のコメントデータ: {analysis_data['other_sponsored_video_comments']}\n" if analysis_data.get("other_sponsored_video_comments") else ""
     prompt += f"チャンネルデータ: {analysis_data['channel_data']}\n"
     prompt += f"チャンネルの視聴者層の年齢分布予測データ: {analysis_data['age_prediction']}\n"
     prompt += f"チャンネルの視聴者層の性別分布予測データ: {analysis_data['gender_prediction']}\n"
@@ -295,50 +613,182 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ✅ YouTube Data API で動画のサムネイルURLを取得
-def get_video_thumbnail(video_id: str) -> str:
-    youtube_api_url = f"https://www.googleapis.com/youtube/v3/videos?id={video_id}&key={YOUTUBE_API_KEY}&part=snippet"
+# モデルごとのレイテンシ（p50 / p95）・エラー率・サーキットブレーカーの状態
+@app.get("/api/model-stats")
+async def model_stats():
+    return model_router.snapshot()
 
-    response = requests.get(youtube_api_url)
-    if response.status_code != 200:
-        raise HTTPException(status_code=500, detail="YouTube API からのレスポンス取得に失敗しました")
 
-    data = response.json()
+# ✅ YouTube Data API で動画のサムネイルURLを取得（videos API は1回で50件まで）
+YOUTUBE_VIDEOS_PER_REQUEST = 50
+THUMBNAIL_DOWNLOAD_CONCURRENCY = int(os.getenv("THUMBNAIL_DOWNLOAD_CONCURRENCY", "16"))
+THUMBNAIL_BATCH_MAX_IDS = int(os.getenv("THUMBNAIL_BATCH_MAX_IDS", "500"))
 
-    print(f"video api data: {data}")
+thumbnail_download_semaphore = asyncio.Semaphore(THUMBNAIL_DOWNLOAD_CONCURRENCY)
 
-    if "items" not in data or len(data["items"]) == 0:
-        raise HTTPException(status_code=404, detail="指定された動画が見つかりません")
 
-    # ✅ サムネイルURLを取得（高解像度のものを優先）
-    snippet = data["items"][0]["snippet"]
-    thumbnails = snippet["thumbnails"]
+async def get_video_thumbnails(video_ids: list) -> dict:
+    """
+    複数の動画のサムネイルURLを {video_id: url} で返す（見つからない動画は含まない）
+    キャッシュにある動画は YouTube API を呼ばない
+    """
+    cached_urls = await thumbnail_cache.get_urls(video_ids)
+    missing_ids = [video_id for video_id in video_ids if video_id not in cached_urls]
+
+    async def fetch_chunk(chunk: list) -> httpx.Response:
+        return await http_utils.get(
+            "https://www.googleapis.com/youtube/v3/videos",
+            params={
+                "id": ",".join(chunk),
+                "key": YOUTUBE_API_KEY,
+                "part": "snippet",
+                "fields": "items(id,snippet/thumbnails)",
+                "maxResults": YOUTUBE_VIDEOS_PER_REQUEST,
+            },
+        )
+
+    chunks = [missing_ids[start:start + YOUTUBE_VIDEOS_PER_REQUEST] for start in range(0, len(missing_ids), YOUTUBE_VIDEOS_PER_REQUEST)]
+    thumbnail_urls = {}
+    for response in await asyncio.gather(*(fetch_chunk(chunk) for chunk in chunks)):
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail="YouTube API からのレスポンス取得に失敗しました")
+
+        for item in response.json().get("items", []):
+            # 高画質のサムネイルを取得（利用可能なものを優先）
+            thumbnail_url = item["snippet"]["thumbnails"].get("high", {}).get("url")
+            if thumbnail_url:
+                thumbnail_urls[item["id"]] = thumbnail_url
 
-    # 高画質のサムネイルを取得（利用可能なものを優先）
-    thumbnail_url = thumbnails.get("high", {}).get("url")
+    await thumbnail_cache.set_urls(thumbnail_urls)
+    return {**cached_urls, **thumbnail_urls}
+
+
+async def get_video_thumbnail(video_id: str) -> str:
+    thumbnail_url = (await get_video_thumbnails([video_id])).get(video_id)
 
     print(f"thumbnail_url: {thumbnail_url}")
 
     if not thumbnail_url:
-        raise HTTPException(status_code=404, detail="サムネイルが見つかりません")
+        raise HTTPException(status_code=404, detail="指定された動画が見つからないか、サムネイルがありません")
 
     return thumbnail_url
 
+
+async def _download_thumbnail(thumbnail_url: str, validator: dict = None):
+    """
+    サムネイル画像を共有クライアントでダウンロードする。validator があれば ETag / Last-Modified で条件付きにする
+    """
+    headers = {}
+    if validator and validator.get("etag"):
+        headers["If-None-Match"] = validator["etag"]
+    if validator and validator.get("last_modified"):
+        headers["If-Modified-Since"] = validator["last_modified"]
+    async with thumbnail_download_semaphore:
+        response = await http_utils.get(thumbnail_url, headers=headers)
+    if response.status_code != 304:  # httpx は 3xx でも raise_for_status で例外にする
+        response.raise_for_status()
+    return response
+
+
+async def analyze_thumbnail_url(thumbnail_url: str, image_format: str = None, quality: int = None) -> dict:
+    """
+    サムネイル画像を非同期にダウンロードし、解析はプロセスプールで行う（イベントループを止めない）
+    画像が前回から変わっていなければ（304 or 同じ内容）、キャッシュ済みの結果を返す
+    """
+    options = (
+        (image_format or THUMBNAIL_OUTPUT_FORMAT).lower(),
+        THUMBNAIL_IMAGE_QUALITY if quality is None else quality,
+        THUMBNAIL_ANALYSIS_WIDTH,
+    )
+    try:
+        validator = await thumbnail_cache.get_validator(thumbnail_url)
+        response = await _download_thumbnail(thumbnail_url, validator)
+        if response.status_code == 304:
+            cached = await thumbnail_cache.get_result(validator["content_hash"], options)
+            if cached is not None:
+                return {**cached, "thumbnail_url": thumbnail_url}
+            # 結果だけ期限切れになっていた場合は、条件なしで取り直す
+            response = await _download_thumbnail(thumbnail_url)
+    except httpx.HTTPStatusError as http_err:
+        return {"error": f"HTTPエラー: {http_err}"}
+    except httpx.HTTPError as e:
+        return {"error": f"サムネイル画像の取得に失敗しました: {e}"}
+
+    content_hash = hashlib.sha256(response.content).hexdigest()
+    await thumbnail_cache.set_validator(
+        thumbnail_url, response.headers.get("ETag"), response.headers.get("Last-Modified"), content_hash
+    )
+    cached = await thumbnail_cache.get_result(content_hash, options)
+    if cached is not None:
+        return {**cached, "thumbnail_url": thumbnail_url}
+
+    result = await analyze_in_process_pool(response.content, thumbnail_url, *options[:2])
+    if "error" not in result:
+        await thumbnail_cache.set_result(content_hash, options, result)
+    return result
+
+
+def _validate_image_format(image_format: str):
+    if image_format and image_format.lower() not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"image_format は {', '.join(OUTPUT_FORMATS)} のいずれかです")
+
+
 # サムネイル画像を取得して分析するエンドポイント
 @app.get("/api/analyze-thumbnail")
-async def analyze_thumbnail(video_id: str):
+async def analyze_thumbnail(video_id: str, image_format: str = None, quality: int = None):
+    """
+    :param image_format: "png" / "webp" / "none"（"none" は線の座標だけを返し、画像は作らない）
+    """
     if not video_id:
         raise HTTPException(status_code=400, detail="動画IDが必要です")
+    _validate_image_format(image_format)
 
     # YouTube Data API でサムネイル URL を取得
     print(f"video_id: {video_id}")
-    thumbnail_url = get_video_thumbnail(video_id)
-
-    # サムネイル画像にアクセス
     try:
-        instance = AnalyzeThumbnail(thumbnail_url)
-        analysis_result = instance.analyze()
-        return analysis_result
+        thumbnail_url = await get_video_thumbnail(video_id)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"YouTube API の呼び出しに失敗しました: {str(e)}")
 
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"サムネイル画像の取得に失敗しました: {str(e)}")
+    return await analyze_thumbnail_url(thumbnail_url, image_format, quality)
+
+
+class ThumbnailBatchRequest(BaseModel):
+    video_ids: list[str]
+    image_format: str | None = None
+    quality: int | None = None
+
+
+# 複数動画のサムネイルをまとめて分析し、終わったものから NDJSON で1行ずつ返すエンドポイント
+@app.post("/api/analyze-thumbnails")
+async def analyze_thumbnails(request: ThumbnailBatchRequest):
+    video_ids = list(dict.fromkeys(video_id.strip() for video_id in request.video_ids if video_id.strip()))
+    if not video_ids:
+        raise HTTPException(status_code=400, detail="動画IDが必要です")
+    if len(video_ids) > THUMBNAIL_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"動画IDは {THUMBNAIL_BATCH_MAX_IDS} 件までです")
+    _validate_image_format(request.image_format)
+
+    try:
+        thumbnail_urls = await get_video_thumbnails(video_ids)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=500, detail=f"YouTube API の呼び出しに失敗しました: {str(e)}")
+
+    async def analyze_one(video_id: str) -> dict:
+        thumbnail_url = thumbnail_urls.get(video_id)
+        if not thumbnail_url:
+            return {"video_id": video_id, "error": "指定された動画が見つからないか、サムネイルがありません"}
+        result = await analyze_thumbnail_url(thumbnail_url, request.image_format, request.quality)
+        return {"video_id": video_id, **result}
+
+    async def stream_results():
+        tasks = [asyncio.create_task(analyze_one(video_id)) for video_id in video_ids]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result, ensure_ascii=False) + "\n"
+        finally:
+            # クライアントが途中で切断した場合は残りを止める
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
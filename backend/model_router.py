@@ -0,0 +1,335 @@
+import os
+import time
+import asyncio
+from collections import deque
+
+from llm_cache import ResponseCache, get_response_cache
+
+# 1モデルあたりの呼び出しのタイムアウト、統計を取る直近の呼び出し数
+ROUTER_CALL_TIMEOUT_SEC = float(os.getenv("ROUTER_CALL_TIMEOUT_SEC", "120"))
+ROUTER_FIRST_CHUNK_TIMEOUT_SEC = float(os.getenv("ROUTER_FIRST_CHUNK_TIMEOUT_SEC", "30"))
+ROUTER_STATS_WINDOW = int(os.getenv("ROUTER_STATS_WINDOW", "100"))
+# サーキットブレーカー: 連続でこの回数失敗したら、一定時間そのモデルを使わない
+ROUTER_BREAKER_FAILURES = int(os.getenv("ROUTER_BREAKER_FAILURES", "3"))
+ROUTER_BREAKER_COOLDOWN_SEC = float(os.getenv("ROUTER_BREAKER_COOLDOWN_SEC", "30"))
+# ヘッジの基準に p95 を使うのに必要な呼び出し数
+ROUTER_MIN_SAMPLES_FOR_HEDGE = 10
+
+
+class ProviderError(Exception):
+    """
+    モデル呼び出しの失敗（すべての候補が失敗したときは ModelRouter からも送出される）
+    """
+
+
+class ModelStats:
+    """
+    直近 window 回の呼び出しのレイテンシとエラー率
+    """
+
+    def __init__(self, window: int = ROUTER_STATS_WINDOW):
+        self._latencies = deque(maxlen=window)  # 成功した呼び出しのみ
+        self._outcomes = deque(maxlen=window)  # True = 成功
+
+    def record(self, latency_sec: float, ok: bool):
+        self._outcomes.append(ok)
+        if ok:
+            self._latencies.append(latency_sec)
+
+    def percentile(self, p: float):
+        """
+        レイテンシの p パーセンタイル（秒）。記録がなければ None
+        """
+        if not self._latencies:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+    @property
+    def samples(self) -> int:
+        return len(self._latencies)
+
+    @property
+    def error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+
+class CircuitBreaker:
+    """
+    連続 failure_threshold 回失敗で open（cooldown_sec の間は使わない）。
+    cooldown 後は half-open で試し、成功すれば closed、失敗すれば再び open になる
+    """
+
+    def __init__(self, failure_threshold: int = ROUTER_BREAKER_FAILURES, cooldown_sec: float = ROUTER_BREAKER_COOLDOWN_SEC):
+        self.failure_threshold = failure_threshold
+        self.cooldown_sec = cooldown_sec
+        self._failures = 0
+        self._opened_at = None
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self._opened_at >= self.cooldown_sec else "open"
+
+    def allow(self) -> bool:
+        return self.state != "open"
+
+    def record(self, ok: bool):
+        if ok:
+            self._failures = 0
+            self._opened_at = None
+            return
+        self._failures += 1
+        if self._opened_at is not None or self._failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+
+
+class ModelEndpoint:
+    """
+    1つのモデル（プロバイダ + モデル名 + 温度）。complete / stream はプロバイダごとのアダプタ
+    """
+
+    def __init__(self, name: str, provider: str, model: str, temperature, complete, stream=None):
+        """
+        :param complete: プロンプトを受け取り全文を返す async 関数（失敗時は例外）
+        :param stream: プロンプトを受け取り差分を yield する async ジェネレータ関数（なければ complete を使う）
+        """
+        self.name = name
+        self.provider = provider
+        self.model = model
+        self.temperature = temperature
+        self.complete = complete
+        self.stream = stream
+        self.stats = ModelStats()
+        self.breaker = CircuitBreaker()
+
+
+class Route:
+    def __init__(self, models: list, hedge_after_sec: float = None):
+        """
+        :param models: 優先順のモデル名（先頭が通常使うモデル、以降はフォールバック / ヘッジ先）
+        :param hedge_after_sec: この秒数で応答がなければ次のモデルにも同時に投げる。None なら先頭モデルの p95
+        """
+        self.models = models
+        self.hedge_after_sec = hedge_after_sec
+
+
+class ModelRouter:
+    """
+    プロバイダ・モデルを登録し、用途（ルート）ごとに呼び出し先を選ぶ。
+    - モデルごとにレイテンシ（p50 / p95）とエラー率を記録する
+    - 失敗が続くモデルはサーキットブレーカーで一時的に外し、次の候補にフォールバックする
+    - 応答が遅いときは次の候補にも同時に投げ（ヘッジ）、先に返った方を使う
+    """
+
+    def __init__(self):
+        self._semaphores = {}  # provider -> asyncio.Semaphore（プロバイダごとの同時実行数）
+        self._endpoints = {}
+        self._routes = {}
+
+    def register_provider(self, provider: str, max_concurrency: int):
+        self._semaphores[provider] = asyncio.Semaphore(max_concurrency)
+
+    def register_model(self, name: str, provider: str, model: str, temperature, complete, stream=None):
+        self._endpoints[name] = ModelEndpoint(name, provider, model, temperature, complete, stream)
+
+    def set_route(self, route: str, models: list, hedge_after_sec: float = None):
+        self._routes[route] = Route(models, hedge_after_sec)
+
+    def snapshot(self) -> dict:
+        """
+        モデルごとの統計（p50 / p95 は秒）
+        """
+        return {
+            name: {
+                "model": endpoint.model,
+                "p50": endpoint.stats.percentile(50),
+                "p95": endpoint.stats.percentile(95),
+                "error_rate": round(endpoint.stats.error_rate, 3),
+                "samples": endpoint.stats.samples,
+                "circuit": endpoint.breaker.state,
+            }
+            for name, endpoint in self._endpoints.items()
+        }
+
+    async def complete(self, route: str, prompt: str, use_cache: bool = True) -> str:
+        """
+        ルートの候補に問い合わせて全文を返す。すべて失敗した場合は ProviderError
+        """
+        _, text = await self.complete_with_model(route, prompt, use_cache)
+        return text
+
+    async def complete_with_model(self, route: str, prompt: str, use_cache: bool = True) -> tuple:
+        """
+        complete と同じ。(実際に応答したモデル名, 全文) を返す（フォールバック・ヘッジ先が答えた場合はそのモデル名）
+        """
+        candidates = self.__candidates(route)
+        cached = await self.__cache_get(candidates, prompt, use_cache)
+        if cached is not None:
+            return cached
+
+        endpoint, text = await self.__race(candidates, prompt, self.__hedge_after(route, candidates[0]))
+        await self.__cache_set(endpoint, prompt, text, use_cache)
+        return endpoint.model, text
+
+    async def stream(self, route: str, prompt: str, use_cache: bool = True):
+        """
+        差分を yield する。最初の差分が届く前に失敗・タイムアウトしたら次の候補にフォールバックする
+        （途中まで送った後の失敗はフォールバックせず ProviderError）
+        """
+        async for _, delta in self.stream_with_model(route, prompt, use_cache):
+            yield delta
+
+    async def stream_with_model(self, route: str, prompt: str, use_cache: bool = True):
+        """
+        stream と同じ。(実際に応答しているモデル名, 差分) を yield する
+        """
+        candidates = self.__candidates(route)
+        cached = await self.__cache_get(candidates, prompt, use_cache)
+        if cached is not None:
+            yield cached
+            return
+
+        errors = []
+        for endpoint in candidates:
+            if endpoint.stream is None:
+                try:
+                    text = await self.__call(endpoint, prompt)
+                except ProviderError as e:
+                    errors.append(f"{endpoint.name}: {e}")
+                    continue
+                await self.__cache_set(endpoint, prompt, text, use_cache)
+                yield endpoint.model, text
+                return
+
+            started = time.monotonic()
+            chunks = []
+            async with self._semaphores[endpoint.provider]:
+                generator = endpoint.stream(prompt)
+                try:
+                    chunks.append(await asyncio.wait_for(anext(generator), ROUTER_FIRST_CHUNK_TIMEOUT_SEC))
+                except Exception as e:
+                    await generator.aclose()
+                    self.__record(endpoint, started, False)
+                    errors.append(f"{endpoint.name}: {e!r}")
+                    continue
+
+                try:
+                    yield endpoint.model, chunks[0]
+                    async for chunk in generator:
+                        chunks.append(chunk)
+                        yield endpoint.model, chunk
+                except Exception as e:
+                    self.__record(endpoint, started, False)
+                    raise ProviderError(f"{endpoint.name}: {e}") from e
+                finally:
+                    await generator.aclose()
+            self.__record(endpoint, started, True)
+            await self.__cache_set(endpoint, prompt, "".join(chunks), use_cache)
+            return
+        raise ProviderError(" / ".join(errors) or "利用できるモデルがありません")
+
+    # private
+    def __candidates(self, route: str) -> list:
+        """
+        ブレーカーが open のモデルを除いた候補（全部 open なら、しかたなく全候補）
+        """
+        endpoints = [self._endpoints[name] for name in self._routes[route].models]
+        return [endpoint for endpoint in endpoints if endpoint.breaker.allow()] or endpoints
+
+    def __hedge_after(self, route: str, primary: ModelEndpoint):
+        hedge_after_sec = self._routes[route].hedge_after_sec
+        if hedge_after_sec is not None:
+            return hedge_after_sec
+        if primary.stats.samples >= ROUTER_MIN_SAMPLES_FOR_HEDGE:
+            return primary.stats.percentile(95)
+        return None
+
+    async def __race(self, candidates: list, prompt: str, hedge_after_sec) -> tuple:
+        """
+        先頭の候補に投げ、hedge_after_sec 以内に返らなければ次の候補にも投げる。
+        失敗したら待たずに次の候補へ。最初に成功した (endpoint, text) を返し、残りはキャンセルする
+        """
+        pending = {}
+        errors = []
+        next_index = 0
+
+        def launch():
+            nonlocal next_index
+            endpoint = candidates[next_index]
+            next_index += 1
+            pending[asyncio.create_task(self.__call(endpoint, prompt))] = endpoint
+
+        launch()
+        try:
+            while pending:
+                can_hedge = hedge_after_sec is not None and next_index < len(candidates)
+                done, _ = await asyncio.wait(
+                    pending, timeout=hedge_after_sec if can_hedge else None, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    print(f"{hedge_after_sec:.1f}秒応答がないため {candidates[next_index].name} にもリクエストします")
+                    launch()
+                    continue
+                for task in done:
+                    endpoint = pending.pop(task)
+                    try:
+                        return endpoint, task.result()
+                    except ProviderError as e:
+                        errors.append(f"{endpoint.name}: {e}")
+                if not pending and next_index < len(candidates):
+                    launch()
+            raise ProviderError(" / ".join(errors))
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def __call(self, endpoint: ModelEndpoint, prompt: str) -> str:
+        started = time.monotonic()
+        try:
+            async with self._semaphores[endpoint.provider]:
+                text = await asyncio.wait_for(endpoint.complete(prompt), ROUTER_CALL_TIMEOUT_SEC)
+            if not text:
+                raise ProviderError("レスポンスがありません")
+        except asyncio.CancelledError:
+            raise  # ヘッジで負けた呼び出しは統計に含めない
+        except ProviderError:
+            self.__record(endpoint, started, False)
+            raise
+        except Exception as e:
+            self.__record(endpoint, started, False)
+            raise ProviderError(repr(e)) from e
+        self.__record(endpoint, started, True)
+        return text
+
+    @staticmethod
+    def __record(endpoint: ModelEndpoint, started: float, ok: bool):
+        endpoint.stats.record(time.monotonic() - started, ok)
+        endpoint.breaker.record(ok)
+
+    @staticmethod
+    async def __cache_get(candidates: list, prompt: str, use_cache: bool):
+        """
+        候補のいずれかのモデルの応答がキャッシュにあれば (モデル名, 全文)。なければ None
+        """
+        if not use_cache:
+            return None
+        # 初回はキャッシュディレクトリを走査するので、取得もスレッドで行う
+        response_cache = await asyncio.to_thread(get_response_cache)
+        if response_cache is None:
+            return None
+        for endpoint in candidates:
+            cached = await response_cache.aget(ResponseCache.make_key(endpoint.model, endpoint.temperature, prompt))
+            if cached is not None:
+                return endpoint.model, cached
+        return None
+
+    @staticmethod
+    async def __cache_set(endpoint: ModelEndpoint, prompt: str, text: str, use_cache: bool):
+        if not (use_cache and text):
+            return
+        response_cache = await asyncio.to_thread(get_response_cache)
+        if response_cache is not None:
+            key = ResponseCache.make_key(endpoint.model, endpoint.temperature, prompt)
+            await response_cache.aset(key, text, model=endpoint.model, temperature=endpoint.temperature)
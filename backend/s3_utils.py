@@ -1,62 +1,315 @@
 import os
+import csv
+import json
+import time
+import zlib
+import codecs
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from dotenv import load_dotenv
 
 load_dotenv()  # .env からAWSキーを読み込み
 from io import BytesIO
 
+
+class S3ObjectCache:
+    """
+    プロセス内で共有する S3 オブジェクトの LRU キャッシュ。
+    TTL 内はダウンロードせずに返し、TTL 切れの場合は ETag で再検証（If-None-Match）する。
+    """
+
+    def __init__(self, max_entries: int = 128, max_bytes: int = 64 * 1024 * 1024,
+                 max_object_bytes: int = 16 * 1024 * 1024, ttl_sec: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_object_bytes = max_object_bytes
+        self.ttl_sec = ttl_sec
+
+        self._entries = OrderedDict()  # key -> {"etag", "body", "validated_at"}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        エントリを返す（なければ None）。"fresh" は TTL 内かどうか。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return {**entry, "fresh": time.monotonic() - entry["validated_at"] < self.ttl_sec}
+
+    def put(self, key, etag: str, body: bytes):
+        if not etag or len(body) > self.max_object_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old["body"])
+            self._entries[key] = {"etag": etag, "body": body, "validated_at": time.monotonic()}
+            self._bytes += len(body)
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted["body"])
+
+    def revalidated(self, key):
+        """
+        304 (Not Modified) が返ったエントリの TTL を延長する。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry["validated_at"] = time.monotonic()
+
+
+# ストリーミング読み込み・マルチパートダウンロードの設定
+S3_STREAM_CHUNK_SIZE = int(os.getenv("S3_STREAM_CHUNK_SIZE", str(64 * 1024)))
+S3_TRANSFER_CONCURRENCY = int(os.getenv("S3_TRANSFER_CONCURRENCY", "8"))
+S3_TRANSFER_PART_SIZE = int(os.getenv("S3_TRANSFER_PART_SIZE", str(8 * 1024 * 1024)))
+
+_object_cache = S3ObjectCache(
+    max_entries=int(os.getenv("S3_CACHE_MAX_ENTRIES", "128")),
+    max_bytes=int(os.getenv("S3_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    max_object_bytes=int(os.getenv("S3_CACHE_MAX_OBJECT_BYTES", str(16 * 1024 * 1024))),
+    ttl_sec=float(os.getenv("S3_CACHE_TTL_SEC", "300")),
+)
+
+
+# 同時に取得するオブジェクト数（get_many）と、HTTP コネクションプールの大きさ
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", "32"))
+S3_GET_MANY_CONCURRENCY = int(os.getenv("S3_GET_MANY_CONCURRENCY", "16"))
+
+_shared_clients_lock = threading.Lock()
+_shared_clients = {}
+
+
+def _get_shared_s3_client(aws_access_key_id: str, aws_secret_access_key: str, region_name: str):
+    """
+    プロセス内で認証情報・リージョンごとに1つだけ boto3 クライアントを作り、以降は使い回す。
+    boto3 のクライアントはスレッドセーフなので、スレッドをまたいで共有してよい。
+    """
+    key = (aws_access_key_id, region_name)
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            config = Config(
+                max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+                tcp_keepalive=True,
+                connect_timeout=float(os.getenv("S3_CONNECT_TIMEOUT_SEC", "5")),
+                read_timeout=float(os.getenv("S3_READ_TIMEOUT_SEC", "60")),
+                retries={"max_attempts": int(os.getenv("S3_MAX_ATTEMPTS", "5")), "mode": "adaptive"},
+            )
+            # クライアント生成（認証情報・エンドポイントの解決）はスレッドセーフではないのでロック内で行う
+            _shared_clients[key] = boto3.session.Session().client(
+                "s3",
+                aws_access_key_id=aws_access_key_id,
+                aws_secret_access_key=aws_secret_access_key,
+                region_name=region_name,
+                config=config
+            )
+        return _shared_clients[key]
+
+
+def _reset_shared_s3_clients_after_fork():
+    """
+    boto3 のクライアント（コネクションプール）は fork をまたいで使えないので、子プロセスでは作り直す
+    """
+    global _shared_clients_lock, _shared_clients
+    _shared_clients_lock = threading.Lock()
+    _shared_clients = {}
+
+
+os.register_at_fork(after_in_child=_reset_shared_s3_clients_after_fork)
+
+
 class S3Client:
     def __init__(self, default_bucket: str = "kt-production"):
         """
-        バケット名などを .env から読み取り、boto3 クライアント初期化
+        バケット名などを .env から読み取り、共有の boto3 クライアントを取得する
         """
         self.aws_access_key_id = os.getenv("AWS_ACCESS_KEY_ID", "")
         self.aws_secret_access_key = os.getenv("AWS_SECRET_ACCESS_KEY", "")
         self.aws_region = os.getenv("AWS_REGION", "us-east-1")
         self.bucket_name = os.getenv("S3_BUCKET_NAME", default_bucket)
 
-        self.s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=self.aws_access_key_id,
-            aws_secret_access_key=self.aws_secret_access_key,
-            region_name=self.aws_region
+        self.s3_client = _get_shared_s3_client(
+            self.aws_access_key_id,
+            self.aws_secret_access_key,
+            self.aws_region
         )
 
+        # このクライアント（= 1回の分析）内でパース済みのオブジェクト
+        self._artifacts = {}
+
+    def load_bytes(self, s3_key: str) -> bytes:
+        """
+        S3上のオブジェクトをバイト列で返す。共有キャッシュを使い、TTL 切れのときは ETag で再検証する
+        """
+        cache_key = (self.bucket_name, s3_key)
+        cached = _object_cache.get(cache_key)
+        if cached and cached["fresh"]:
+            return cached["body"]
+
+        params = {"Bucket": self.bucket_name, "Key": s3_key}
+        if cached:
+            params["IfNoneMatch"] = cached["etag"]
+        try:
+            response = self.s3_client.get_object(**params)
+        except ClientError as e:
+            if cached and e.response.get("Error", {}).get("Code") in ("304", "NotModified"):
+                _object_cache.revalidated(cache_key)
+                return cached["body"]
+            raise
+
+        body = response["Body"].read()
+        _object_cache.put(cache_key, response.get("ETag"), body)
+        return body
+
+    def get_many(self, s3_keys: list, max_workers: int = None) -> dict:
+        """
+        複数のオブジェクトを並列に取得し、{キー: バイト列} で返す（存在しないキーは None）
+        """
+        s3_keys = list(dict.fromkeys(s3_keys))
+        if not s3_keys:
+            return {}
+
+        def fetch(s3_key):
+            try:
+                return self.load_bytes(s3_key)
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                    return None
+                raise
+
+        max_workers = min(max_workers or S3_GET_MANY_CONCURRENCY, S3_MAX_POOL_CONNECTIONS, len(s3_keys))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return dict(zip(s3_keys, executor.map(fetch, s3_keys)))
+
+    def head(self, s3_key: str) -> dict:
+        """
+        オブジェクトのメタデータ（ETag / 最終更新日時 / サイズ）を返す
+        """
+        response = self.s3_client.head_object(Bucket=self.bucket_name, Key=s3_key)
+        return {
+            "etag": response.get("ETag"),
+            "last_modified": response.get("LastModified"),
+            "size": response.get("ContentLength"),
+        }
+
+    def open_stream(self, s3_key: str):
+        """
+        オブジェクトの本文をストリーム（read() できるファイル風オブジェクト）で返す
+        """
+        return self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)["Body"]
+
+    def iter_lines(self, s3_key: str, encoding: str = "utf-8"):
+        """
+        オブジェクトを少しずつダウンロードし、デコード済みの行（改行付き）を yield する。
+        キーが .gz で終わるか ContentEncoding が gzip の場合は展開しながら読む
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key)
+        body = response["Body"]
+        gzipped = s3_key.endswith(".gz") or response.get("ContentEncoding") == "gzip"
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzipped else None
+        decoder = codecs.getincrementaldecoder(encoding)()
+        pending = ""
+        try:
+            for chunk in body.iter_chunks(S3_STREAM_CHUNK_SIZE):
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                pending += decoder.decode(chunk)
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    yield line + "\n"
+            if decompressor:
+                pending += decoder.decode(decompressor.flush())
+            pending += decoder.decode(b"", final=True)
+            if pending:
+                yield pending
+        finally:
+            body.close()
+
+    def iter_csv_records(self, s3_key: str, encoding: str = "utf-8"):
+        """
+        CSV を1行ずつ dict で yield する（オブジェクト全体をメモリに載せない）
+        """
+        lines = (line.lstrip("\ufeff") if index == 0 else line for index, line in enumerate(self.iter_lines(s3_key, encoding)))
+        yield from csv.DictReader(lines)
+
+    def iter_json_records(self, s3_key: str, encoding: str = "utf-8"):
+        """
+        JSON Lines を1レコードずつ yield する
+        """
+        for line in self.iter_lines(s3_key, encoding):
+            if line.strip():
+                yield json.loads(line)
+
+    def read_range(self, s3_key: str, byte_range: str) -> bytes:
+        """
+        Range を指定して一部だけ取得する（例: "bytes=0-1023", "bytes=-1024"）
+        """
+        response = self.s3_client.get_object(Bucket=self.bucket_name, Key=s3_key, Range=byte_range)
+        return response["Body"].read()
+
+    def read_head_text(self, s3_key: str, max_bytes: int, encoding: str = "utf-8") -> str:
+        """
+        先頭 max_bytes だけを取得し、途中で切れた最後の行を除いた文字列を返す（非圧縮オブジェクト用）
+        """
+        data = self.read_range(s3_key, f"bytes=0-{max_bytes - 1}")
+        text = data.decode(encoding, errors="ignore")
+        return text if len(data) < max_bytes else text[:text.rfind("\n") + 1]
+
+    def read_tail_text(self, s3_key: str, max_bytes: int, encoding: str = "utf-8") -> str:
+        """
+        末尾 max_bytes だけを取得し、途中で切れた最初の行を除いた文字列を返す（非圧縮オブジェクト用）
+        """
+        data = self.read_range(s3_key, f"bytes=-{max_bytes}")
+        text = data.decode(encoding, errors="ignore")
+        return text if len(data) < max_bytes else text[text.find("\n") + 1:]
+
+    def load_json(self, s3_key: str):
+        """
+        S3上の JSON をパースして返す。同じクライアント内では一度だけダウンロード・パースする
+        """
+        if s3_key not in self._artifacts:
+            self._artifacts[s3_key] = json.loads(self.load_bytes(s3_key).decode("utf-8"))
+        return self._artifacts[s3_key]
+
     def load_csv_as_text(self, s3_key: str) -> str:
         """
         S3上の CSV (テキスト) をダウンロードして、文字列として返す
         """
-        buffer = BytesIO()
-        self.s3_client.download_fileobj(
-            Bucket=self.bucket_name,
-            Key=s3_key,
-            Fileobj=buffer
-        )
-        buffer.seek(0)
-        csv_text = buffer.read().decode("utf-8")
+        csv_text = self.load_bytes(s3_key).decode("utf-8")
         return csv_text
 
     def load_json_as_text(self, s3_key: str) -> str:
         """
         S3上の JSON (テキスト) をダウンロードして、文字列として返す
         """
-        buffer = BytesIO()
-        self.s3_client.download_fileobj(
-            Bucket=self.bucket_name,
-            Key=s3_key,
-            Fileobj=buffer
-        )
-        buffer.seek(0)
-        json_text = buffer.read().decode("utf-8")
+        json_text = self.load_bytes(s3_key).decode("utf-8")
         return json_text
 
-    def load_file_to_local(self, s3_key: str, local_path: str):
+    def load_file_to_local(self, s3_key: str, local_path: str, max_concurrency: int = None, part_size: int = None):
         """
         S3のファイルをローカルに保存する（CSV以外でも可）
+        大きいファイルはパートに分けて並列にダウンロードする
         """
+        part_size = part_size or S3_TRANSFER_PART_SIZE
+        config = TransferConfig(
+            multipart_threshold=part_size,
+            multipart_chunksize=part_size,
+            max_concurrency=max_concurrency or S3_TRANSFER_CONCURRENCY,
+            use_threads=True,
+        )
         self.s3_client.download_file(
             Bucket=self.bucket_name,
             Key=s3_key,
-            Filename=local_path
+            Filename=local_path,
+            Config=config
         )
         return local_path
@@ -0,0 +1,183 @@
+import os
+import re
+from abc import ABC, abstractmethod
+
+# 終了判定の方式（llm / local / marker）。WebSocket の入力 "terminationPolicy" で上書きできる。
+# デフォルトは従来どおり発言したモデルに確認する llm。local / marker は LLM の呼び出しを減らしたいときに指定する
+TERMINATION_POLICY = os.getenv("TERMINATION_POLICY", "llm")
+TERMINATION_SIMILARITY_THRESHOLD = float(os.getenv("TERMINATION_SIMILARITY_THRESHOLD", "0.6"))
+END_CHECK_CONTEXT_TOKENS = int(os.getenv("END_CHECK_CONTEXT_TOKENS", "1500"))
+
+AGREEMENT_KEYWORDS = (
+    "合意", "同意", "賛成", "異論はありません", "異論はない", "おっしゃる通り", "その通り",
+    "議論を終了", "終了しましょう", "結論として", "一致して",
+)
+DISAGREEMENT_KEYWORDS = ("反論", "矛盾", "異なり", "異なる", "しかし", "一方で", "疑問", "不十分", "再考", "納得できません")
+
+END_MARKER_PATTERN = re.compile(r"\[\[議論終了[:：]\s*(はい|いいえ)\s*\]\]")
+END_MARKER_PREFIX = "[[議論終了"
+END_MARKER_MAX_LENGTH = 20
+
+
+class TerminationPolicy(ABC):
+    """
+    議論を終了するかどうかの判定方法。
+    - prompt_instruction: 発言用プロンプトに追記する指示
+    - turn_filter: 発言テキストを加工するフィルタ（ストリーミング中の delta にも適用される）
+    - should_end: 発言のあとに呼ばれ、終了するなら True
+    """
+
+    name = ""
+
+    def prompt_instruction(self) -> str:
+        return ""
+
+    def turn_filter(self):
+        return None
+
+    @abstractmethod
+    async def should_end(self, speaker: str, response: str, memory) -> bool:
+        ...
+
+
+class LLMConfirmPolicy(TerminationPolicy):
+    """
+    発言したモデルに「議論は終了してもよいですか？」と追加で問い合わせる（従来の方式。1回ごとに LLM 呼び出しが増える）
+    """
+
+    name = "llm"
+
+    def __init__(self, ask):
+        """
+        :param ask: (発言者, プロンプト) を受け取り、その発言者のモデルの応答を返す async 関数
+        """
+        self.ask = ask
+
+    async def should_end(self, speaker: str, response: str, memory) -> bool:
+        confirm_end_prompt = f"""
+        これまでの議論（最後があなたの最新の発言です）:
+        {memory.render(END_CHECK_CONTEXT_TOKENS, include_topic=False)}
+
+        議論は終了してもよいですか？「はい」または「いいえ」で答えてください。
+        """
+        confirm_end_response = await self.ask(speaker, confirm_end_prompt)
+        return "はい" in confirm_end_response
+
+
+class LocalConvergencePolicy(TerminationPolicy):
+    """
+    LLM を呼ばずに、直近2発言の類似度と合意・反論のキーワードから収束を判定する
+    """
+
+    name = "local"
+
+    def __init__(self, similarity_threshold: float = TERMINATION_SIMILARITY_THRESHOLD):
+        self.similarity_threshold = similarity_threshold
+
+    async def should_end(self, speaker: str, response: str, memory) -> bool:
+        previous = memory.turns[-2][1] if len(memory.turns) >= 2 else ""
+        return self.converged(response, previous)
+
+    def converged(self, latest: str, previous: str) -> bool:
+        agreements = sum(latest.count(keyword) for keyword in AGREEMENT_KEYWORDS)
+        disagreements = sum(latest.count(keyword) for keyword in DISAGREEMENT_KEYWORDS)
+        similarity = bigram_similarity(latest, previous)
+        print(f"収束判定: 類似度 {similarity:.2f}, 合意 {agreements}, 反論 {disagreements}")
+        # 同じ内容の繰り返しになっている、または合意の表現が反論よりはっきり多い
+        return similarity >= self.similarity_threshold or (agreements >= 2 and agreements > 2 * disagreements)
+
+
+class MarkerPolicy(TerminationPolicy):
+    """
+    発言の末尾に [[議論終了: はい]] / [[議論終了: いいえ]] を書かせ、追加の呼び出しなしで判定する。
+    マーカーはクライアントへの送信・履歴から取り除く。マーカーがなければ fallback で判定する
+    """
+
+    name = "marker"
+
+    def __init__(self, fallback: TerminationPolicy = None):
+        self.fallback = fallback or LocalConvergencePolicy()
+        self._filter = None  # 直近の発言に使ったフィルタ（読み取ったマーカーを持つ）
+
+    def prompt_instruction(self) -> str:
+        return (
+            "発言の最後の行に、議論を終了してよいと考えるなら [[議論終了: はい]]、"
+            "続けるべきなら [[議論終了: いいえ]] とだけ書いてください。"
+        )
+
+    def turn_filter(self):
+        self._filter = EndMarkerFilter()
+        return self._filter
+
+    async def should_end(self, speaker: str, response: str, memory) -> bool:
+        decision = self._filter.decision if self._filter else None
+        if decision is None:
+            return await self.fallback.should_end(speaker, response, memory)
+        return decision
+
+
+class EndMarkerFilter:
+    """
+    発言テキストから終了マーカーを取り除く。ストリーミングではマーカーの書きかけの可能性がある末尾だけを保留する。
+    読み取ったマーカーは decision（True = 終了 / False = 続行 / None = マーカーなし）で参照できる
+    """
+
+    def __init__(self):
+        self.decision = None
+        self._pending = ""
+
+    def feed(self, delta: str) -> str:
+        """
+        delta を受け取り、送信してよいテキストを返す
+        """
+        text = self.__extract(self._pending + delta)
+        split = len(text)
+        for index in range(max(0, len(text) - END_MARKER_MAX_LENGTH), len(text)):
+            tail = text[index:]
+            if END_MARKER_PREFIX.startswith(tail) or tail.startswith(END_MARKER_PREFIX):
+                split = index
+                break
+        self._pending = text[split:]
+        return text[:split]
+
+    def finish(self) -> str:
+        """
+        保留していた残りを返す（マーカーが完成していなかった場合はそのまま出す）
+        """
+        text, self._pending = self.__extract(self._pending), ""
+        return text
+
+    # private
+    def __extract(self, text: str) -> str:
+        for match in END_MARKER_PATTERN.finditer(text):
+            self.decision = match.group(1) == "はい"
+        return END_MARKER_PATTERN.sub("", text)
+
+
+def bigram_similarity(a: str, b: str) -> float:
+    """
+    文字 2-gram の Jaccard 係数（0〜1）。空白は無視する
+    """
+    a, b = "".join(a.split()), "".join(b.split())
+    if len(a) < 2 or len(b) < 2:
+        return 0.0
+    grams_a = {a[i:i + 2] for i in range(len(a) - 1)}
+    grams_b = {b[i:i + 2] for i in range(len(b) - 1)}
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+
+def create_termination_policy(name: str = None, ask=None) -> TerminationPolicy:
+    """
+    名前（llm / local / marker）から判定方法を作る。不明な名前なら TERMINATION_POLICY を使う
+
+    :param ask: llm の場合に使う、(発言者, プロンプト) → 応答 の async 関数（なければ llm の代わりに marker）
+    """
+    name = (name or TERMINATION_POLICY).lower()
+    if name not in ("llm", "local", "marker"):
+        print(f"不明な終了判定方式のため {TERMINATION_POLICY} を使います: {name}")
+        name = TERMINATION_POLICY.lower()
+    if name == "local":
+        return LocalConvergencePolicy()
+    if name == "marker" or ask is None:
+        return MarkerPolicy()
+    return LLMConfirmPolicy(ask)
@@ -0,0 +1,70 @@
+import comment_analyzer
+from comment_analyzer import CommentAnalyzer
+
+CSV_TEXT = "text,like_count,published_at\nいい動画でした,10,2024-01-02T00:00:00Z\n参考になりました,3,2024-01-03T00:00:00Z\n"
+
+BUNDLE = {
+    "video_id": 1, "youtube_video_id": "main", "title": "タイトル", "description": "説明", "metadata": "{}",
+    "published_at": "2024-01-01 00:00:00", "is_sponsored": 1, "product_id": 7,
+    "channel_id": 2, "youtube_channel_id": "UC_main", "channel_title": "チャンネル", "channel_description": "",
+    "channel_metadata": "{}", "channel_published_at": "2020-01-01 00:00:00",
+    "prediction_age_13_17": 0.1, "prediction_age_18_24": 0.2, "prediction_age_25_34": 0.3, "prediction_age_35_44": 0.2,
+    "prediction_age_45_54": 0.1, "prediction_age_55_64": 0.05, "prediction_age_65_": 0.05, "prediction_rate": 40,
+}
+
+OTHER_VIDEO = {"youtube_video_id": "other", "title": "他の動画", "description": "", "metadata": "{}", "published_at": "2024-02-01"}
+
+
+class FakeDB:
+    def fetch_comment_analysis_bundle(self, youtube_video_id):
+        return BUNDLE
+
+    def fetch_video_stats_by_video_id(self, video_id, days):
+        return {"view_count": 100, "like_count": 10, "comment_count": 2}
+
+    def fetch_other_product_videos(self, product_id):
+        return [OTHER_VIDEO]
+
+    def fetch_youtube_channel_ids_by_youtube_video_ids(self, youtube_video_ids):
+        return {"other": "UC_other"}
+
+
+class FakeS3:
+    def __init__(self):
+        self.keys = []
+
+    def load_csv_as_text(self, s3_key):
+        self.keys.append(s3_key)
+        return CSV_TEXT
+
+    def get_many(self, s3_keys, max_workers=None):
+        self.keys.extend(s3_keys)
+        return {s3_key: CSV_TEXT.encode("utf-8") for s3_key in s3_keys}
+
+
+def test_create_data_for_sponsored_video(monkeypatch):
+    monkeypatch.setattr(comment_analyzer, "DBClient", FakeDB)
+    monkeypatch.setattr(comment_analyzer, "S3Client", FakeS3)
+    monkeypatch.setenv("COMMENT_STORE_ENABLED", "0")
+
+    analyzer = CommentAnalyzer("main")
+    data = analyzer.create_data()
+
+    # 対象動画のコメントと、スポンサード動画のコメントがそれぞれのセクションに入る
+    assert data["comment_data"] is not None
+    assert data["comment_stats"] is not None
+    assert data["other_sponsored_video_data"][0]["タイトル"] == "他の動画"
+    assert len(data["other_sponsored_video_comments"]) == 1
+    assert sorted(analyzer.s3.keys) == ["video_comments/UC_main/main.csv", "video_comments/UC_other/other.csv"]
+
+
+def test_missing_sponsored_comments_are_skipped(monkeypatch):
+    monkeypatch.setattr(comment_analyzer, "DBClient", FakeDB)
+    monkeypatch.setattr(comment_analyzer, "S3Client", FakeS3)
+    monkeypatch.setenv("COMMENT_STORE_ENABLED", "0")
+    monkeypatch.setattr(FakeS3, "get_many", lambda self, s3_keys, max_workers=None: dict.fromkeys(s3_keys))
+
+    data = CommentAnalyzer("main").create_data({"other_sponsored_video_comments"})
+
+    # get_many は存在しないCSVを None で返すので、そのセクションは空になる
+    assert data["other_sponsored_video_comments"] == []
@@ -0,0 +1,43 @@
+from io import BytesIO
+
+import pytest
+
+from comment_compactor import compact_comment_rows
+from comment_store import CommentStore, iter_rows
+
+pytest.importorskip("pyarrow")
+
+
+class FakeS3:
+    def __init__(self, body: bytes):
+        self.body = body
+
+    def head(self, s3_key):
+        return {"etag": '"v1"', "last_modified": None, "size": len(self.body)}
+
+    def open_stream(self, s3_key):
+        return BytesIO(self.body)
+
+
+def load(tmp_path, body: bytes):
+    return CommentStore(FakeS3(body), directory=str(tmp_path)).load_table("video_comments/UC/video.csv")
+
+
+def test_load_table(tmp_path):
+    table = load(tmp_path, "text,like_count\nいい動画,3\n\"改行\nあり\",1\n".encode("utf-8"))
+    assert table.column_names == ["text", "like_count"]
+    assert list(iter_rows(table)) == [["いい動画", "3"], ["改行\nあり", "1"]]
+
+
+def test_load_empty_csv(tmp_path):
+    table = load(tmp_path, b"")
+    assert table.num_rows == 0
+    assert compact_comment_rows(table.column_names, iter_rows(table), 100) is not None
+
+
+def test_load_header_only_csv(tmp_path):
+    table = load(tmp_path, b"text,like_count\n")
+    assert table.num_rows == 0
+    assert table.column_names == ["text", "like_count"]
+    # 2回目は保存済みのファイルを読む
+    assert load(tmp_path, b"text,like_count\n").column_names == ["text", "like_count"]
@@ -0,0 +1,25 @@
+import asyncio
+
+from debate_jobs import InMemoryJobStore
+
+
+def test_frames_with_limit():
+    async def scenario():
+        store = InMemoryJobStore()
+        job_id = await store.create({})
+        for index in range(3):
+            await store.append(job_id, {"text": str(index)})
+        await store.discard(job_id, [1])
+        return (
+            await store.frames(job_id, 0, 0),
+            await store.frames(job_id, 0, 1),
+            await store.frames(job_id, 1),
+            await store.frames(job_id, 5),
+        )
+
+    empty, first, rest, beyond = asyncio.run(scenario())
+    assert empty == ([], 0)
+    assert first == ([(0, {"text": "0"})], 1)
+    # 消したフレームの offset は欠番になる
+    assert rest == ([(2, {"text": "2"})], 3)
+    assert beyond == ([], 5)
@@ -0,0 +1,101 @@
+import uuid
+import asyncio
+
+import pytest
+
+import main
+from debate_jobs import DebateJobQueue, InMemoryJobStore
+from model_router import ModelRouter, ProviderError
+
+
+def failing_router() -> ModelRouter:
+    """
+    すべてのモデルが ProviderError を返すルーター
+    """
+    async def complete(prompt: str) -> str:
+        raise ProviderError("503 Service Unavailable")
+
+    async def stream(prompt: str):
+        raise ProviderError("503 Service Unavailable")
+        yield
+
+    router = ModelRouter()
+    for provider in ("openai", "gemini"):
+        router.register_provider(provider, 1)
+    for name, provider in (("gpt", "openai"), ("gpt_fast", "openai"), ("gemini", "gemini"), ("gemini_fast", "gemini")):
+        router.register_model(name, provider, name, None, complete, stream)
+    for route, models in (("gpt", ["gpt", "gpt_fast"]), ("gemini", ["gemini", "gemini_fast"]),
+                          ("gpt_cheap", ["gpt_fast", "gpt"]), ("gemini_cheap", ["gemini_fast", "gemini"])):
+        router.set_route(route, models)
+    return router
+
+
+async def run_job(params: dict):
+    queue = DebateJobQueue(main.run_debate, InMemoryJobStore(), workers=1)
+    await queue.start()
+    try:
+        job_id = await queue.submit(params)
+        frames = [frame async for _, frame in queue.follow(job_id)]
+        return await queue.store.get(job_id), frames
+    finally:
+        await queue.stop()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_failing_provider_fails_job(monkeypatch, stream):
+    monkeypatch.setattr(main, "model_router", failing_router())
+
+    job, frames = asyncio.run(run_job({"topic": "テスト", "stream": stream, "noCache": True}))
+
+    assert job["status"] == "failed"
+    assert "503" in job["error"]
+    # エラーは発言としてではなく、1つのシステムメッセージとして送られる
+    assert [frame["sender"] for frame in frames] == ["system"]
+
+
+def scripted_router(calls: list) -> ModelRouter:
+    """
+    GPT の通常モデルだけが失敗し、それ以外は毎回違う反論を返すルーター（収束しない）。呼ばれたモデル名を calls に記録する
+    """
+    def adapter(model: str, fail: bool):
+        async def complete(prompt: str) -> str:
+            calls.append(model)
+            if fail:
+                raise ProviderError("timeout")
+            return f"しかし反論があります: {uuid.uuid4().hex}"
+        return complete
+
+    router = ModelRouter()
+    for provider in ("openai", "gemini"):
+        router.register_provider(provider, 4)
+    router.register_model("gpt", "openai", "gpt-main", None, adapter("gpt-main", True))
+    router.register_model("gpt_fast", "openai", "gpt-small", None, adapter("gpt-small", False))
+    router.register_model("gemini", "gemini", "gemini-main", None, adapter("gemini-main", False))
+    router.register_model("gemini_fast", "gemini", "gemini-small", None, adapter("gemini-small", False))
+    for route, models in (("gpt", ["gpt", "gpt_fast"]), ("gemini", ["gemini", "gemini_fast"]),
+                          ("gpt_cheap", ["gpt_fast", "gpt"]), ("gemini_cheap", ["gemini_fast", "gemini"])):
+        router.set_route(route, models)
+    return router
+
+
+def test_turns_are_labelled_with_answering_model(monkeypatch):
+    calls = []
+    monkeypatch.setattr(main, "model_router", scripted_router(calls))
+
+    job, frames = asyncio.run(run_job({"topic": "テスト", "noCache": True, "terminationPolicy": "local"}))
+
+    assert job["status"] == "completed"
+    senders = [frame["sender"] for frame in frames]
+    # GPT はフォールバック先が答えたので、そのモデル名で表示される
+    assert "GPT:gpt-small" in senders and "GPT:gpt-main" not in senders
+    assert "Gemini:gemini-main" in senders
+    assert senders[-1] == "GPTまとめ"
+    # 両者が3回話した後の発言は速いモデルに回る
+    assert "gemini-small" in calls
+
+
+def test_frames_endpoint_rejects_zero_limit():
+    from fastapi.testclient import TestClient
+
+    client = TestClient(main.app)
+    assert client.get("/api/debates/unknown/frames", params={"limit": 0}).status_code == 422
@@ -0,0 +1,15 @@
+from termination_policy import LLMConfirmPolicy, LocalConvergencePolicy, MarkerPolicy, create_termination_policy
+
+
+async def ask(speaker: str, prompt: str) -> str:
+    return "はい"
+
+
+def test_default_policy_is_llm_judge():
+    assert isinstance(create_termination_policy(None, ask=ask), LLMConfirmPolicy)
+    assert isinstance(create_termination_policy("unknown", ask=ask), LLMConfirmPolicy)
+
+
+def test_other_policies_are_opt_in():
+    assert isinstance(create_termination_policy("local", ask=ask), LocalConvergencePolicy)
+    assert isinstance(create_termination_policy("marker", ask=ask), MarkerPolicy)
@@ -11,6 +11,14 @@ import { IconDownload, IconChevronDown } from '@tabler/icons-react';
 interface Message {
   sender: string; // 例: "User" | "GPT(3.5)" | "Gemini(2.0)" | "GPTまとめ"
   text: string;
+  turnId?: string; // ストリーミング時の発言ID
+}
+
+/** ✅ サーバーから届くフレーム（type なしは従来の1発言まるごと） */
+interface ServerFrame extends Message {
+  type?: "delta" | "turn_complete" | "error" | "job" | "job_end"; // error: モデル・サーバーのエラー（発言ではない）
+  jobId?: string; // type: "job" / "job_end" のときの議論ID
+  offset?: number; // 議論内のフレーム番号（再接続時にここから再開する）
 }
 
 export default function Magi() {
@@ -22,6 +30,8 @@ export default function Magi() {
   const [videoId, setVideoId] = useState("");
   const [channelId, setChannelId] = useState("");
   const messagesEndRef = useRef<HTMLDivElement | null>(null);
+  /** ✅ 進行中の議論と、受信済みの次のフレーム番号（切断後に続きから受け取るため） */
+  const jobRef = useRef<{ jobId: string; nextOffset: number } | null>(null);
 
   /** ✅ メッセージが追加されるたびにスクロール */
   const viewport = useRef<HTMLDivElement>(null);
@@ -37,19 +47,60 @@ export default function Magi() {
 
     const messageListener = (event: MessageEvent) => {
       try {
-        const data = JSON.parse(event.data) as Message;
-        setMessages((prev) => [...prev, data]);
+        const data = JSON.parse(event.data) as ServerFrame;
+        if (data.type === "job") {
+          // ✅ 再接続（同じ jobId）の場合は受信済みの位置を保つ
+          if (jobRef.current?.jobId !== data.jobId) {
+            jobRef.current = { jobId: data.jobId!, nextOffset: 0 };
+          }
+          return;
+        }
+        if (data.type === "job_end") {
+          jobRef.current = null;
+          setLoading(false);
+          return;
+        }
+        if (data.offset !== undefined && jobRef.current) {
+          if (data.offset < jobRef.current.nextOffset) return; // 受信済みのフレーム
+          jobRef.current.nextOffset = data.offset + 1;
+        }
+        if (data.type === "delta" || data.type === "turn_complete") {
+          // ✅ 同じ turnId の発言に差分を追記し、turn_complete で全文に置き換える
+          setMessages((prev) => {
+            const index = prev.findIndex((msg) => msg.turnId === data.turnId);
+            if (index === -1) {
+              return [...prev, { sender: data.sender, text: data.text, turnId: data.turnId }];
+            }
+            const next = [...prev];
+            const text = data.type === "delta" ? next[index].text + data.text : data.text;
+            next[index] = { ...next[index], text };
+            return next;
+          });
+        } else {
+          setMessages((prev) => [...prev, { sender: data.sender, text: data.text }]);
+        }
         setLoading(false);
       } catch (error) {
         console.error("メッセージのパースエラー:", error);
       }
     };
 
+    /** ✅ 議論の途中で切断された場合は、再接続後に続きのフレームから受け取る */
+    const openListener = () => {
+      if (jobRef.current && WebSocketManager.socketInstance) {
+        WebSocketManager.socketInstance.send(
+          JSON.stringify({ jobId: jobRef.current.jobId, offset: jobRef.current.nextOffset })
+        );
+      }
+    };
+
     WebSocketManager.addListener(messageListener);
+    WebSocketManager.addOpenListener(openListener);
     setIsConnected(true);
 
     return () => {
       WebSocketManager.removeListener(messageListener);
+      WebSocketManager.removeOpenListener(openListener);
     };
   }, []);
 
@@ -61,6 +112,7 @@ export default function Magi() {
         analysisType: analysisType !== "none" ? analysisType : undefined,
         videoId: analysisType === "comment_analysis" ? videoId : undefined,
         channelId: analysisType === "channel_subscriber_popular_channel" ? channelId : undefined,
+        stream: true,
       };
 
       console.log("送信データ:", payload);
@@ -84,7 +136,7 @@ export default function Magi() {
 
     return (
       <Group
-        key={`${msg.sender}-${msg.text}-${index}`}
+        key={msg.turnId ?? `${msg.sender}-${msg.text}-${index}`}
         align="flex-start"
         justify={isUser ? "flex-end" : "flex-start"}
         gap="xs"
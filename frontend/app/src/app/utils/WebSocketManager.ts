@@ -2,6 +2,7 @@ class WebSocketManager {
   private static instance: WebSocketManager;
   private socket: WebSocket | null = null;
   private listeners: ((message: MessageEvent) => void)[] = [];
+  private openListeners: (() => void)[] = [];
   private connectionStatus: boolean = false;
 
   private constructor() {}
@@ -24,6 +25,7 @@ class WebSocketManager {
     this.socket.onopen = () => {
       console.log("WebSocket: 接続成功");
       this.connectionStatus = true;
+      this.openListeners.forEach((listener) => listener()); // ✅ 再接続時の再開処理など
     };
 
     this.socket.onmessage = (event) => {
@@ -50,6 +52,15 @@ class WebSocketManager {
     this.listeners = this.listeners.filter((l) => l !== listener);
   }
 
+  /** ✅ 接続（再接続を含む）が確立したときに呼ばれるリスナー */
+  addOpenListener(listener: () => void) {
+    this.openListeners.push(listener);
+  }
+
+  removeOpenListener(listener: () => void) {
+    this.openListeners = this.openListeners.filter((l) => l !== listener);
+  }
+
   close() {
     if (this.socket) {
       this.socket.close();